@@ -1,19 +1,38 @@
 import streamlit as st
 import os
-import asyncio
-from pathlib import Path
 
-# Set environment variables from secrets
-os.environ["OPENAI_API_KEY"] = st.secrets["OPENAI_API_KEY"]
-os.environ["SCRAPFLY_KEY"] = st.secrets["SCRAPFLY_KEY"]
 
-# Import your existing functions
-from src.innorep.run_scrape import scrape
-from src.innorep.run_llm import main as run_analysis
-from src.innorep.create_pdf import main as create_pdf_report
+def load_secrets():
+    """Copies the API keys from the Streamlit secrets into the environment, unless the environment already has them."""
+    for name in ("OPENAI_API_KEY", "SCRAPFLY_KEY"):
+        if os.environ.get(name):
+            continue
+        try:
+            os.environ[name] = st.secrets[name]
+        except (KeyError, FileNotFoundError):
+            pass
+
+
+@st.cache_resource
+def get_job_queue():
+    """One job queue per server process, shared by every session, so identical requests are merged."""
+    from src.innorep.jobs import JobQueue
+
+    return JobQueue()
+
+
+@st.fragment(run_every=2)
+def show_progress(job_id):
+    """Polls the job every two seconds and reruns the page once it has finished."""
+    job = get_job_queue().get(job_id)
+    if job is None or job['status'] in ("done", "failed"):
+        st.rerun()
+    st.info(job['message'])
+    st.caption(f"Stage: {job['stage']}")
 
 
 def main():
+    load_secrets()
     st.title("InnoRep Analytical Report Generator")
 
     st.sidebar.title("Options")
@@ -21,46 +40,34 @@ def main():
     # Removed checkboxes for scraping and analysis
 
     if st.sidebar.button("Run"):
+        # The report is built in the background; an in-flight or fresh report of the same profile is reused
         try:
-            # Scrape Instagram data
-            st.write(f"Scraping Instagram profile: {username}")
-            with st.spinner("Scraping data..."):
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(scrape(username))
-            st.success("Scraping completed.")
-
-            # Analyze comments
-            st.write("Analyzing comments...")
-            with st.spinner("Analyzing data..."):
-                run_analysis(username)
-            st.success("Analysis completed.")
-
-            # Generate PDF report
-            st.write("Generating PDF report...")
-            with st.spinner("Creating PDF report..."):
-                # Define the output path for the PDF
-                report_dir = Path(__file__).resolve().parent / 'report' / 'reports'
-                report_dir.mkdir(parents=True, exist_ok=True)
-                output_pdf = report_dir / f'{username}_innorep_report.pdf'
-                create_pdf_report(username, str(output_pdf))
-            st.success("Report generated.")
-
-            # Display the generated report
-            if output_pdf.exists():
-                st.write("Generated Report:")
-                with output_pdf.open("rb") as f:
-                    st.download_button(
-                        label="Download Report",
-                        data=f.read(),
-                        file_name=f"{username}_innorep_report.pdf",
-                        mime="application/pdf"
-                    )
-            else:
-                st.error("Report not found.")
-        except Exception as e:
+            st.session_state['job_id'] = get_job_queue().submit(username)
+        except ValueError as e:
             st.error(f"An error occurred: {e}")
 
+    job_id = st.session_state.get('job_id')
+    job = get_job_queue().get(job_id) if job_id else None
+    if job is None:
+        return
+    if job['status'] == "failed":
+        st.error(f"An error occurred: {job['error']}")
+    elif job['status'] == "done":
+        st.success(job['message'])
+        pdf_bytes = get_job_queue().load_pdf(job_id)
+        if pdf_bytes:
+            st.write("Generated Report:")
+            st.download_button(
+                label="Download Report",
+                data=pdf_bytes,
+                file_name=f"{job['username']}_innorep_report.pdf",
+                mime="application/pdf"
+            )
+        else:
+            st.error("Report not found.")
+    else:
+        show_progress(job_id)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,198 @@
+"""
+End-to-end benchmark of the scrape, analysis, aggregation and PDF stages on synthetic accounts, fully offline.
+
+    $ python -m benchmarks.bench_e2e [--sizes 1k 10k 100k] [--save baseline.json] [--compare baseline.json]
+    $ python -m benchmarks.bench_e2e --pages benchmarks/recorded/bench_pages.jsonl
+
+Scrapfly is replaced by ReplayScrapfly serving synthetic GraphQL pages and OpenAI by a local FakeOpenAIServer.
+With --pages, the account of responses saved by RecordingScrapfly is replayed instead of the synthetic sizes
+and reported as "recorded". For each account size and stage it reports comments per second and the peak memory
+the stage allocated (tracemalloc, measured in a second pass so that tracing does not slow the timed one).
+With --compare, a stage whose throughput falls or whose peak memory grows by more than --tolerance against the
+saved baseline is a regression, and the exit code is 1.
+
+The Makefile targets bench, bench-baseline and bench-replay wrap these runs; CI runs them on every pull request.
+"""
+import io
+import gc
+import sys
+import json
+import time
+import asyncio
+import argparse
+import warnings
+import tempfile
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+from contextlib import redirect_stdout
+from typing import Any, Callable
+
+from loguru import logger
+
+from benchmarks.fakes import FakeOpenAIServer, ReplayScrapfly, load_pages, recorded_username
+from benchmarks.fixtures import account_pages
+from src.innorep import chart_renderer, create_pdf, run_llm
+from src.innorep.analyze.analyze import analyze_comments, calculate_metrics, create_openai_client
+from src.innorep.analyze.prepare import aggregate
+from src.innorep.analyze.ratelimit import RateLimiter
+from src.innorep.scrape import instagram
+from src.innorep.serialization import write_json
+
+STAGES = ("scrape", "analyze", "aggregate", "pdf")
+
+
+def parse_size(value: str) -> int:
+    """Account sizes such as 1000, 10k or 0.1m."""
+    multiplier = {"k": 1_000, "m": 1_000_000}.get(value[-1].lower(), 1)
+    return int(float(value[:-1] if multiplier > 1 else value) * multiplier)
+
+
+def size_label(comments: int) -> str:
+    return f"{comments // 1000}k" if comments >= 1000 and comments % 1000 == 0 else str(comments)
+
+
+def measure(run: Callable[[], Any], memory: bool) -> tuple[Any, float, float | None]:
+    """Runs a stage once timed and, with `memory`, once more under tracemalloc. Returns result, seconds, peak MiB."""
+    gc.collect()
+    started = time.perf_counter()
+    result = run()
+    seconds = time.perf_counter() - started
+    peak = None
+    if memory:
+        gc.collect()
+        tracemalloc.start()
+        try:
+            run()
+            peak = tracemalloc.get_traced_memory()[1] / 2 ** 20
+        finally:
+            tracemalloc.stop()
+    return result, seconds, peak
+
+
+def bench_account(username: str, pages: dict[str, bytes], server: FakeOpenAIServer, args) -> dict:
+    """Runs every stage for the account served by `pages`. Returns the measurements keyed by stage."""
+    instagram.SCRAPFLY = ReplayScrapfly(pages, latency=args.scrape_latency)
+
+    async def scrape():
+        user = await instagram.scrape_user(username)
+        return [post async for post in instagram.scrape_user_posts(user["id"], max_comments=None)]
+
+    async def analyze(scraped_comments):
+        client = create_openai_client(base_url=server.base_url, api_key="bench", max_retries=0)
+        limiter = RateLimiter(requests_per_minute=server.settings["requests_per_minute"],
+                              tokens_per_minute=server.settings["tokens_per_minute"], base_delay=0.1)
+        try:
+            return await analyze_comments(scraped_comments, concurrency=args.concurrency, client=client,
+                                          mode=args.mode, pack_size=args.pack_size, limiter=limiter)
+        finally:
+            await client.close()
+
+    def build_pdf(output_pdf):
+        # A fresh renderer for every pass, so the charts are rendered and not taken from the render cache
+        chart_renderer._default_renderer = None
+        create_pdf.main(username, output_pdf)
+
+    measurements = {}
+
+    def record(stage: str, run: Callable[[], Any], count: Callable[[Any], int]) -> Any:
+        result, seconds, peak = measure(run, args.memory)
+        items = count(result)
+        measurements[stage] = {"items": items, "seconds": seconds, "per_second": items / seconds if seconds else 0.0,
+                               "peak_mib": peak}
+        return result
+
+    posts = record("scrape", lambda: asyncio.run(scrape()),
+                   lambda scraped: sum(len(post.get("comments") or []) for post in scraped))
+    scraped_comments = [comment for post in posts for comment in post.get("comments") or []]
+    results = record("analyze", lambda: asyncio.run(analyze(scraped_comments)), len)
+    record("aggregate", lambda: aggregate(results, datetime(2023, 1, 1), datetime.now()), lambda _: len(results))
+
+    analysis_file = run_llm.output_dir / f"analysis_{username}.json"
+    write_json(analysis_file, {"username": username, "metrics": calculate_metrics(results), "llm_results": results,
+                               "run_stats": {}, "timestamp": datetime.now().isoformat()})
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            output_pdf = Path(directory) / f"{username}.pdf"
+            record("pdf", lambda: build_pdf(output_pdf), lambda _: len(results))
+    finally:
+        analysis_file.unlink()
+    return measurements
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Lines describing every stage that got slower or bigger than the baseline by more than `tolerance`."""
+    regressions = []
+    for label, stages in results.items():
+        for stage, current in stages.items():
+            previous = baseline.get(label, {}).get(stage)
+            if not previous:
+                continue
+            if current["per_second"] < previous["per_second"] * (1 - tolerance):
+                regressions.append(f"{label} {stage}: {current['per_second']:.0f} comments/s, "
+                                   f"was {previous['per_second']:.0f} comments/s")
+            if current["peak_mib"] and previous.get("peak_mib") and \
+                    current["peak_mib"] > previous["peak_mib"] * (1 + tolerance):
+                regressions.append(f"{label} {stage}: peak {current['peak_mib']:.1f} MiB, "
+                                   f"was {previous['peak_mib']:.1f} MiB")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--sizes", nargs="+", default=["1k", "10k", "100k"], help="Comments per account")
+    parser.add_argument("--pages", type=Path, help="Replay the account of these recorded Scrapfly responses "
+                                                    "(JSON lines) instead of the synthetic sizes")
+    parser.add_argument("--scrape-latency", type=float, default=0.0, help="Seconds per replayed scrape request")
+    parser.add_argument("--llm-latency", type=float, default=0.02, help="Seconds per fake OpenAI request")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of OpenAI requests failing with 500")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Share of OpenAI requests getting a 429")
+    parser.add_argument("--mode", choices=["live", "packed"], default="packed")
+    parser.add_argument("--pack-size", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=30)
+    parser.add_argument("--no-memory", dest="memory", action="store_false", help="Skip the tracemalloc passes")
+    parser.add_argument("--save", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="Compare with results saved earlier")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative regression")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the stages")
+    args = parser.parse_args(argv)
+    logger.remove()  # the scraper logs every post
+    warnings.simplefilter("ignore", FutureWarning)  # pandas frequency aliases, once per aggregation
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else {}
+    recorded = load_pages(args.pages) if args.pages else None
+    if recorded:
+        sizes = {"recorded": None}
+    else:
+        sizes = {size_label(comments): comments for comments in map(parse_size, args.sizes)}
+    results = {}
+    with FakeOpenAIServer(latency=args.llm_latency, error_rate=args.error_rate,
+                          rate_limit_rate=args.rate_limit_rate) as server:
+        for label, comments in sizes.items():
+            username = recorded_username(recorded) if recorded else f"bench_{label}"
+            pages = recorded or account_pages(username, comments)
+            output = sys.stdout if args.verbose else io.StringIO()
+            with redirect_stdout(output):
+                results[label] = bench_account(username, pages, server, args)
+            for stage in STAGES:
+                data = results[label][stage]
+                line = f"{label:>5} {stage:<10} {data['seconds']:8.2f}s {data['per_second']:10.0f} comments/s"
+                if data["peak_mib"] is not None:
+                    line += f"  peak {data['peak_mib']:7.1f} MiB"
+                previous = baseline.get(label, {}).get(stage)
+                if previous:
+                    speedup = data['per_second'] / previous['per_second']
+                    line += f"  (was {previous['per_second']:.0f}/s, {speedup:.2f}x)"
+                print(line)
+        print(f"Fake OpenAI server: {server.stats()}")
+
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+"""
+Cold-start import time of each entry point, measured in fresh interpreters with `python -X importtime`.
+
+    $ python -m benchmarks.bench_import [--repeat 5] [--save baseline.json] [--compare baseline.json]
+
+Reports the best wall time per entry point and the heaviest top-level packages it pulled in.
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from pathlib import Path
+
+ENTRY_POINTS = [
+    "app",
+    "src.innorep.run_scrape",
+    "src.innorep.run_llm",
+    "src.innorep.pipeline",
+    "src.innorep.batch_runner",
+    "src.innorep.create_pdf",
+    "src.innorep.storage",
+]
+HEAVY_PACKAGES = ["streamlit", "pandas", "numpy", "matplotlib", "seaborn", "reportlab", "openai", "httpx", "scrapfly",
+                  "pydantic", "jmespath"]
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def measure(module: str) -> tuple[float, dict[str, float]]:
+    """Imports `module` in a new interpreter. Returns the wall time and the cumulative import time per package."""
+    started = time.perf_counter()
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True, env={**os.environ, "PYTHONPATH": str(ROOT)},
+    )
+    elapsed = time.perf_counter() - started
+    if process.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{process.stderr.splitlines()[-1]}")
+    packages = {}
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        if name.strip() in HEAVY_PACKAGES and cumulative.strip().isdigit():
+            packages[name.strip()] = int(cumulative) / 1e6
+    return elapsed, packages
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--save", type=Path, help="Write the results to this JSON file")
+    parser.add_argument("--compare", type=Path, help="Compare with results saved earlier")
+    parser.add_argument("modules", nargs="*", default=ENTRY_POINTS)
+    args = parser.parse_args(argv)
+
+    baseline = json.loads(args.compare.read_text()) if args.compare else {}
+    results = {}
+    for module in args.modules:
+        runs = [measure(module) for _ in range(args.repeat)]
+        best, packages = min(runs, key=lambda run: run[0])
+        results[module] = best
+        heavy = ", ".join(f"{name} {seconds:.2f}s" for name, seconds in
+                          sorted(packages.items(), key=lambda item: -item[1])[:4]) or "-"
+        line = f"{module:<28} {best:6.2f}s"
+        if module in baseline:
+            line += f"  (was {baseline[module]:.2f}s, {baseline[module] / best:.1f}x)"
+        print(f"{line}  loads: {heavy}")
+    if args.save:
+        args.save.write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""
+Posts parsed per second by scrape/instagram.py: jmespath.search with the expression string (as before),
+the precompiled expressions and the hand-written extractors. Also checks that all three agree.
+
+    $ python -m benchmarks.bench_parsing [--posts 2000] [--fixtures DIR]
+
+With --fixtures, recorded posts query responses (data.user.edge_owner_to_timeline_media) are used instead of
+synthetic pages.
+"""
+import time
+import argparse
+from pathlib import Path
+
+import jmespath
+from loguru import logger
+
+from benchmarks.fixtures import load_fixtures, posts_page
+from src.innorep.scrape import instagram
+
+
+def parse_with_strings(node: dict) -> dict:
+    """The previous parse_post: the expression strings are handed to jmespath.search on every call."""
+    result = jmespath.search(instagram.POST_EXPRESSION.expression, node)
+    comments = (instagram.COMMENTS_EXPRESSION if "edge_media_to_comment" in node
+                else instagram.PARENT_COMMENTS_EXPRESSION)
+    result.update(jmespath.search(comments.expression, node))
+    return result
+
+
+def edge_cases() -> list[dict]:
+    """Nodes with missing, null and oddly shaped fields, where jmespath semantics matter."""
+    return [
+        {"shortcode": "empty"},
+        {"shortcode": "nulls", "location": None, "edge_media_to_caption": None,
+         "edge_media_to_comment": {"count": 0, "edges": None, "page_info": None}},
+        {"shortcode": "odd", "location": ["x"], "edge_media_to_caption": {"edges": [None, {"node": None},
+                                                                              [{"node": {"text": "nested"}}], "s"]},
+         "edge_media_to_comment": {"edges": [{"node": None}, {"node": "text"}, {"node": {"owner": None}}]}},
+        {"shortcode": "parent", "edge_media_to_parent_comment": {"count": 1, "edges": [
+            {"node": {"id": "1", "text": "a", "owner": {"username": "u"}, "edge_liked_by": None}}]}},
+    ]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--posts", type=int, default=2000)
+    parser.add_argument("--comments", type=int, default=24, help="Comments preloaded per synthetic post")
+    parser.add_argument("--fixtures", type=Path, help="Directory of recorded posts query responses")
+    args = parser.parse_args(argv)
+    logger.remove()  # parse_post logs every post at debug level
+
+    if args.fixtures:
+        pages = load_fixtures(args.fixtures)
+    else:
+        pages = [posts_page(start, 50, args.posts, comments=args.comments) for start in range(0, args.posts, 50)]
+    nodes = [edge["node"] for page in pages for edge in page["data"]["user"]["edge_owner_to_timeline_media"]["edges"]]
+
+    for node in nodes[:200] + edge_cases():
+        expected = parse_with_strings(node)
+        assert instagram.parse_post(node, fast=False) == expected, node.get("shortcode")
+        assert instagram.parse_post(node) == expected, node.get("shortcode")
+        assert list(instagram.parse_post(node)) == list(expected)
+
+    print(f"{len(nodes)} posts")
+    baseline = None
+    for label, parse in [
+        ("jmespath.search(string)", parse_with_strings),
+        ("compiled expressions", lambda node: instagram.parse_post(node, fast=False)),
+        ("hand-written extractors", instagram.parse_post),
+    ]:
+        started = time.perf_counter()
+        for node in nodes:
+            parse(node)
+        rate = len(nodes) / (time.perf_counter() - started)
+        baseline = baseline or rate
+        print(f"  {label:<26} {rate:10.0f} posts/s  ({rate / baseline:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+Compares the JSON files written before (stdlib json, indent=2) with the serialization module on a synthetic
+account of 50k comments: writing and reading the all-user-posts and analysis files and decoding Scrapfly pages.
+
+    $ python -m benchmarks.bench_serialization [--comments 50000] [--backend orjson]
+"""
+import json
+import time
+import random
+import argparse
+import tempfile
+from pathlib import Path
+
+from src.innorep import serialization
+from src.innorep.analyze.records import CommentResults
+
+WORDS = ["great", "post", "love", "this", "🔥", "nice", "check", "my", "page", "wow", "ça", "va", "👏", "amazing"]
+
+
+def synthetic_account(comments: int, comments_per_post: int = 100, seed: int = 0):
+    """Posts in the all-user-posts layout and the matching classification results."""
+    rng = random.Random(seed)
+    posts, entries = [], []
+    for post_index in range(max(1, comments // comments_per_post)):
+        post_comments = []
+        for comment_index in range(comments_per_post):
+            comment = {
+                "id": f"{post_index}_{comment_index}",
+                "text": " ".join(rng.choices(WORDS, k=rng.randint(1, 12))),
+                "created_at": 1_700_000_000 + post_index * 3600 + comment_index,
+                "owner": f"user{rng.randint(0, 10_000)}",
+                "owner_verified": False,
+                "viewer_has_liked": False,
+                "likes": rng.randint(0, 50),
+            }
+            post_comments.append(comment)
+            entries.append({
+                "id": comment["id"], "created_at": comment["created_at"], "comment": comment["text"],
+                "sentiment": rng.choice(["positive", "neutral", "negative"]),
+                "spam": rng.choice(["spam", "not_spam"]), "source": "llm",
+            })
+        posts.append({
+            "id": str(post_index), "shortcode": f"sc{post_index}", "src": "https://example.com/p.jpg",
+            "video_url": None, "views": None, "likes": rng.randint(0, 5000), "taken_at": 1_700_000_000 + post_index,
+            "captions": ["caption " * 10], "comments_count": comments_per_post, "comments_next_page": None,
+            "comments": post_comments,
+        })
+    return posts, CommentResults.from_dicts(entries)
+
+
+def timed(label: str, function, repeat: int = 3) -> float:
+    best = min(_once(function) for _ in range(repeat))
+    print(f"  {label:<28} {best * 1000:8.1f} ms")
+    return best
+
+
+def _once(function) -> float:
+    started = time.perf_counter()
+    function()
+    return time.perf_counter() - started
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument("--comments", type=int, default=50_000)
+    parser.add_argument("--backend", choices=list(serialization.BACKENDS), default=None)
+    args = parser.parse_args(argv)
+
+    serialization.set_backend(args.backend)
+    posts, results = synthetic_account(args.comments)
+    posts_doc = {"posts_all": posts, "username": "bench", "timestamp": "2024-01-01T00:00:00"}
+    analysis_doc = {"username": "bench", "metrics": {}, "llm_results": results, "run_stats": {}, "timestamp": ""}
+    page = json.dumps({"data": {"user": {"edge_owner_to_timeline_media": {"edges": [{"node": post} for post in posts]}}}})
+
+    with tempfile.TemporaryDirectory() as directory:
+        old_posts, new_posts = Path(directory) / "old_posts.json", Path(directory) / "new_posts.json"
+        old_analysis, new_analysis = Path(directory) / "old_analysis.json", Path(directory) / "new_analysis.json"
+
+        print(f"{args.comments} comments in {len(posts)} posts")
+        print("stdlib json, indent=2 (previous files):")
+        old = [
+            timed("write posts", lambda: old_posts.write_text(
+                json.dumps(posts_doc, indent=2, ensure_ascii=False), encoding='utf-8')),
+            timed("write analysis", lambda: old_analysis.write_text(
+                json.dumps({**analysis_doc, "llm_results": results.to_dicts()}, indent=2, ensure_ascii=False),
+                encoding='utf-8')),
+            timed("read posts", lambda: json.loads(old_posts.read_text(encoding='utf-8'))),
+            timed("decode response page", lambda: json.loads(page)),
+        ]
+        print(f"serialization ({serialization.backend}, compact, streamed):")
+        new = [
+            timed("write posts", lambda: serialization.write_json(new_posts, posts_doc)),
+            timed("write analysis", lambda: serialization.write_json(new_analysis, analysis_doc)),
+            timed("read posts", lambda: serialization.read_json(new_posts)),
+            timed("decode response page", lambda: serialization.loads(page)),
+        ]
+        assert serialization.read_json(new_posts) == json.loads(old_posts.read_text(encoding='utf-8'))
+        assert serialization.read_json(new_analysis) == json.loads(old_analysis.read_text(encoding='utf-8'))
+        print(f"file size: posts {old_posts.stat().st_size // 1024} -> {new_posts.stat().st_size // 1024} KiB, "
+              f"analysis {old_analysis.stat().st_size // 1024} -> {new_analysis.stat().st_size // 1024} KiB")
+        print(f"total: {sum(old) * 1000:.0f} ms -> {sum(new) * 1000:.0f} ms ({sum(old) / sum(new):.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+"""
+Offline stand-ins for the two paid services, so every stage can be benchmarked without keys or network.
+
+`ReplayScrapfly` answers the scraper from a dict of recorded (or synthetic, see fixtures.account_pages) responses
+keyed by URL; set it as `instagram.SCRAPFLY`. `RecordingScrapfly` wraps the real client and saves what it
+receives in the same format, for replaying later.
+
+`FakeOpenAIServer` is a local HTTP server in its own process that speaks the chat completions API with
+structured outputs. It answers both the single-comment and the packed schema with deterministic labels, and can
+add latency, server errors and 429s with a retry-after header. Point a client at it with
+`create_openai_client(base_url=server.base_url, api_key="bench")`.
+"""
+import json
+import time
+import zlib
+import random
+import asyncio
+import threading
+import multiprocessing
+import urllib.request
+from pathlib import Path
+from types import SimpleNamespace
+from typing import Optional
+from urllib.parse import parse_qs, urlsplit
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+SENTIMENTS = ("positive", "neutral", "negative")
+
+
+def load_pages(path: Path) -> dict[str, bytes]:
+    """Responses saved by RecordingScrapfly: one JSON line per request with its url and content."""
+    pages = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                pages[record["url"]] = record["content"].encode('utf-8')
+    return pages
+
+
+def save_pages(pages: dict[str, bytes], path: Path) -> None:
+    """Writes responses keyed by URL in the format of RecordingScrapfly, for `load_pages`."""
+    with open(path, 'w', encoding='utf-8') as f:
+        for url, content in pages.items():
+            f.write(json.dumps({"url": url, "content": content.decode('utf-8')}, ensure_ascii=False) + "\n")
+
+
+def recorded_username(pages: dict[str, bytes]) -> str:
+    """The account whose profile request is among the responses."""
+    for url in pages:
+        if "/web_profile_info/" in url:
+            return parse_qs(urlsplit(url).query)["username"][0]
+    raise ValueError("The responses do not include a web_profile_info request")
+
+
+class ReplayScrapfly:
+    """Serves scrape requests from recorded responses, optionally after a fixed delay per request."""
+
+    def __init__(self, pages: dict[str, bytes], latency: float = 0.0):
+        self.pages = pages
+        self.latency = latency
+        self.requests = 0
+
+    async def async_scrape(self, config):
+        self.requests += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        try:
+            content = self.pages[config.url]
+        except KeyError:
+            raise KeyError(f"No recorded response for {config.url}") from None
+        return SimpleNamespace(content=content)
+
+
+class RecordingScrapfly:
+    """Passes requests to a real ScrapflyClient and appends every response to a JSON lines file."""
+
+    def __init__(self, client, path: Path):
+        self.client = client
+        self.path = Path(path)
+
+    async def async_scrape(self, config):
+        result = await self.client.async_scrape(config)
+        content = result.content if isinstance(result.content, str) else result.content.decode('utf-8')
+        with open(self.path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps({"url": config.url, "content": content}, ensure_ascii=False) + "\n")
+        return result
+
+
+def labels(text: str) -> dict:
+    """Deterministic sentiment and spam labels of a comment text."""
+    digest = zlib.crc32(text.encode('utf-8'))
+    return {"sentiment": SENTIMENTS[digest % 3], "spam": "spam" if digest % 10 == 0 else "not_spam"}
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    # Headers and body go out in one segment, so keep-alive requests do not wait for delayed ACKs
+    wbufsize = 1 << 16
+    disable_nagle_algorithm = True
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status: int, body: dict, headers: Optional[dict] = None) -> None:
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/stats"):
+            with self.server.lock:
+                self._send(200, dict(self.server.stats))
+        else:
+            self._send(404, {"error": {"message": "not found", "type": "invalid_request_error"}})
+
+    def do_POST(self):
+        request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        settings = self.server.settings
+        time.sleep(settings["latency"])
+        outcome = random.random()
+        if outcome < settings["rate_limit_rate"]:
+            self._count("rate_limited")
+            self._send(429, {"error": {"message": "Rate limit reached", "type": "requests",
+                                       "code": "rate_limit_exceeded"}},
+                       {"retry-after-ms": str(int(settings["retry_after"] * 1000))})
+            return
+        if outcome < settings["rate_limit_rate"] + settings["error_rate"]:
+            self._count("errors")
+            self._send(500, {"error": {"message": "The server had an error", "type": "server_error"}})
+            return
+
+        messages = request["messages"]
+        schema = request.get("response_format", {}).get("json_schema", {}).get("name")
+        if schema == "PackedCommentAnalyses":
+            items = json.loads(messages[-1]["content"])
+            answer = {"results": [{"id": item["id"], **labels(item["text"])} for item in items]}
+        else:
+            answer = labels(messages[-1]["content"].removeprefix(" Comment: "))
+        content = json.dumps(answer)
+        prompt_tokens = sum(len(message["content"]) // 4 + 4 for message in messages)
+        completion_tokens = len(content) // 4
+        self._count("completions")
+        self._send(200, {
+            "id": f"chatcmpl-{random.getrandbits(48):x}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request["model"],
+            "choices": [{"index": 0, "finish_reason": "stop", "logprobs": None,
+                         "message": {"role": "assistant", "content": content, "refusal": None}}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }, {
+            "x-ratelimit-limit-requests": str(settings["requests_per_minute"]),
+            "x-ratelimit-remaining-requests": str(settings["requests_per_minute"] - 1),
+            "x-ratelimit-limit-tokens": str(settings["tokens_per_minute"]),
+            "x-ratelimit-remaining-tokens": str(settings["tokens_per_minute"] - prompt_tokens),
+        })
+
+    def _count(self, key: str) -> None:
+        with self.server.lock:
+            self.server.stats["requests"] += 1
+            self.server.stats[key] += 1
+
+
+class _Server(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # a client pool opens its connections at once; the default backlog of 5 drops them
+
+
+def _serve(settings: dict, connection) -> None:
+    random.seed(settings["seed"])
+    server = _Server(("127.0.0.1", 0), _Handler)
+    server.settings = settings
+    server.lock = threading.Lock()
+    server.stats = {"requests": 0, "completions": 0, "errors": 0, "rate_limited": 0}
+    connection.send(server.server_address[1])
+    server.serve_forever()
+
+
+class FakeOpenAIServer:
+    """
+    A fake chat completions endpoint running in a child process, so it does not compete with the measured code
+    for the GIL.
+
+    :param latency: Seconds each request takes.
+    :param error_rate: Share of requests answered with a 500.
+    :param rate_limit_rate: Share of requests answered with a 429 carrying retry-after-ms of `retry_after` seconds.
+    :param requests_per_minute: Reported in the x-ratelimit-* headers.
+    :param tokens_per_minute: Reported in the x-ratelimit-* headers.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.02,
+        error_rate: float = 0.0,
+        rate_limit_rate: float = 0.0,
+        retry_after: float = 0.05,
+        requests_per_minute: int = 1_000_000,
+        tokens_per_minute: int = 1_000_000_000,
+        seed: int = 0
+    ):
+        self.settings = {
+            "latency": latency, "error_rate": error_rate, "rate_limit_rate": rate_limit_rate,
+            "retry_after": retry_after, "requests_per_minute": requests_per_minute,
+            "tokens_per_minute": tokens_per_minute, "seed": seed,
+        }
+        self.port = None
+        self._process = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}/v1"
+
+    def start(self) -> "FakeOpenAIServer":
+        receiver, sender = multiprocessing.Pipe(duplex=False)
+        self._process = multiprocessing.Process(target=_serve, args=(self.settings, sender), daemon=True)
+        self._process.start()
+        self.port = receiver.recv()
+        return self
+
+    def stats(self) -> dict:
+        """Requests answered so far, by outcome."""
+        with urllib.request.urlopen(f"{self.base_url}/stats") as response:
+            return json.loads(response.read())
+
+    def stop(self) -> None:
+        if self._process is not None:
+            self._process.terminate()
+            self._process.join()
+            self._process = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,174 @@
+"""
+Synthetic Instagram GraphQL responses in the shapes the scraper reads, for benchmarks.
+
+Recorded responses can be used instead: `load_fixtures` reads every *.json file of a directory.
+`account_pages` renders every response of a whole synthetic account, keyed by the URL the scraper requests.
+
+    $ python -m benchmarks.fixtures benchmarks/recorded/bench_pages.jsonl [--comments 200]
+
+writes such an account in the format of RecordingScrapfly, as the committed replay set was made.
+"""
+import sys
+import json
+import random
+import argparse
+from pathlib import Path
+from typing import Optional
+from urllib.parse import quote
+
+WORDS = ["great", "post", "love", "this", "🔥", "nice", "check", "my", "page", "wow", "ça", "va", "👏", "amazing"]
+
+
+def _text(rng: random.Random, words: int = 12) -> str:
+    return " ".join(rng.choices(WORDS, k=rng.randint(1, words)))
+
+
+def comment_node(rng: random.Random, post_index: int, comment_index: int, parent: bool = False) -> dict:
+    node = {
+        "id": f"{post_index}_{comment_index}",
+        "text": _text(rng),
+        "created_at": 1_700_000_000 - post_index * 3600 + comment_index,
+        "did_report_as_spam": False,
+        "owner": {
+            "id": str(rng.randint(1, 10 ** 9)),
+            "is_verified": rng.random() < 0.05,
+            "profile_pic_url": "https://example.com/pic.jpg",
+            "username": f"user{rng.randint(0, 10_000)}",
+        },
+        "viewer_has_liked": False,
+    }
+    if parent:
+        node["edge_liked_by"] = {"count": rng.randint(0, 100)}
+        node["edge_threaded_comments"] = {"count": 0, "page_info": {"has_next_page": False, "end_cursor": None}}
+    return node
+
+
+def post_node(rng: random.Random, index: int, comments: int = 3, total_comments: Optional[int] = None) -> dict:
+    total_comments = comments if total_comments is None else total_comments
+    return {
+        "__typename": "GraphImage",
+        "id": str(index),
+        "shortcode": f"sc{index}",
+        "dimensions": {"height": 1080, "width": 1080},
+        "display_url": f"https://example.com/{index}.jpg",
+        "thumbnail_src": f"https://example.com/{index}_thumb.jpg",
+        "media_preview": None,
+        "video_url": None,
+        "is_video": False,
+        "product_type": None,
+        "taken_at_timestamp": 1_700_000_000 - index * 3600,
+        "comments_disabled": False,
+        "location": {"id": "1", "name": "Somewhere"} if rng.random() < 0.3 else None,
+        "edge_media_preview_like": {"count": rng.randint(0, 5000), "edges": []},
+        "edge_media_to_caption": {"edges": [{"node": {"text": _text(rng, 40)}}]},
+        "edge_media_to_tagged_user": {"edges": [
+            {"node": {"user": {"username": f"tagged{rng.randint(0, 100)}", "full_name": ""}}}
+            for _ in range(rng.randint(0, 3))
+        ]},
+        "edge_media_to_comment": {
+            "count": total_comments,
+            "page_info": {"has_next_page": total_comments > comments,
+                          "end_cursor": f"c{comments}" if total_comments > comments else None},
+            "edges": [{"node": comment_node(rng, index, j)} for j in range(comments)],
+        },
+    }
+
+
+def posts_page(start: int, count: int, total: int, comments: int = 3, total_comments: Optional[int] = None,
+               seed: int = 0) -> dict:
+    """A page of the user posts query, with `comments` comments preloaded per post."""
+    rng = random.Random(seed * 1_000_003 + start)
+    end = min(start + count, total)
+    return {"data": {"user": {"edge_owner_to_timeline_media": {
+        "count": total,
+        "page_info": {"end_cursor": str(end), "has_next_page": end < total},
+        "edges": [{"node": post_node(rng, index, comments, total_comments)} for index in range(start, end)],
+    }}}}
+
+
+def comments_page(post_index: int, start: int, count: int, total: int, seed: int = 0) -> dict:
+    """A page of the post comments query."""
+    rng = random.Random(seed * 1_000_003 + post_index * 10_007 + start)
+    end = min(start + count, total)
+    return {"data": {"shortcode_media": {
+        "comments_disabled": False,
+        "edge_media_to_parent_comment": {
+            "count": total,
+            "page_info": {"end_cursor": f"c{end}" if end < total else None, "has_next_page": end < total},
+            "edges": [{"node": comment_node(rng, post_index, j, parent=True)} for j in range(start, end)],
+        },
+    }}}
+
+
+def user_response(username: str, user_id: str = "1", posts: int = 0) -> dict:
+    """The web_profile_info response of a user."""
+    return {"data": {"user": {
+        "id": user_id, "username": username, "full_name": username.title(), "biography": "",
+        "bio_links": [], "external_url": None, "is_private": False, "is_verified": False,
+        "edge_followed_by": {"count": 1000}, "edge_follow": {"count": 100},
+        "edge_owner_to_timeline_media": {"count": posts, "edges": []},
+        "edge_felix_video_timeline": {"count": 0, "edges": []},
+        "edge_saved_media": {"count": 0}, "edge_related_profiles": {"edges": []},
+    }}}
+
+
+def account_pages(
+    username: str,
+    comments: int,
+    comments_per_post: int = 100,
+    preloaded: int = 3,
+    post_page_size: int = 24,
+    comment_page_size: int = 50,
+    seed: int = 0
+) -> dict[str, bytes]:
+    """
+    Every response the scraper requests for an account of `comments` comments, keyed by request URL.
+
+    Each post has `comments_per_post` comments: `preloaded` of them come with the timeline page, the rest are
+    paginated by `comment_page_size`. The page sizes must be the ones the scraper asks for (its defaults).
+    """
+    from src.innorep.scrape.instagram import COMMENTS_URL, POSTS_URL
+
+    posts = max(1, comments // comments_per_post)
+    pages = {
+        f"https://i.instagram.com/api/v1/users/web_profile_info/?username={username}":
+            json.dumps(user_response(username, posts=posts)).encode('utf-8'),
+    }
+    after = None
+    for start in range(0, posts, post_page_size):
+        variables = {"id": "1", "first": post_page_size, "after": after}
+        page = posts_page(start, post_page_size, posts, preloaded, comments_per_post, seed)
+        pages[POSTS_URL + quote(json.dumps(variables))] = json.dumps(page).encode('utf-8')
+        after = page["data"]["user"]["edge_owner_to_timeline_media"]["page_info"]["end_cursor"]
+    for post_index in range(posts):
+        for start in range(preloaded, comments_per_post, comment_page_size):
+            variables = {"shortcode": f"sc{post_index}", "first": comment_page_size, "after": f"c{start}"}
+            page = comments_page(post_index, start, comment_page_size, comments_per_post, seed)
+            pages[COMMENTS_URL + quote(json.dumps(variables))] = json.dumps(page).encode('utf-8')
+    return pages
+
+
+def load_fixtures(directory: Path) -> list:
+    """Recorded responses, one JSON document per *.json file."""
+    return [json.loads(path.read_text(encoding='utf-8')) for path in sorted(Path(directory).glob("*.json"))]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Writes the responses of a synthetic account as JSON lines")
+    parser.add_argument("output", type=Path)
+    parser.add_argument("--username", default="bench_recorded")
+    parser.add_argument("--comments", type=int, default=200)
+    parser.add_argument("--comments-per-post", type=int, default=50)
+    args = parser.parse_args(argv)
+
+    from benchmarks.fakes import save_pages
+
+    pages = account_pages(args.username, args.comments, comments_per_post=args.comments_per_post)
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+    save_pages(pages, args.output)
+    print(f"{len(pages)} responses written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,100 +1,680 @@
+import re
+import json
 import asyncio
-from enum import Enum
-from typing import Type
+import time
+import tempfile
+import warnings
+import unicodedata
+from pathlib import Path
+from typing import Optional, Type
 
+import httpx
+import openai
 from pydantic import BaseModel
-from openai import AsyncOpenAI
-from src.innorep.analyze.utils import batch_process_openai
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+from src.innorep.analyze.batch import BatchJobError, BatchTransport, OpenAIBatchTransport, run_batch_job
+from src.innorep.analyze.cache import ClassificationCache
+from src.innorep.analyze.checkpoint import AnalysisCheckpoint, snapshot_hash
+from src.innorep.analyze.heuristics import HeuristicClassifier
+from src.innorep.analyze.models import (
+    Sentiment, Spam, CommentAnalysis, PackedCommentAnalysis, PackedCommentAnalyses
+)
+from src.innorep.analyze.ratelimit import RateLimiter, estimate_tokens
+from src.innorep.analyze.records import CommentResults
+from src.innorep.analyze.utils import first_error, stream_process_openai
+from src.innorep.instrumentation import set_gauge, span
+
+
+SENTIMENT_SPAM_INSTRUCTION = (
+    "Analyze the Instagram post comment, determine the sentiment, and classify whether it is spam."
+)
 
+PACKED_SENTIMENT_SPAM_INSTRUCTION = (
+    "You receive a JSON list of Instagram post comments, each with an id and a text. "
+    "For every comment, determine the sentiment and classify whether it is spam. "
+    "Return exactly one result per comment and copy its id unchanged."
+)
 
-class Sentiment(str, Enum):
-    positive = "positive"
-    negative = "negative"
-    neutral = "neutral"
+# USD per 1M tokens (input, output), used to report the cost of a run
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+# Batch API requests are billed at half the live price
+BATCH_DISCOUNT = 0.5
 
 
-class Spam(str, Enum):
-    spam = "spam"
-    not_spam = "not_spam"
+_WHITESPACE = re.compile(r"\s+")
+_VARIATION_SELECTORS = re.compile("[\ufe0e\ufe0f]")
 
 
-class CommentAnalysis(BaseModel):
-    sentiment: Sentiment
-    spam: Spam
+def normalize_comment_text(text: str) -> str:
+    """Normalizes a comment so that trivially different copies ("Nice!", "nice! ", "❤️"/"❤") compare equal."""
+    text = unicodedata.normalize("NFKC", text or "")
+    text = _VARIATION_SELECTORS.sub("", text)
+    return _WHITESPACE.sub(" ", text).strip().casefold()
 
 
-SENTIMENT_SPAM_INSTRUCTION = (
-    "Analyze the Instagram post comment, determine the sentiment, and classify whether it is spam."
-)
+def group_comments(comments: list[dict]) -> dict[str, list[dict]]:
+    """Groups comments by normalized text, keeping first-seen order."""
+    groups = {}
+    for comment in comments:
+        groups.setdefault(normalize_comment_text(comment['text']), []).append(comment)
+    return groups
+
+
+def create_openai_client(
+    max_connections: int = 100,
+    max_keepalive_connections: int = 30,
+    keepalive_expiry: float = 30.0,
+    timeout: float = 60.0,
+    **kwargs
+) -> AsyncOpenAI:
+    """
+    Creates an AsyncOpenAI client with a tunable connection pool, meant to be shared by every call of a run.
+
+    :param max_connections: Maximum number of open connections in the pool.
+    :param max_keepalive_connections: Maximum number of idle connections kept alive for reuse.
+    :param keepalive_expiry: Seconds an idle connection is kept alive.
+    :param timeout: Request timeout in seconds.
+    :param kwargs: Extra arguments passed to AsyncOpenAI (api_key, base_url, max_retries, ...).
+
+    :return: The client. The caller is responsible for closing it with `await client.close()`.
+    """
+    http_client = DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        ),
+        timeout=timeout,
+    )
+    return AsyncOpenAI(http_client=http_client, **kwargs)
+
+
+def _without_sdk_retries(client: AsyncOpenAI, limiter: Optional[RateLimiter]) -> AsyncOpenAI:
+    """The client to send requests with: under a limiter, which does the retrying, the SDK must not retry too."""
+    if limiter is None or client.max_retries == 0:
+        return client
+    # A copy sharing the connection pool, so closing the caller's client still closes it
+    return client.with_options(max_retries=0)
+
+
+def record_usage(usage: Optional[dict], completion) -> None:
+    """Adds the request and token counts of a completion to a usage dict."""
+    if usage is None:
+        return
+    usage['requests'] = usage.get('requests', 0) + 1
+    if getattr(completion, 'usage', None) is not None:
+        usage['prompt_tokens'] = usage.get('prompt_tokens', 0) + completion.usage.prompt_tokens
+        usage['completion_tokens'] = usage.get('completion_tokens', 0) + completion.usage.completion_tokens
+
+
+def usage_cost(usage: dict, model: str) -> float:
+    """Cost in USD of the tokens counted in a usage dict, or 0 for models without a known price."""
+    input_price, output_price = MODEL_PRICES.get(model, (0, 0))
+    return (usage.get('prompt_tokens', 0) * input_price + usage.get('completion_tokens', 0) * output_price) / 1e6
+
+
+def comment_messages(instruction, comment: str) -> list[dict]:
+    """Chat messages for classifying a single comment."""
+    return [{"role": "system", "content": instruction}, {"role": "user", "content": f" Comment: {comment}"}]
+
+
+async def parse_completion(
+    client: AsyncOpenAI,
+    model: str,
+    messages: list[dict],
+    response_format: Type[BaseModel],
+    limiter: Optional[RateLimiter] = None,
+    usage: Optional[dict] = None,
+    completion_tokens: int = 20
+):
+    """Sends one structured-output request, waiting for the limiter and feeding it the rate-limit headers."""
+    if limiter is not None:
+        await limiter.acquire(estimate_tokens(messages, completion_tokens))
+    with span("llm_request", model=model) as request_span:
+        if limiter is None:
+            completion = await client.beta.chat.completions.parse(
+                model=model, messages=messages, response_format=response_format)
+        else:
+            raw = await client.beta.chat.completions.with_raw_response.parse(
+                model=model, messages=messages, response_format=response_format)
+            limiter.update_from_headers(raw.headers)
+            completion = raw.parse()
+        request_usage = {}
+        record_usage(request_usage, completion)
+        request_span.update(
+            prompt_tokens=request_usage.get('prompt_tokens', 0),
+            completion_tokens=request_usage.get('completion_tokens', 0),
+            cost_usd=usage_cost(request_usage, model),
+        )
+    record_usage(usage, completion)
+    return completion
 
 
 async def classify_comment(
     instruction,
     comment: str = "",
     response_format: Type[BaseModel] = CommentAnalysis,
-    model: str = "gpt-4o-mini"
+    model: str = "gpt-4o-mini",
+    client: Optional[AsyncOpenAI] = None,
+    usage: Optional[dict] = None,
+    limiter: Optional[RateLimiter] = None
 ):
-    client = AsyncOpenAI()
-    messages=[{"role": "system", "content": instruction}, {"role": "user", "content": f" Comment: {comment}"}]
-    completion = await client.beta.chat.completions.parse(
-        model=model, messages=messages, response_format=response_format)
-    message = completion.choices[0].message
-    if message.parsed:
-        return message.parsed
-    else:
-        print(message.refusal)
-        raise ValueError("OpenAI model failed to parse output")
-
-
-async def analyze_comments(comments: list[dict], batch_size: int = 30) -> list[dict]:
-    """Analyzes a list of comments for sentiment and spam using the batch_process function."""
-
-    async def process_batch(batch: list[dict]) -> list[dict]:
-        """Processes a single batch of comments."""
-        batch_prompts = [comment['text'] for comment in batch]
-        tasks = [classify_comment(SENTIMENT_SPAM_INSTRUCTION, comment) for comment in batch_prompts]
-        batch_results = await asyncio.gather(*tasks)
-
-
-        return [
-            {
-                'id': batch[j]['id'],
-                'created_at': batch[j]['created_at'],
-                'comment': batch[j]['text'],
-                'sentiment': batch_results[j].sentiment,
-                'spam': batch_results[j].spam,
-            }
-            for j in range(len(batch))
-        ]
-
-    return await batch_process_openai(comments, batch_size=batch_size, process_batch=process_batch)
+    if client is None:
+        # No shared client given: use a throwaway one for this call only
+        async with create_openai_client(max_connections=1) as own_client:
+            return await classify_comment(instruction, comment, response_format, model, own_client, usage, limiter)
+    client = _without_sdk_retries(client, limiter)
 
+    attempts = 0
 
-def calculate_metrics(sentiment_results):
-    """Calculates metrics based on sentiment analysis results."""
+    async def attempt():
+        nonlocal attempts
+        attempts += 1
+        completion = await parse_completion(
+            client, model, comment_messages(instruction, comment), response_format, limiter, usage)
+        message = completion.choices[0].message
+        if message.parsed:
+            return message.parsed
+        else:
+            print(message.refusal)
+            raise ValueError("OpenAI model failed to parse output")
+
+    # Latency of the whole classification, including the limiter's waits and retries
+    with span("classify_comment") as classify_span:
+        try:
+            if limiter is None:
+                return await attempt()
+            return await limiter.call(attempt)
+        finally:
+            classify_span["retries"] = max(attempts - 1, 0)
+
+
+async def classify_comments_packed(
+    instruction,
+    comments: dict[str, str],
+    model: str = "gpt-4o-mini",
+    client: Optional[AsyncOpenAI] = None,
+    usage: Optional[dict] = None,
+    max_retries: int = 2,
+    limiter: Optional[RateLimiter] = None
+) -> dict[str, CommentAnalysis]:
+    """
+    Classifies several comments in one structured-output request.
+
+    Ids missing from the answer are sent again in a smaller pack, up to `max_retries` times;
+    whatever is still missing after that is classified one comment at a time.
+
+    :param instruction: The system prompt for the packed request.
+    :param comments: Comment texts keyed by comment id.
+
+    :return: The classification of every comment, keyed by comment id.
+    """
+    if client is None:
+        # No shared client given: use a throwaway one for this call only
+        async with create_openai_client(max_connections=1) as own_client:
+            return await classify_comments_packed(
+                instruction, comments, model, own_client, usage, max_retries, limiter)
+    client = _without_sdk_retries(client, limiter)
+
+    with span("classify_pack", pack_size=len(comments)):
+        return await _classify_comments_packed(instruction, comments, model, client, usage, max_retries, limiter)
+
+
+async def _classify_comments_packed(instruction, comments, model, client, usage, max_retries, limiter):
+    results = {}
+    remaining = dict(comments)
+    for _ in range(max_retries + 1):
+        if not remaining:
+            break
+        pack = json.dumps([{"id": comment_id, "text": text} for comment_id, text in remaining.items()],
+                          ensure_ascii=False)
+        messages = [{"role": "system", "content": instruction}, {"role": "user", "content": pack}]
+
+        async def attempt():
+            return await parse_completion(client, model, messages, PackedCommentAnalyses, limiter, usage,
+                                          completion_tokens=20 * len(remaining))
+
+        completion = await (attempt() if limiter is None else limiter.call(attempt))
+        message = completion.choices[0].message
+        if not message.parsed:
+            print(message.refusal)
+            continue
+        for item in message.parsed.results:
+            if item.id in remaining:
+                results[item.id] = CommentAnalysis(sentiment=item.sentiment, spam=item.spam)
+                del remaining[item.id]
 
-    total_comments = len(sentiment_results)
-    total_spam = sum(1 for result in sentiment_results if result['spam'] == "spam")
-    total_comment_length = sum(len(c['comment']) for c in sentiment_results)
-
-    # # NPS Calculation Logic
-    # promoters = sum(1 for result in sentiment_results if result['sentiment_score'] >= 9)
-    # detractors = sum(1 for result in sentiment_results if result['sentiment_score'] <= 6)
-    # passives = sum(1 for result in sentiment_results if 7 <= result['sentiment_score'] <= 8)
-    #
-    # valid_responses = promoters + detractors + passives
-    #
-    # if valid_responses > 0:
-    #     nps_score = ((promoters - detractors) / valid_responses) * 100
-    # else:
-    #     nps_score = 0
-
-    # Calculate the metrics
-    metrics = {
-        "total_comments": total_comments,
-        "average_comment_length": total_comment_length / total_comments if total_comments > 0 else 0,
-        "spam_rate": total_spam / total_comments if total_comments > 0 else 0,
-        # "nps_score": nps_score,
+    for comment_id, text in remaining.items():
+        results[comment_id] = await classify_comment(
+            SENTIMENT_SPAM_INSTRUCTION, text, model=model, client=client, usage=usage, limiter=limiter)
+    return results
+
+
+def report_run_stats(
+    stats: Optional[dict],
+    mode: str,
+    model: str,
+    comments: int,
+    distinct_texts: int,
+    classified_texts: int,
+    usage: dict,
+    limiter: RateLimiter,
+    failed_texts: int,
+    elapsed: float,
+    source_counts: dict,
+    cache: Optional[ClassificationCache],
+    batch_usage: Optional[dict] = None,
+    restored_texts: int = 0
+) -> None:
+    """
+    Prints a run summary and stores it in `stats` (deduplication, requests/tokens/cost, sources, cache).
+
+    :param usage: Requests and tokens of live requests, at full price.
+    :param batch_usage: Requests and tokens of Batch API jobs, at the batch discount. Counts report both together.
+    :param restored_texts: Distinct texts taken from a checkpoint instead of being classified again.
+    """
+    dedup_stats = {
+        "comments": comments,
+        "distinct_texts": distinct_texts,
+        "collapse_ratio": comments / distinct_texts if distinct_texts else 0,
     }
+    for key, value in dedup_stats.items():
+        set_gauge(f"dedup_{key}", value)
+    batch_usage = batch_usage or {}
+    cost = usage_cost(usage, model) + usage_cost(batch_usage, model) * BATCH_DISCOUNT
+    llm_stats = {
+        "mode": mode,
+        "model": model,
+        "classified_texts": classified_texts,
+        "restored_texts": restored_texts,
+        **{key: usage.get(key, 0) + batch_usage.get(key, 0) for key in {**usage, **batch_usage}},
+        **limiter.stats(),
+        "failed_texts": failed_texts,
+        "cost_usd": cost,
+        "cost_per_comment": cost / classified_texts if classified_texts else 0,
+        "comments_per_second": classified_texts / elapsed if elapsed > 0 else 0,
+    }
+    print(f"Classified {distinct_texts} distinct texts for {comments} comments.")
+    print(f"{llm_stats['requests']} requests, {llm_stats['comments_per_second']:.1f} comments/s, ${cost:.4f}.")
+    print(f"Comments by source: {source_counts}.")
+    if stats is not None:
+        stats['dedup'] = dedup_stats
+        stats['llm'] = llm_stats
+        stats['sources'] = source_counts
+
+    if cache is not None:
+        cache_stats = cache.stats()
+        print(f"Classification cache: {cache_stats['hits']} hits, {cache_stats['misses']} misses.")
+        if stats is not None:
+            stats['cache'] = cache_stats
+
+
+async def analyze_comments(
+    comments: list[dict],
+    concurrency: int = 30,
+    client: Optional[AsyncOpenAI] = None,
+    cache: Optional[ClassificationCache] = None,
+    model: str = "gpt-4o-mini",
+    mode: str = "live",
+    pack_size: int = 20,
+    batch_transport: Optional[BatchTransport] = None,
+    batch_file: Optional[Path] = None,
+    batch_poll_interval: float = 30.0,
+    batch_fallback: bool = True,
+    limiter: Optional[RateLimiter] = None,
+    prefilter: Optional[HeuristicClassifier] = None,
+    stats: Optional[dict] = None,
+    checkpoint: Optional[AnalysisCheckpoint] = None,
+    batch_size: Optional[int] = None
+) -> CommentResults:
+    """
+    Analyzes a list of comments for sentiment and spam, keeping up to `concurrency` requests in flight.
+
+    All requests share one client. If `client` is not given, a pooled client sized to `concurrency`
+    is created for this run and closed when it ends; a client passed in is left open for the caller, and its
+    requests are sent without the SDK's own retries, which would repeat every retry of the rate limiter.
+    Comments with the same normalized text are classified once. Each result records under 'source' whether it came
+    from the local prefilter ("heuristic"), the cache ("cache"), a live request ("llm") or a batch job ("batch");
+    results of the prefilter also name the heuristic rule that settled them under 'rule'.
+
+    Every request goes through a shared rate limiter. A comment whose request still fails after the limiter's
+    retries is retried once more on its own after the main pass; if that fails too, it is returned with
+    sentiment and spam set to None and the error message under 'error' instead of failing the whole run.
+
+    :param cache: Optional classification cache; comments found in it are not sent to the model.
+    :param model: The OpenAI model used for classification.
+    :param mode: "live" sends one comment per request, "packed" sends `pack_size` comments per request,
+        "batch" submits all requests as one offline Batch API job and waits for it.
+    :param pack_size: Number of comments per request in packed mode.
+    :param batch_transport: Transport used in batch mode; defaults to the OpenAI Batch API through `client`.
+    :param batch_file: Where the batch mode JSONL request file is written; defaults to a temporary file that is
+        removed after the job.
+    :param batch_poll_interval: Seconds between batch job status checks.
+    :param batch_fallback: Classify the comments a batch job did not return with live requests, at full price.
+        With False they are returned unclassified, and a batch job that failed without any output raises.
+    :param limiter: Rate limiter shared by all requests; defaults to a new RateLimiter with default quotas.
+    :param prefilter: Optional local classifier; comments it settles with enough confidence are not sent to the model.
+    :param stats: Optional dict that is filled with run statistics (deduplication, cache, requests, tokens, cost).
+    :param checkpoint: Optional checkpoint that model classifications are appended to as they finish. A run on the
+        same comments and model resumes from it and only classifies the texts missing there; in batch mode it also
+        waits for the batch job submitted by the interrupted run instead of submitting a new one.
+    :param batch_size: Deprecated name of `concurrency`.
+
+    :return: The results in the order of `comments`, as compact CommentResults (iterating gives llm_results entries).
+    """
+    if batch_size is not None:
+        warnings.warn("batch_size is deprecated, use concurrency", DeprecationWarning, stacklevel=2)
+        concurrency = batch_size
+    if mode not in ("live", "packed", "batch"):
+        raise ValueError(f"Unknown analysis mode: {mode}")
+    if pack_size < 1:
+        raise ValueError(f"pack_size must be at least 1, got {pack_size}")
+    # Cache entries are keyed on the prompt that produced them; packed requests use their own
+    mode_instruction = PACKED_SENTIMENT_SPAM_INSTRUCTION if mode == "packed" else SENTIMENT_SPAM_INSTRUCTION
+
+    # Identical texts are classified once and the result is copied back to every comment
+    groups = group_comments(comments)
+    distinct_texts = list(groups)
+
+    by_text = {}
+    sources = {}
+    rules = {}
+    pending = []
+    restored = checkpoint.resume(snapshot_hash(comments, model)) if checkpoint is not None else {}
+    if restored:
+        print(f"Resuming from checkpoint: {len(restored)} texts already classified.")
+    for normalized in distinct_texts:
+        if normalized in restored:
+            by_text[normalized], sources[normalized] = restored[normalized]
+            continue
+        if prefilter is not None:
+            local = prefilter.classify(normalized)
+            if local is not None:
+                by_text[normalized], sources[normalized], rules[normalized] = local[0], "heuristic", local[2]
+                continue
+        cached = None
+        if cache is not None:
+            cached = cache.get(cache.make_key(normalized, mode_instruction, model, CommentAnalysis), CommentAnalysis)
+        if cached is not None:
+            by_text[normalized], sources[normalized] = cached, "cache"
+        else:
+            pending.append(normalized)
+
+    def remember(normalized: str, result: CommentAnalysis, instruction: str, source: str = "llm") -> None:
+        by_text[normalized] = result
+        sources[normalized] = source
+        if checkpoint is not None:
+            checkpoint.add(normalized, result, source)
+        if cache is not None:
+            cache.set(cache.make_key(normalized, instruction, model, CommentAnalysis), result)
+            if instruction != mode_instruction:
+                # A single-comment fallback in packed mode: also store it where packed runs look it up
+                cache.set(cache.make_key(normalized, mode_instruction, model, CommentAnalysis), result)
+
+    usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    # Batch API requests are billed at a discount, unlike the live requests for what a batch job did not return
+    batch_usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+    if limiter is None:
+        limiter = RateLimiter()
+    failed = []
+    errors = {}
+
+    async def process_text(normalized: str) -> None:
+        """Classifies one distinct text; a failure is set aside for the one-at-a-time retry pass."""
+        text = groups[normalized][0]['text']
+        try:
+            result = await classify_comment(
+                SENTIMENT_SPAM_INSTRUCTION, text, model=model, client=client, usage=usage, limiter=limiter)
+        except (openai.OpenAIError, ValueError) as e:
+            print(f"Classification failed for comment {groups[normalized][0]['id']}: {e}")
+            failed.append(normalized)
+            return
+        remember(normalized, result, SENTIMENT_SPAM_INSTRUCTION)
+
+    async def process_pack(pack: list[str]) -> None:
+        """Classifies several distinct texts in one request, keyed by the id of their first comment."""
+        ids = {str(groups[normalized][0]['id']): normalized for normalized in pack}
+        try:
+            packed_results = await classify_comments_packed(
+                PACKED_SENTIMENT_SPAM_INSTRUCTION,
+                {comment_id: groups[normalized][0]['text'] for comment_id, normalized in ids.items()},
+                model=model, client=client, usage=usage, limiter=limiter)
+        except (openai.OpenAIError, ValueError) as e:
+            print(f"Classification failed for a pack of {len(pack)} comments: {e}")
+            packed_results = {}
+        for comment_id, result in packed_results.items():
+            remember(ids[comment_id], result, PACKED_SENTIMENT_SPAM_INSTRUCTION)
+        failed.extend(normalized for normalized in pack if normalized not in by_text)
+
+    async def retry_failed() -> None:
+        """Retries failed texts one at a time, recording the error of those that fail again."""
+        retry, failed[:] = list(failed), []
+        if retry:
+            print(f"Retrying {len(retry)} failed comments one at a time...")
+        for normalized in retry:
+            text = groups[normalized][0]['text']
+            try:
+                remember(normalized, await classify_comment(
+                    SENTIMENT_SPAM_INSTRUCTION, text, model=model, client=client, usage=usage, limiter=limiter),
+                    SENTIMENT_SPAM_INSTRUCTION)
+            except (openai.OpenAIError, ValueError) as e:
+                errors[normalized] = str(e)
+
+    async def process_batch_job(texts: list[str]) -> None:
+        """Classifies distinct texts through one Batch API job, then live-classifies whatever it did not return."""
+        ids = {str(groups[normalized][0]['id']): normalized for normalized in texts}
+        messages = {
+            comment_id: comment_messages(SENTIMENT_SPAM_INSTRUCTION, groups[normalized][0]['text'])
+            for comment_id, normalized in ids.items()
+        }
+        transport = batch_transport if batch_transport is not None else OpenAIBatchTransport(client)
+
+        async def run_job(path: Path) -> dict:
+            return await run_batch_job(
+                messages, path, transport, model=model, response_format=CommentAnalysis,
+                poll_interval=batch_poll_interval, usage=batch_usage, limiter=limiter,
+                batch_id=checkpoint.batch_id if checkpoint is not None else None,
+                on_submit=checkpoint.save_batch_id if checkpoint is not None else None)
+
+        with span("batch_job", requests=len(messages)) as job_span:
+            try:
+                if batch_file is not None:
+                    batch_results = await run_job(batch_file)
+                else:
+                    with tempfile.TemporaryDirectory(prefix="innorep_batch_") as directory:
+                        batch_results = await run_job(Path(directory) / "requests.jsonl")
+            except BatchJobError as e:
+                # The job is over either way: the next run must submit a new one
+                if checkpoint is not None:
+                    checkpoint.save_batch_id(None)
+                if not batch_fallback:
+                    raise
+                print(e)
+                batch_results = {}
+            job_span.update(
+                prompt_tokens=batch_usage.get('prompt_tokens', 0),
+                completion_tokens=batch_usage.get('completion_tokens', 0),
+                cost_usd=usage_cost(batch_usage, model) * BATCH_DISCOUNT,
+            )
+        for comment_id, result in batch_results.items():
+            # A reattached job may also hold texts restored from the checkpoint since
+            if comment_id in ids:
+                remember(ids[comment_id], result, SENTIMENT_SPAM_INSTRUCTION, source="batch")
+        if checkpoint is not None:
+            checkpoint.flush()
+            checkpoint.save_batch_id(None)
+
+        missing = [normalized for comment_id, normalized in ids.items() if comment_id not in batch_results]
+        if missing and batch_fallback:
+            print(f"Batch job returned no result for {len(missing)} comments, classifying them live...")
+            await stream_process_openai(missing, process_text, concurrency=concurrency)
+        else:
+            for normalized in missing:
+                errors[normalized] = "not returned by the batch job"
+
+    own_client = client is None and bool(pending)
+    if own_client:
+        # Retries are left to the rate limiter, which knows about the shared quota
+        client = create_openai_client(
+            max_connections=concurrency, max_keepalive_connections=concurrency, max_retries=0)
+    elif client is not None:
+        client = _without_sdk_retries(client, limiter)
+
+    started = time.perf_counter()
+    try:
+        if mode == "packed":
+            packs = [pending[i:i + pack_size] for i in range(0, len(pending), pack_size)]
+            await stream_process_openai(packs, process_pack, concurrency=concurrency)
+        elif mode == "batch":
+            if pending:
+                await process_batch_job(pending)
+        else:
+            await stream_process_openai(pending, process_text, concurrency=concurrency)
+        await retry_failed()
+    finally:
+        if checkpoint is not None:
+            # Also when the run fails, so that the next run resumes from every classification paid for
+            checkpoint.flush()
+        if own_client:
+            await client.close()
+    elapsed = time.perf_counter() - started
+
+    results = CommentResults()
+    for comment in comments:
+        normalized = normalize_comment_text(comment['text'])
+        results.append(
+            comment, by_text.get(normalized), sources.get(normalized), errors.get(normalized, "not classified"),
+            rules.get(normalized))
+
+    source_counts = {}
+    for normalized, group in groups.items():
+        source = sources.get(normalized, "failed")
+        source_counts[source] = source_counts.get(source, 0) + len(group)
+    report_run_stats(
+        stats, mode, model, len(comments), len(distinct_texts), len(pending), usage, limiter, len(errors),
+        elapsed, source_counts, cache, batch_usage, len(restored))
+    return results
+
+
+async def analyze_comment_queue(
+    queue: asyncio.Queue,
+    concurrency: int = 30,
+    client: Optional[AsyncOpenAI] = None,
+    cache: Optional[ClassificationCache] = None,
+    model: str = "gpt-4o-mini",
+    limiter: Optional[RateLimiter] = None,
+    prefilter: Optional[HeuristicClassifier] = None,
+    stats: Optional[dict] = None
+) -> CommentResults:
+    """
+    Live-mode analysis of comments that arrive over time, for example while a profile is still being scraped.
+
+    `concurrency` workers take comments from `queue` until they get None, which the producer puts once when it is
+    done. With a bounded queue the producer waits whenever classification falls behind. Deduplication, the prefilter,
+    the cache, the rate limiter and failure handling behave as in `analyze_comments`; a duplicate of a text that is
+    still being classified waits for that request instead of sending its own.
+
+    :return: Results in the order their classifications finished, which is not the order of the queue: a comment
+        waiting for a slow request is added after comments taken later.
+    """
+    own_client = client is None
+    if own_client:
+        client = create_openai_client(
+            max_connections=concurrency, max_keepalive_connections=concurrency, max_retries=0)
+    if limiter is None:
+        limiter = RateLimiter()
+    client = _without_sdk_retries(client, limiter)
+
+    resolving = {}
+    sources = {}
+    rules = {}
+    errors = {}
+    counts = {}
+    results = CommentResults()
+    usage = {'requests': 0, 'prompt_tokens': 0, 'completion_tokens': 0}
+
+    async def resolve(normalized: str, text: str) -> Optional[CommentAnalysis]:
+        """Classifies one distinct text through the prefilter, the cache and the model."""
+        if prefilter is not None:
+            local = prefilter.classify(normalized)
+            if local is not None:
+                sources[normalized], rules[normalized] = "heuristic", local[2]
+                return local[0]
+        key = None
+        if cache is not None:
+            key = cache.make_key(normalized, SENTIMENT_SPAM_INSTRUCTION, model, CommentAnalysis)
+            cached = cache.get(key, CommentAnalysis)
+            if cached is not None:
+                sources[normalized] = "cache"
+                return cached
+        # One extra attempt on its own after the limiter's retries, then mark the comment as failed
+        for _ in range(2):
+            try:
+                result = await classify_comment(
+                    SENTIMENT_SPAM_INSTRUCTION, text, model=model, client=client, usage=usage, limiter=limiter)
+            except (openai.OpenAIError, ValueError) as e:
+                print(f"Classification failed for comment text {text[:40]!r}: {e}")
+                errors[normalized] = str(e)
+                continue
+            errors.pop(normalized, None)
+            sources[normalized] = "llm"
+            if key is not None:
+                cache.set(key, result)
+            return result
+        return None
+
+    async def worker():
+        while True:
+            comment = await queue.get()
+            if comment is None:
+                # Leave the end marker for the other workers
+                queue.put_nowait(None)
+                return
+            normalized = normalize_comment_text(comment['text'])
+            counts[normalized] = counts.get(normalized, 0) + 1
+            if normalized not in resolving:
+                resolving[normalized] = asyncio.ensure_future(resolve(normalized, comment['text']))
+            result = await resolving[normalized]
+            results.append(
+                comment, result, sources.get(normalized), errors.get(normalized, "not classified"),
+                rules.get(normalized))
+
+    started = time.perf_counter()
+    try:
+        # A failing worker cancels the others instead of leaving them running
+        async with asyncio.TaskGroup() as group:
+            for _ in range(max(concurrency, 1)):
+                group.create_task(worker())
+    except BaseExceptionGroup as e:
+        raise first_error(e) from None
+    finally:
+        # Requests still in flight when the run fails or is cancelled must not outlive it (and the cache)
+        for future in resolving.values():
+            future.cancel()
+        await asyncio.gather(*resolving.values(), return_exceptions=True)
+        if own_client:
+            await client.close()
+    elapsed = time.perf_counter() - started
+
+    source_counts = {}
+    for normalized, count in counts.items():
+        source = sources.get(normalized, "failed")
+        source_counts[source] = source_counts.get(source, 0) + count
+    classified = sum(1 for normalized in counts if sources.get(normalized) != "heuristic"
+                     and sources.get(normalized) != "cache")
+    report_run_stats(
+        stats, "stream", model, len(results), len(counts), classified, usage, limiter, len(errors),
+        elapsed, source_counts, cache)
+    return results
+
+
+def calculate_metrics(sentiment_results):
+    """Calculates metrics based on sentiment analysis results."""
+    # pandas is only needed here, at the end of a run
+    from src.innorep.analyze.prepare import build_frame, frame_metrics
 
-    return metrics
+    with span("metrics", comments=len(sentiment_results)):
+        return frame_metrics(build_frame(sentiment_results))
@@ -0,0 +1,218 @@
+import json
+import asyncio
+from pathlib import Path
+from typing import Callable, Optional, Protocol, Type
+
+from pydantic import BaseModel
+from openai import AsyncOpenAI
+
+from src.innorep.analyze.ratelimit import RateLimiter
+
+
+BATCH_ENDPOINT = "/v1/chat/completions"
+TERMINAL_STATUSES = ("completed", "failed", "expired", "cancelled")
+
+
+class BatchJobError(RuntimeError):
+    """A batch job that finished without any output, for example because it failed validation or was cancelled."""
+
+
+class BatchTransport(Protocol):
+    """Submits a JSONL batch file, reports its status and downloads its output files."""
+
+    async def submit(self, batch_file: Path) -> str:
+        """Uploads the batch file, starts the job and returns its id."""
+        ...
+
+    async def poll(self, batch_id: str) -> dict:
+        """Returns the job state: status, output_file_id, error_file_id, request_counts and errors (messages)."""
+        ...
+
+    async def download(self, file_id: str) -> str:
+        """Returns the content of an output or error file."""
+        ...
+
+
+class OpenAIBatchTransport:
+    """BatchTransport backed by the OpenAI Files and Batch APIs."""
+
+    def __init__(self, client: AsyncOpenAI, completion_window: str = "24h"):
+        self.client = client
+        self.completion_window = completion_window
+
+    async def submit(self, batch_file: Path) -> str:
+        uploaded = await self.client.files.create(
+            file=(batch_file.name, batch_file.read_bytes()), purpose="batch")
+        batch = await self.client.batches.create(
+            input_file_id=uploaded.id, endpoint=BATCH_ENDPOINT, completion_window=self.completion_window)
+        return batch.id
+
+    async def poll(self, batch_id: str) -> dict:
+        batch = await self.client.batches.retrieve(batch_id)
+        return {
+            "status": batch.status,
+            "output_file_id": batch.output_file_id,
+            "error_file_id": batch.error_file_id,
+            "request_counts": batch.request_counts.model_dump() if batch.request_counts else None,
+            "errors": [error.message for error in batch.errors.data or []] if batch.errors else [],
+        }
+
+    async def download(self, file_id: str) -> str:
+        content = await self.client.files.content(file_id)
+        return content.text
+
+
+def _strict_schema(schema: dict) -> dict:
+    """Marks every object of a JSON schema as strict: all properties required and no others allowed."""
+    if schema.get("type") == "object":
+        schema["additionalProperties"] = False
+        schema["required"] = list(schema.get("properties", {}))
+    for value in schema.values():
+        if isinstance(value, dict):
+            _strict_schema(value)
+        elif isinstance(value, list):
+            for item in value:
+                if isinstance(item, dict):
+                    _strict_schema(item)
+    return schema
+
+
+def response_format_param(response_format: Type[BaseModel]) -> dict:
+    """The structured-output response_format of a request body, as the SDK's parse() sends it."""
+    return {
+        "type": "json_schema",
+        "json_schema": {
+            "schema": _strict_schema(response_format.model_json_schema()),
+            "name": response_format.__name__,
+            "strict": True,
+        },
+    }
+
+
+def write_batch_file(
+    batch_file: Path,
+    messages: dict[str, list[dict]],
+    model: str,
+    response_format: Type[BaseModel]
+) -> None:
+    """
+    Writes one chat-completion request per line in the Batch API input format.
+
+    :param batch_file: The JSONL file to write.
+    :param messages: Chat messages of each request, keyed by the id used as custom_id.
+    :param model: The OpenAI model.
+    :param response_format: The pydantic model the answers must follow.
+    """
+    response_format_body = response_format_param(response_format)
+    batch_file.parent.mkdir(parents=True, exist_ok=True)
+    with open(batch_file, 'w', encoding='utf-8') as f:
+        for custom_id, request_messages in messages.items():
+            request = {
+                "custom_id": custom_id,
+                "method": "POST",
+                "url": BATCH_ENDPOINT,
+                "body": {"model": model, "messages": request_messages, "response_format": response_format_body},
+            }
+            f.write(json.dumps(request, ensure_ascii=False) + "\n")
+
+
+def parse_batch_output(
+    output: str,
+    response_format: Type[BaseModel],
+    usage: Optional[dict] = None
+) -> dict[str, BaseModel]:
+    """
+    Parses a Batch API output file into results keyed by custom_id.
+
+    Lines with an error, a refusal or an unparsable answer are skipped, so their ids are simply missing.
+    """
+    results = {}
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        response = entry.get("response") or {}
+        if entry.get("error") or response.get("status_code") != 200:
+            print(f"Batch request {entry.get('custom_id')} failed: {entry.get('error') or response.get('status_code')}")
+            continue
+        body = response["body"]
+        if usage is not None:
+            usage['requests'] = usage.get('requests', 0) + 1
+            if body.get("usage"):
+                usage['prompt_tokens'] = usage.get('prompt_tokens', 0) + body["usage"]["prompt_tokens"]
+                usage['completion_tokens'] = usage.get('completion_tokens', 0) + body["usage"]["completion_tokens"]
+        message = body["choices"][0]["message"]
+        if not message.get("content"):
+            print(message.get("refusal"))
+            continue
+        try:
+            results[entry["custom_id"]] = response_format.model_validate_json(message["content"])
+        except ValueError as e:
+            print(f"Batch request {entry['custom_id']} returned unparsable output: {e}")
+    return results
+
+
+def report_batch_errors(batch_id: str, errors: str, shown: int = 5) -> None:
+    """Prints how many requests of a batch job failed and the errors of the first `shown` of them."""
+    lines = [line for line in errors.splitlines() if line.strip()]
+    print(f"Batch {batch_id}: {len(lines)} requests failed.")
+    for line in lines[:shown]:
+        entry = json.loads(line)
+        body = (entry.get("response") or {}).get("body") or {}
+        error = entry.get("error") or body.get("error") or {}
+        print(f"  {entry.get('custom_id')}: {error.get('message') if isinstance(error, dict) else error}")
+
+
+async def run_batch_job(
+    messages: dict[str, list[dict]],
+    batch_file: Path,
+    transport: BatchTransport,
+    model: str,
+    response_format: Type[BaseModel],
+    poll_interval: float = 30.0,
+    usage: Optional[dict] = None,
+    limiter: Optional[RateLimiter] = None,
+    batch_id: Optional[str] = None,
+    on_submit: Optional[Callable[[str], None]] = None
+) -> dict[str, BaseModel]:
+    """
+    Writes the requests to a batch file, submits it, polls until the job finishes and returns the parsed results.
+
+    Status checks and downloads go through `limiter`, which retries connection errors and 5xx with backoff, so a
+    blip during the hours a job may take does not end the run. The submitted job is not resubmitted: `on_submit`
+    gets its id to save, and a later run passing it as `batch_id` reattaches to the job instead of paying again.
+
+    :param limiter: Retries failed status checks and downloads; defaults to a new RateLimiter.
+    :param batch_id: Id of a job submitted earlier with the same requests, to wait for instead of submitting.
+    :param on_submit: Called with the id of the job right after it is submitted.
+
+    :return: Results keyed by id. Ids of requests that failed or did not finish are missing.
+    :raises BatchJobError: If the job finished without output, e.g. failed or cancelled. Its errors are printed.
+    """
+    if limiter is None:
+        limiter = RateLimiter()
+    if batch_id is None:
+        write_batch_file(batch_file, messages, model, response_format)
+        batch_id = await transport.submit(batch_file)
+        print(f"Submitted batch {batch_id} with {len(messages)} requests.")
+        if on_submit is not None:
+            on_submit(batch_id)
+    else:
+        print(f"Reattaching to batch {batch_id} submitted by an earlier run.")
+
+    while True:
+        state = await limiter.call(lambda: transport.poll(batch_id))
+        print(f"Batch {batch_id}: {state['status']} {state.get('request_counts') or ''}")
+        if state["status"] in TERMINAL_STATUSES:
+            break
+        await asyncio.sleep(poll_interval)
+
+    for error in state.get("errors") or []:
+        print(f"Batch {batch_id}: {error}")
+    if state.get("error_file_id"):
+        report_batch_errors(batch_id, await limiter.call(lambda: transport.download(state["error_file_id"])))
+    # Expired jobs still return the requests that completed in time
+    if not state.get("output_file_id"):
+        raise BatchJobError(f"Batch {batch_id} {state['status']} without output")
+    output = await limiter.call(lambda: transport.download(state["output_file_id"]))
+    return parse_batch_output(output, response_format, usage=usage)
@@ -0,0 +1,108 @@
+import json
+import time
+import sqlite3
+import hashlib
+from functools import lru_cache
+from pathlib import Path
+from typing import Optional, Type
+
+from pydantic import BaseModel
+
+
+@lru_cache(maxsize=None)
+def _schema_fingerprint(response_format: Type[BaseModel]) -> str:
+    """JSON schema of the response format, serialised once per model class."""
+    return json.dumps(response_format.model_json_schema(), sort_keys=True)
+
+
+class ClassificationCache:
+    """
+    Persistent SQLite cache of LLM classification results.
+
+    Entries are content-addressed: the key is a hash of the comment text, the instruction, the model and the
+    response schema, so changing any of them simply misses the cache instead of returning a stale answer.
+    """
+
+    def __init__(self, path: Path, max_entries: Optional[int] = None, max_age: Optional[float] = None):
+        """
+        :param path: The SQLite database file. Parent directories are created if needed.
+        :param max_entries: Keep at most this many entries (newest first) when the cache is pruned.
+        :param max_age: Entries older than this many seconds are ignored and removed when the cache is pruned.
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.max_entries = max_entries
+        self.max_age = max_age
+        self.hits = 0
+        self.misses = 0
+
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            " key TEXT PRIMARY KEY,"
+            " result TEXT NOT NULL,"
+            " created_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_classifications_created_at ON classifications (created_at)")
+        self._conn.commit()
+
+    @staticmethod
+    def make_key(text: str, instruction: str, model: str, response_format: Type[BaseModel]) -> str:
+        """Builds the content hash identifying one classification request."""
+        payload = json.dumps([text, instruction, model, _schema_fingerprint(response_format)], ensure_ascii=False)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key: str, response_format: Type[BaseModel]) -> Optional[BaseModel]:
+        """Returns the cached result for `key`, or None on a miss or an expired entry."""
+        row = self._conn.execute(
+            "SELECT result, created_at FROM classifications WHERE key = ?", (key,)
+        ).fetchone()
+        if row is not None and (self.max_age is None or time.time() - row[1] <= self.max_age):
+            self.hits += 1
+            return response_format.model_validate_json(row[0])
+        self.misses += 1
+        return None
+
+    def set(self, key: str, result: BaseModel) -> None:
+        """Stores a classification result."""
+        self._conn.execute(
+            "INSERT OR REPLACE INTO classifications (key, result, created_at) VALUES (?, ?, ?)",
+            (key, result.model_dump_json(), time.time()),
+        )
+        self._conn.commit()
+
+    def prune(self) -> None:
+        """Applies the age and size limits."""
+        if self.max_age is not None:
+            self._conn.execute("DELETE FROM classifications WHERE created_at < ?", (time.time() - self.max_age,))
+        if self.max_entries is not None:
+            self._conn.execute(
+                "DELETE FROM classifications WHERE key NOT IN "
+                "(SELECT key FROM classifications ORDER BY created_at DESC LIMIT ?)",
+                (self.max_entries,),
+            )
+        self._conn.commit()
+
+    def stats(self) -> dict:
+        """Hit/miss counters for this instance and the current number of entries."""
+        lookups = self.hits + self.misses
+        entries = self._conn.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups > 0 else 0,
+            "entries": entries,
+        }
+
+    def close(self) -> None:
+        """Prunes the cache and closes the database."""
+        self.prune()
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,159 @@
+import os
+import shutil
+import hashlib
+from pathlib import Path
+from typing import Optional
+
+from src.innorep.analyze.models import CommentAnalysis
+from src.innorep.serialization import dumps, loads
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+
+def snapshot_hash(comments: list[dict], model: str) -> str:
+    """Hash identifying an analysis input: the ids and texts of the comments, in order, and the model."""
+    digest = hashlib.sha256(model.encode('utf-8'))
+    for comment in comments:
+        digest.update(b"\0" + str(comment['id']).encode('utf-8') + b"\0" + (comment['text'] or "").encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+class AnalysisCheckpoint:
+    """
+    Append-only checkpoint of the classifications of one analysis run, so an interrupted run can resume.
+
+    Finished classifications (keyed by normalized comment text) are buffered and written as numbered JSON lines
+    chunks under <directory>/<username>/<snapshot>/. Each chunk is written to a temporary name and renamed, so a
+    crash loses at most the unwritten buffer, never a chunk. A run on the same input snapshot reads all chunks back;
+    checkpoints of other snapshots of the user are stale and removed. Clear the checkpoint once the results are saved,
+    and close it in any case.
+
+    A run holds the lock file <directory>/<username>.lock from `resume` to `clear` or `close`, so a second run of
+    the same user neither removes the snapshot the first one is writing nor writes chunks under the same numbers;
+    it goes on without a checkpoint instead. The operating system releases the lock of a process that dies.
+    Unreadable chunks and lines (a disk that filled up, an edited file) are skipped; their texts are classified again.
+    """
+
+    def __init__(self, directory: Path, username: str, chunk_size: int = 200):
+        """
+        :param directory: The root directory of all checkpoints.
+        :param chunk_size: Classifications per chunk file.
+        """
+        self.user_dir = Path(directory) / username
+        self.chunk_size = chunk_size
+        self.path: Optional[Path] = None
+        self._buffer: list[bytes] = []
+        self._next_chunk = 1
+        self._lock_file = None
+
+    def resume(self, snapshot: str) -> dict[str, tuple[CommentAnalysis, str]]:
+        """
+        Opens the checkpoint of an input snapshot and returns its classifications as (result, source) by text.
+        Returns nothing and checkpoints nothing if another run holds the checkpoints of the user.
+        """
+        if not self._lock():
+            print(f"Checkpoints of {self.user_dir.name} are in use by another run, continuing without a checkpoint.")
+            return {}
+        for stale in self.user_dir.glob("*"):
+            if stale.is_dir() and stale.name != snapshot:
+                shutil.rmtree(stale, ignore_errors=True)
+        self.path = self.user_dir / snapshot
+        self.path.mkdir(parents=True, exist_ok=True)
+        self._buffer = []
+
+        restored = {}
+        skipped = 0
+        chunks = sorted(self.path.glob("chunk_*.jsonl"))
+        for chunk in chunks:
+            try:
+                lines = chunk.read_bytes().splitlines()
+            except OSError:
+                skipped += 1
+                continue
+            for line in lines:
+                try:
+                    entry = loads(line)
+                    restored[entry['text']] = (
+                        CommentAnalysis(sentiment=entry['sentiment'], spam=entry['spam']), entry['source'])
+                except (ValueError, KeyError, TypeError):
+                    skipped += 1
+        if skipped:
+            print(f"Skipped {skipped} unreadable checkpoint chunks or lines of {self.user_dir.name}.")
+        self._next_chunk = int(chunks[-1].stem.split("_")[1]) + 1 if chunks else 1
+        return restored
+
+    @property
+    def batch_id(self) -> Optional[str]:
+        """Id of the batch job submitted for this snapshot and not yet collected, if any."""
+        batch_file = self.path / "batch_id" if self.path is not None else None
+        if batch_file is None or not batch_file.exists():
+            return None
+        return batch_file.read_text(encoding='utf-8').strip() or None
+
+    def save_batch_id(self, batch_id: Optional[str]) -> None:
+        """
+        Records the batch job of this snapshot, so that a later run waits for it instead of submitting another.
+        None forgets the job once its results are recorded.
+        """
+        if self.path is None:
+            return
+        batch_file = self.path / "batch_id"
+        if batch_id is None:
+            batch_file.unlink(missing_ok=True)
+            return
+        temp_file = batch_file.with_name(".batch_id.tmp")
+        temp_file.write_text(batch_id, encoding='utf-8')
+        os.replace(temp_file, batch_file)
+
+    def add(self, text: str, result: CommentAnalysis, source: str) -> None:
+        """Records one finished classification, writing a chunk whenever `chunk_size` are buffered."""
+        self._buffer.append(dumps({
+            'text': text, 'sentiment': result.sentiment.value, 'spam': result.spam.value, 'source': source}))
+        if len(self._buffer) >= self.chunk_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Writes the buffered classifications as a new chunk."""
+        if not self._buffer or self.path is None:
+            return
+        chunk = self.path / f"chunk_{self._next_chunk:06d}.jsonl"
+        temp_chunk = chunk.with_name(f".{chunk.name}.tmp")
+        temp_chunk.write_bytes(b"\n".join(self._buffer) + b"\n")
+        os.replace(temp_chunk, chunk)
+        self._buffer = []
+        self._next_chunk += 1
+
+    def clear(self) -> None:
+        """Removes every checkpoint of the user, once the results are saved elsewhere, and releases the lock."""
+        self._buffer = []
+        if self._lock_file is not None:
+            shutil.rmtree(self.user_dir, ignore_errors=True)
+        self.close()
+
+    def close(self) -> None:
+        """Releases the lock, keeping the written chunks for the next run."""
+        self.path = None
+        if self._lock_file is not None:
+            self._lock_file.close()  # closing the file releases the lock
+            self._lock_file = None
+
+    def _lock(self) -> bool:
+        """Takes the lock of the user's checkpoints unless another run holds it."""
+        if self._lock_file is not None:
+            return True
+        self.user_dir.parent.mkdir(parents=True, exist_ok=True)
+        lock_file = open(self.user_dir.parent / f"{self.user_dir.name}.lock", 'a+b')
+        try:
+            if fcntl is not None:
+                fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            else:
+                msvcrt.locking(lock_file.fileno(), msvcrt.LK_NBLCK, 1)
+        except OSError:
+            lock_file.close()
+            return False
+        self._lock_file = lock_file
+        return True
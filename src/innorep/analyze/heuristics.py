@@ -0,0 +1,91 @@
+import re
+import unicodedata
+from typing import Callable, Optional
+
+from src.innorep.analyze.models import Sentiment, Spam, CommentAnalysis
+
+
+# A local model takes a comment text and returns its classification with a confidence, or None to abstain
+LocalModel = Callable[[str], Optional[tuple[CommentAnalysis, float]]]
+
+_LINK = re.compile(r"https?://|www\.|\b[\w-]+\.(?:com|net|org|io|ly|me|shop|store|link)\b")
+_MENTION = re.compile(r"@[\w.]+")
+# Whole phrases of self-promotion only: topic words such as crypto or giveaway also occur in genuine comments
+_PROMO = re.compile(
+    r"\b(?:check (?:out )?my (?:page|profile|account|bio)|visit my (?:page|profile)|dm (?:me|us|for)|"
+    r"follow (?:me|back|us)|link in (?:my )?bio|promo code|send (?:me )?(?:a )?(?:pic|dm)|"
+    r"make money|onlyfans|free followers)\b|\bearn \$"
+)
+_WORD = re.compile(r"[^\W\d_]+")
+
+POSITIVE_EMOJI = set("🔥❤😍👏🙌💯😊🥰💕💖💗💓💞✨👍😘🤩💪🙏😻💘♥😀😃😄😁☺🤗🌹🎉👌😇")
+NEGATIVE_EMOJI = set("😡👎🤮💩😠🤬😒🙄😤🖕")
+PRAISE_WORDS = {
+    "nice", "amazing", "wow", "love", "beautiful", "awesome", "great", "cool", "perfect", "gorgeous",
+    "stunning", "cute", "lovely", "fantastic", "incredible", "super", "bravo", "congrats", "congratulations",
+    "excellent", "brilliant", "fabulous", "wonderful", "beauty", "goals", "legend", "queen", "king", "fire",
+}
+NEGATIVE_WORDS = {"ugly", "boring", "terrible", "awful", "worst", "bad", "disgusting", "trash", "horrible", "cringe"}
+
+
+def _is_emoji(char: str) -> bool:
+    return unicodedata.category(char) == "So" or char in "\u200d\ufe0f\ufe0e" or "\U0001f3fb" <= char <= "\U0001f3ff"
+
+
+class HeuristicClassifier:
+    """
+    Rule-based classifier for comments that do not need the LLM: link and self-promotion spam,
+    emoji-only reactions, single-word praise or complaints and bare friend mentions.
+
+    An optional local model (for example a small scikit-learn pipeline) is consulted for comments no rule matches.
+    Only answers with a confidence of at least `threshold` are used; everything else goes to the LLM.
+    """
+
+    def __init__(self, threshold: float = 0.9, model: Optional[LocalModel] = None):
+        self.threshold = threshold
+        self.model = model
+
+    def rules(self, text: str) -> Optional[tuple[CommentAnalysis, float, str]]:
+        """Applies the rules to a normalized comment text. Returns (result, confidence, rule name) or None."""
+        if not text:
+            return None
+        if _LINK.search(text):
+            return CommentAnalysis(sentiment=Sentiment.neutral, spam=Spam.spam), 0.95, "link"
+        if _PROMO.search(text):
+            # Below the default threshold: a phrase match alone is not sure enough to skip the LLM
+            return CommentAnalysis(sentiment=Sentiment.neutral, spam=Spam.spam), 0.8, "promotion"
+
+        without_mentions = _MENTION.sub("", text).strip()
+        if not without_mentions:
+            return CommentAnalysis(sentiment=Sentiment.neutral, spam=Spam.not_spam), 0.9, "mention"
+
+        emoji = [char for char in without_mentions if _is_emoji(char)]
+        words = _WORD.findall(without_mentions)
+        if emoji and not words:
+            symbols = {char for char in emoji if char in POSITIVE_EMOJI or char in NEGATIVE_EMOJI}
+            if symbols and symbols <= POSITIVE_EMOJI:
+                return CommentAnalysis(sentiment=Sentiment.positive, spam=Spam.not_spam), 0.92, "positive_emoji"
+            if symbols and symbols <= NEGATIVE_EMOJI:
+                return CommentAnalysis(sentiment=Sentiment.negative, spam=Spam.not_spam), 0.9, "negative_emoji"
+            return None
+
+        if len(words) == 1 and words[0] in PRAISE_WORDS and not set(emoji) & NEGATIVE_EMOJI:
+            return CommentAnalysis(sentiment=Sentiment.positive, spam=Spam.not_spam), 0.92, "praise_word"
+        if len(words) == 1 and words[0] in NEGATIVE_WORDS and not set(emoji) & POSITIVE_EMOJI:
+            return CommentAnalysis(sentiment=Sentiment.negative, spam=Spam.not_spam), 0.85, "negative_word"
+        return None
+
+    def classify(self, text: str) -> Optional[tuple[CommentAnalysis, float, str]]:
+        """
+        Classifies a normalized comment text locally.
+
+        :return: (result, confidence, rule name) when the confidence reaches the threshold, otherwise None.
+        """
+        answer = self.rules(text)
+        if answer is None and self.model is not None:
+            prediction = self.model(text)
+            if prediction is not None:
+                answer = (*prediction, "model")
+        if answer is not None and answer[1] >= self.threshold:
+            return answer
+        return None
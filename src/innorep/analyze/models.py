@@ -0,0 +1,27 @@
+from enum import Enum
+
+from pydantic import BaseModel
+
+
+class Sentiment(str, Enum):
+    positive = "positive"
+    negative = "negative"
+    neutral = "neutral"
+
+
+class Spam(str, Enum):
+    spam = "spam"
+    not_spam = "not_spam"
+
+
+class CommentAnalysis(BaseModel):
+    sentiment: Sentiment
+    spam: Spam
+
+
+class PackedCommentAnalysis(CommentAnalysis):
+    id: str
+
+
+class PackedCommentAnalyses(BaseModel):
+    results: list[PackedCommentAnalysis]
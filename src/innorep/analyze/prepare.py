@@ -1,62 +1,145 @@
+from typing import Iterable, Union
+
+import numpy as np
 import pandas as pd
 
+from src.innorep.analyze.records import CommentResults, SENTIMENTS, SPAM_VALUES
 
-def prepare_time_series_data(analysis_data, start_date, end_date, grouping='1M'):
-    """
-    Prepares a dataframe for visualizing sentiment ratios over time.
 
-    :param analysis_data: The JSON-like dictionary containing analysis results.
-    :param start_date: The start date for the period of interest (datetime object).
-    :param end_date: The end date for the period of interest (datetime object).
-    :param grouping: The grouping period for the time series ('1W', '1M', '3M', 'Y'). Default is '1M'.
+SPAM_LABELS = {'spam': 'Spam', 'not_spam': 'Not Spam'}
+DEFAULT_GROUPINGS = ('1W', '1M', '3M', 'Y')
 
-    :return: DataFrame grouped by time and sentiment ratio.
+
+def build_frame(llm_results: Union[list[dict], pd.DataFrame, CommentResults]) -> pd.DataFrame:
     """
+    Builds the typed columnar frame every aggregation works on.
 
-    # Convert the created_at timestamps to datetime objects
-    df = pd.DataFrame(analysis_data['llm_results'])
-    df['created_at'] = pd.to_datetime(df['created_at'], unit='s')
+    :param llm_results: Classification results, as a list of dicts (analysis JSON), a DataFrame (result store)
+        or CommentResults (a fresh analysis).
 
-    # Filter data to the specified date range
-    df_filtered = df[(df['created_at'] >= start_date) & (df['created_at'] <= end_date)]
+    :return: DataFrame with datetime64 'created_at', categorical 'sentiment' and 'spam' and integer 'comment_length'.
+        Unclassified comments keep NaN labels.
+    """
+    if isinstance(llm_results, CommentResults):
+        df = llm_results.to_frame()
+    elif isinstance(llm_results, pd.DataFrame):
+        df = llm_results
+    else:
+        df = pd.DataFrame(llm_results)
+    df = df.reindex(columns=['created_at', 'comment', 'sentiment', 'spam'])
+    return pd.DataFrame({
+        'created_at': pd.to_datetime(df['created_at'], unit='s'),
+        'sentiment': pd.Categorical(df['sentiment'], categories=list(SENTIMENTS)),
+        'spam': pd.Categorical(df['spam'], categories=list(SPAM_VALUES)),
+        'comment_length': df['comment'].astype(object).str.len().fillna(0).astype('int64'),
+    })
+
+
+def frame_metrics(frame: pd.DataFrame) -> dict:
+    """The analysis metrics of a typed frame, as written to analysis_{username}.json."""
+    total_comments = len(frame)
+    total_spam = int((frame['spam'] == 'spam').sum())
+    total_comment_length = int(frame['comment_length'].sum())
+    return {
+        "total_comments": total_comments,
+        "average_comment_length": total_comment_length / total_comments if total_comments > 0 else 0,
+        "spam_rate": total_spam / total_comments if total_comments > 0 else 0,
+    }
+
+
+def sentiment_ratios(frame: pd.DataFrame, grouping: str = '1M') -> pd.DataFrame:
+    """
+    Ratio of each sentiment per period of a typed frame.
 
-    # Group by the specified period for time series and sentiment
-    df_grouped = (
-        df_filtered
-        .groupby([pd.Grouper(key='created_at', freq=grouping), 'sentiment'])
+    Only sentiments that occur in the frame get a column, and periods without classified comments are left out.
+    """
+    counts = (
+        frame
+        .groupby([pd.Grouper(key='created_at', freq=grouping), 'sentiment'], observed=True)
         .size()
         .unstack(fill_value=0)
     )
+    counts = counts.loc[:, counts.sum(axis=0) > 0]
+    counts.columns = pd.Index([str(column) for column in counts.columns], name='sentiment')
+    return counts.div(counts.sum(axis=1), axis=0)
 
-    # Calculate the ratio of each sentiment
-    df_ratios = df_grouped.div(df_grouped.sum(axis=1), axis=0)
 
-    return df_ratios
+def spam_distribution(frame: pd.DataFrame) -> pd.DataFrame:
+    """
+    Percentage of spam and non-spam comments of a typed frame, most frequent first (ties in order of appearance).
 
+    The order matters: the report chart colours the slices by position.
+    """
+    spam = frame['spam']
+    codes = spam.cat.codes.to_numpy()
+    codes = codes[codes >= 0]
+    counts = np.bincount(codes, minlength=len(SPAM_LABELS))
+    first_seen = [np.argmax(codes == code) if counts[code] else len(codes) for code in range(len(SPAM_LABELS))]
+    order = sorted((code for code in range(len(SPAM_LABELS)) if counts[code]),
+                   key=lambda code: (-counts[code], first_seen[code]))
+    labels = list(SPAM_LABELS.values())
+    return pd.DataFrame({
+        'Spam': [labels[code] for code in order],
+        'Percentage': [counts[code] / len(codes) * 100 for code in order],
+    })
+
+
+def aggregate(
+    llm_results: Union[list[dict], pd.DataFrame, CommentResults],
+    start_date=None,
+    end_date=None,
+    groupings: Iterable[str] = DEFAULT_GROUPINGS
+) -> dict:
+    """
+    Computes everything the analysis and the report need from one typed frame.
 
-def prepare_spam_barchart_data(analysis_data, start_date, end_date):
+    :param llm_results: Classification results, as a list of dicts, a DataFrame or CommentResults.
+    :param start_date: Start of the period for the time series and spam distribution (datetime), or None.
+    :param end_date: End of that period (datetime), or None.
+    :param groupings: Periods to compute the sentiment time series for.
+
+    :return: Dictionary with 'metrics' (over all results), 'time_series' (sentiment ratios keyed by grouping)
+        and 'spam_distribution'.
     """
-    Prepares a dataframe for visualizing spam distribution as a bar chart.
+    frame = build_frame(llm_results)
+    in_range = frame
+    if start_date is not None or end_date is not None:
+        mask = np.ones(len(frame), dtype=bool)
+        if start_date is not None:
+            mask &= (frame['created_at'] >= start_date).to_numpy()
+        if end_date is not None:
+            mask &= (frame['created_at'] <= end_date).to_numpy()
+        in_range = frame[mask]
+
+    return {
+        "metrics": frame_metrics(frame),
+        "time_series": {grouping: sentiment_ratios(in_range, grouping) for grouping in dict.fromkeys(groupings)},
+        "spam_distribution": spam_distribution(in_range),
+    }
+
+
+def prepare_time_series_data(analysis_data, start_date, end_date, grouping='1M'):
+    """
+    Prepares a dataframe for visualizing sentiment ratios over time.
 
     :param analysis_data: The JSON-like dictionary containing analysis results.
     :param start_date: The start date for the period of interest (datetime object).
     :param end_date: The end date for the period of interest (datetime object).
+    :param grouping: The grouping period for the time series ('1W', '1M', '3M', 'Y'). Default is '1M'.
 
-    :return: pd.DataFrame: DataFrame for spam distribution as a bar chart.
+    :return: DataFrame grouped by time and sentiment ratio.
     """
+    return aggregate(analysis_data['llm_results'], start_date, end_date, groupings=[grouping])['time_series'][grouping]
 
-    # Convert the created_at timestamps to datetime objects
-    df = pd.DataFrame(analysis_data['llm_results'])
-    df['created_at'] = pd.to_datetime(df['created_at'], unit='s')
 
-    # Filter data to the specified date range
-    df_filtered = df[(df['created_at'] >= start_date) & (df['created_at'] <= end_date)]
+def prepare_spam_barchart_data(analysis_data, start_date, end_date):
+    """
+    Prepares a dataframe for visualizing spam distribution as a bar chart.
 
-    # Prepare DataFrame for sentiment distribution as a bar chart
-    df_sentiment_barchart = df_filtered['spam'].value_counts(normalize=True).reset_index()
-    df_sentiment_barchart.columns = ['spam', 'freq']
-    df_sentiment_barchart['spam'] = df_sentiment_barchart['spam'].map({'spam': 'Spam', 'not_spam': 'Not Spam'})
-    df_sentiment_barchart['freq'] = df_sentiment_barchart['freq'] * 100
-    df_sentiment_barchart = df_sentiment_barchart.rename(columns={'spam': 'Spam', 'freq': 'Percentage'})
+    :param analysis_data: The JSON-like dictionary containing analysis results.
+    :param start_date: The start date for the period of interest (datetime object).
+    :param end_date: The end date for the period of interest (datetime object).
 
-    return df_sentiment_barchart
+    :return: pd.DataFrame: DataFrame for spam distribution as a bar chart.
+    """
+    return aggregate(analysis_data['llm_results'], start_date, end_date, groupings=[])['spam_distribution']
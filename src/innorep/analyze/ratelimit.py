@@ -0,0 +1,192 @@
+import re
+import time
+import random
+import asyncio
+from typing import Awaitable, Callable, Mapping, Optional, TypeVar
+
+import openai
+
+
+T = TypeVar("T")
+
+# Errors worth another attempt after a backoff: rate limits and transient network/server failures.
+# A refusal or unparsable answer is not among them: waiting does not change it, so callers retry those on their own
+RETRYABLE_ERRORS = (
+    openai.RateLimitError,
+    openai.APIConnectionError,
+    openai.APITimeoutError,
+    openai.InternalServerError,
+)
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parses an OpenAI reset header such as "1s", "6m0s" or "120ms" into seconds."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after_seconds(headers: Mapping[str, str]) -> Optional[float]:
+    """Reads the retry-after-ms or retry-after header of a 429 response."""
+    retry_after_ms = parse_reset_duration(headers.get("retry-after-ms"))
+    if retry_after_ms is not None:
+        return retry_after_ms / 1000
+    return parse_reset_duration(headers.get("retry-after"))
+
+
+def _header_number(headers: Mapping[str, str], name: str) -> Optional[float]:
+    value = headers.get(name)
+    try:
+        return float(value) if value is not None else None
+    except ValueError:
+        return None
+
+
+def quota_exhausted(headers: Mapping[str, str]) -> bool:
+    """Whether the x-ratelimit-* headers report no requests or no tokens left in the shared budget."""
+    return _header_number(headers, "x-ratelimit-remaining-requests") == 0 or \
+        _header_number(headers, "x-ratelimit-remaining-tokens") == 0
+
+
+def estimate_tokens(messages: list[dict], completion_tokens: int = 20) -> int:
+    """Rough token count of a request (about 4 characters per token) plus the expected answer."""
+    return sum(len(message["content"]) // 4 + 4 for message in messages) + completion_tokens
+
+
+class TokenBucket:
+    """A per-minute budget that refills continuously. Reservations may overdraw it; callers then wait."""
+
+    def __init__(self, per_minute: float):
+        self.capacity = per_minute
+        self.level = per_minute
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def reserve(self, amount: float) -> float:
+        """Takes `amount` from the bucket and returns how many seconds the caller must wait before using it."""
+        self._refill()
+        self.level -= amount
+        return max(0.0, -self.level * 60 / self.capacity)
+
+    def sync(self, limit: Optional[float], remaining: Optional[float]) -> None:
+        """
+        Aligns the bucket with the limit and remaining budget reported by the server.
+
+        The server's remaining budget already counts the requests it has received, including ones this bucket
+        still holds reservations for, so it replaces the level rather than being combined with it.
+        """
+        self._refill()
+        if limit:
+            self.capacity = limit
+        if remaining is not None:
+            self.level = min(self.capacity, remaining)
+
+
+class RateLimiter:
+    """
+    Shared limiter for LLM calls that tracks both requests/min and tokens/min.
+
+    It follows the x-ratelimit-* response headers and retries failed calls with exponential backoff and full jitter.
+    A 429 pauses every caller only when the headers show the shared budget is used up; otherwise (a burst, a
+    per-request limit) only the request that got it backs off.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: float = 500,
+        tokens_per_minute: float = 200_000,
+        max_retries: int = 5,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0
+    ):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.paused_until = 0.0
+        self.retries = 0
+        self.rate_limited = 0
+
+    async def acquire(self, tokens: int) -> None:
+        """Waits until one request of about `tokens` tokens fits in both budgets."""
+        wait = max(
+            self.requests.reserve(1),
+            self.tokens.reserve(tokens),
+            self.paused_until - time.monotonic(),
+        )
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    def update_from_headers(self, headers: Mapping[str, str]) -> None:
+        """Adapts the budgets to the x-ratelimit-* headers of a response."""
+
+        def number(name):
+            return _header_number(headers, name)
+
+        self.requests.sync(number("x-ratelimit-limit-requests"), number("x-ratelimit-remaining-requests"))
+        self.tokens.sync(number("x-ratelimit-limit-tokens"), number("x-ratelimit-remaining-tokens"))
+
+        # Nothing left in one of the budgets: hold every caller until the server resets it
+        resets = []
+        if number("x-ratelimit-remaining-requests") == 0:
+            resets.append(parse_reset_duration(headers.get("x-ratelimit-reset-requests")))
+        if number("x-ratelimit-remaining-tokens") == 0:
+            resets.append(parse_reset_duration(headers.get("x-ratelimit-reset-tokens")))
+        resets = [reset for reset in resets if reset]
+        if resets:
+            self.pause(max(resets))
+
+    def pause(self, seconds: float) -> None:
+        """Holds all callers for at least `seconds`."""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> float:
+        """Delay before retry number `attempt`: the server's retry-after if given, else exponential with full jitter."""
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+
+    async def call(self, make_call: Callable[[], Awaitable[T]], max_retries: Optional[int] = None) -> T:
+        """
+        Runs `make_call`, retrying retryable errors with backoff.
+
+        :param make_call: A function starting a fresh attempt each time it is called.
+        :param max_retries: Overrides the limiter's default number of retries.
+
+        :return: The result of the first successful attempt. The last error is raised if every attempt fails.
+        """
+        max_retries = self.max_retries if max_retries is None else max_retries
+        for attempt in range(max_retries + 1):
+            try:
+                return await make_call()
+            except RETRYABLE_ERRORS as e:
+                if attempt == max_retries:
+                    raise
+                if isinstance(e, openai.RateLimitError):
+                    self.rate_limited += 1
+                    self.update_from_headers(e.response.headers)
+                    delay = self.backoff(attempt, retry_after_seconds(e.response.headers))
+                    if quota_exhausted(e.response.headers):
+                        # The shared quota is used up, so every caller waits, not just this one
+                        self.pause(delay)
+                else:
+                    delay = self.backoff(attempt)
+                self.retries += 1
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        return {"retries": self.retries, "rate_limited": self.rate_limited}
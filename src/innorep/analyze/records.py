@@ -0,0 +1,181 @@
+from array import array
+from typing import TYPE_CHECKING, Iterable, Iterator, Optional, Union
+
+from src.innorep.analyze.models import CommentAnalysis
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Label codes. Sentiments are in alphabetical order, the column order of the sentiment time series
+SENTIMENTS = ('negative', 'neutral', 'positive')
+SPAM_VALUES = ('spam', 'not_spam')
+SOURCES = ('heuristic', 'cache', 'llm', 'batch')
+
+_SENTIMENT_CODES = {value: code for code, value in enumerate(SENTIMENTS)}
+_SPAM_CODES = {value: code for code, value in enumerate(SPAM_VALUES)}
+_SOURCE_CODES = {value: code for code, value in enumerate(SOURCES)}
+
+# A missing label (unclassified comment) or source
+NO_CODE = -1
+
+
+def _code(codes: dict, value) -> int:
+    if value is None:
+        return NO_CODE
+    return codes[getattr(value, 'value', value)]
+
+
+def _label(labels: tuple, code: int) -> Optional[str]:
+    return labels[code] if code != NO_CODE else None
+
+
+class CommentResults:
+    """
+    Classification results of many comments, stored column-wise.
+
+    Labels and sources are kept as one-byte codes and timestamps in a typed array, instead of one dict and one
+    pydantic object per comment; ids and texts are the strings of the scraped comments. Errors are only kept for
+    the few unclassified comments, and the name of the prefilter rule under 'rule' only for the comments the
+    heuristic prefilter settled. `to_frame` builds the categorical DataFrame without touching the strings,
+    `to_dicts` and iteration give the llm_results entries of the analysis JSON.
+
+    created_at is kept in the typed array when it is whole epoch seconds, as scraped. The rare other values (None
+    for a comment without a timestamp, a float) hold 0 in the array and are kept as they were in `odd_created_at`,
+    so entries and the analysis JSON carry exactly the scraped value.
+    """
+
+    __slots__ = ('ids', 'created_at', 'odd_created_at', 'comments', 'sentiment', 'spam', 'source', 'errors', 'rules')
+
+    def __init__(self):
+        self.ids: list[str] = []
+        self.created_at = array('q')
+        self.odd_created_at: dict[int, Optional[float]] = {}
+        self.comments: list[Optional[str]] = []
+        self.sentiment = array('b')
+        self.spam = array('b')
+        self.source = array('b')
+        self.errors: dict[int, str] = {}
+        self.rules: dict[int, str] = {}
+
+    def append(
+        self, comment: dict, result: Optional[CommentAnalysis], source: Optional[str], error: str,
+        rule: Optional[str] = None
+    ) -> None:
+        """
+        Adds the result of one scraped comment; an unclassified comment carries the error instead of labels.
+
+        :param rule: Name of the heuristic rule that classified the comment, for source "heuristic".
+        """
+        if result is None:
+            self.errors[len(self.ids)] = error
+        if rule is not None:
+            self.rules[len(self.ids)] = rule
+        self.ids.append(comment['id'])
+        self._append_created_at(comment.get('created_at'))
+        self.comments.append(comment['text'])
+        self.sentiment.append(_code(_SENTIMENT_CODES, result.sentiment) if result else NO_CODE)
+        self.spam.append(_code(_SPAM_CODES, result.spam) if result else NO_CODE)
+        self.source.append(_code(_SOURCE_CODES, source))
+
+    def append_entry(self, entry: dict) -> None:
+        """Adds one llm_results entry, as loaded from the analysis JSON or the result store."""
+        if entry.get('sentiment') is None:
+            self.errors[len(self.ids)] = entry.get('error') or "not classified"
+        if entry.get('rule') is not None:
+            self.rules[len(self.ids)] = entry['rule']
+        self.ids.append(entry['id'])
+        self._append_created_at(entry.get('created_at'))
+        self.comments.append(entry['comment'])
+        self.sentiment.append(_code(_SENTIMENT_CODES, entry.get('sentiment')))
+        self.spam.append(_code(_SPAM_CODES, entry.get('spam')))
+        self.source.append(_code(_SOURCE_CODES, entry.get('source')))
+
+    def _append_created_at(self, value) -> None:
+        if type(value) is int:
+            self.created_at.append(value)
+        else:
+            self.odd_created_at[len(self.created_at)] = value
+            self.created_at.append(0)
+
+    @classmethod
+    def from_dicts(cls, entries: Iterable[dict]) -> "CommentResults":
+        results = cls()
+        for entry in entries:
+            results.append_entry(entry)
+        return results
+
+    def extend(self, other: "CommentResults") -> None:
+        offset = len(self.ids)
+        self.ids.extend(other.ids)
+        self.created_at.extend(other.created_at)
+        self.comments.extend(other.comments)
+        self.sentiment.extend(other.sentiment)
+        self.spam.extend(other.spam)
+        self.source.extend(other.source)
+        self.errors.update({offset + index: error for index, error in other.errors.items()})
+        self.rules.update({offset + index: rule for index, rule in other.rules.items()})
+        self.odd_created_at.update({offset + index: value for index, value in other.odd_created_at.items()})
+
+    def __add__(self, other: Union["CommentResults", list]) -> "CommentResults":
+        combined = CommentResults()
+        combined.extend(self)
+        combined.extend(other if isinstance(other, CommentResults) else CommentResults.from_dicts(other))
+        return combined
+
+    def __radd__(self, other: list) -> "CommentResults":
+        return CommentResults.from_dicts(other) + self
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def entry(self, index: int) -> dict:
+        """The llm_results entry of one comment."""
+        entry = {
+            'id': self.ids[index],
+            'created_at': self.odd_created_at.get(index, self.created_at[index]) if self.odd_created_at
+            else self.created_at[index],
+            'comment': self.comments[index],
+            'sentiment': _label(SENTIMENTS, self.sentiment[index]),
+            'spam': _label(SPAM_VALUES, self.spam[index]),
+            'source': _label(SOURCES, self.source[index]),
+        }
+        if index in self.errors:
+            entry['error'] = self.errors[index]
+        if index in self.rules:
+            entry['rule'] = self.rules[index]
+        return entry
+
+    def __getitem__(self, index: int) -> dict:
+        return self.entry(range(len(self.ids))[index])
+
+    def __iter__(self) -> Iterator[dict]:
+        return (self.entry(index) for index in range(len(self.ids)))
+
+    def to_dicts(self) -> list[dict]:
+        """The results in the llm_results layout of the analysis JSON."""
+        return list(self)
+
+    def to_frame(self) -> "pd.DataFrame":
+        """The results as a DataFrame with the llm_results columns and categorical labels and source."""
+        import numpy as np
+        import pandas as pd
+
+        errors = pd.Series(self.errors, dtype=object).reindex(range(len(self.ids)))
+        rules = pd.Series(self.rules, dtype=object).reindex(range(len(self.ids)))
+        created_at = np.array(self.created_at, dtype=np.int64)
+        if self.odd_created_at:
+            # A missing timestamp becomes NaN, as in a frame built from the entries
+            created_at = created_at.astype(np.float64)
+            for index, value in self.odd_created_at.items():
+                created_at[index] = np.nan if value is None else value
+        return pd.DataFrame({
+            'id': self.ids,
+            'created_at': created_at,
+            'comment': self.comments,
+            'sentiment': pd.Categorical.from_codes(np.array(self.sentiment, dtype=np.int8), list(SENTIMENTS)),
+            'spam': pd.Categorical.from_codes(np.array(self.spam, dtype=np.int8), list(SPAM_VALUES)),
+            'source': pd.Categorical.from_codes(np.array(self.source, dtype=np.int8), list(SOURCES)),
+            'error': errors.to_numpy(),
+            'rule': rules.to_numpy(),
+        })
@@ -1,4 +1,5 @@
-from typing import Callable, Any
+import asyncio
+from typing import Awaitable, Callable, Any, Optional
 
 
 instruction_extract_base = (
@@ -8,34 +9,65 @@ instruction_extract_base = (
 )
 
 
-async def batch_process_openai(
+def first_error(group: BaseExceptionGroup) -> BaseException:
+    """
+    The error to raise for a failed task group: its first exception that is not a cancellation.
+    The others are printed, so that no failure goes unreported.
+    """
+    errors = [error for error in group.exceptions if not isinstance(error, asyncio.CancelledError)] \
+        or list(group.exceptions)
+    for error in errors[1:]:
+        print(f"Also failed: {type(error).__name__}: {error}")
+    return errors[0]
+
+
+def print_progress(done: int, total: int, every: int = 50) -> None:
+    """Default progress reporter: prints every `every` items and on completion."""
+    if done % every == 0 or done == total:
+        print(f"Processed {done}/{total} items...")
+
+
+async def stream_process_openai(
     items: list[Any],
-    batch_size: int,
-    process_batch: Callable[[list[Any]], Any]
+    process_item: Callable[[Any], Awaitable[Any]],
+    concurrency: int = 30,
+    progress: Optional[Callable[[int, int], None]] = print_progress,
 ) -> list[Any]:
     """
-    Processes a list of items in batches of a given size using the specified processing function.
+    Processes items with at most `concurrency` calls in flight, starting the next item as soon as any call finishes.
+
+    A slow call only occupies its own slot instead of stalling a whole batch.
 
     :param items: The list of items to be processed.
-    :param batch_size: The size of each batch.
-    :param process_batch: A function that takes a list of items and returns the processed results.
+    :param concurrency: The maximum number of concurrent `process_item` calls.
+    :param process_item: A coroutine function that takes a single item and returns its result.
+    :param progress: Optional callback receiving (done, total) after each finished item.
 
-    :return: A list of results after processing all batches.
+    :return: A list of results in the same order as `items`.
     """
     total_items = len(items)
-    results = []
-
-    print(f"Starting processing of {total_items} items in batches of {batch_size}...")
-
-    for i in range(0, total_items, batch_size):
-        batch = items[i:i + batch_size]
+    results = [None] * total_items
+    pending = iter(enumerate(items))
+    done = 0
 
-        print(f"Processing batch {i // batch_size + 1} with {len(batch)} items...")
+    print(f"Starting processing of {total_items} items with concurrency {concurrency}...")
 
-        batch_results = await process_batch(batch)
-        results.extend(batch_results)
+    async def worker():
+        nonlocal done
+        # All workers pull from the same iterator, so each slot is refilled the moment its call returns
+        for index, item in pending:
+            results[index] = await process_item(item)
+            done += 1
+            if progress:
+                progress(done, total_items)
 
-        print(f"Batch {i // batch_size + 1} processed.")
+    workers = [asyncio.create_task(worker()) for _ in range(min(max(concurrency, 1), total_items))]
+    try:
+        await asyncio.gather(*workers)
+    except BaseException:
+        for task in workers:
+            task.cancel()
+        raise
 
     print("Processing complete.")
     return results
@@ -0,0 +1,197 @@
+"""
+Runs the scrape, analysis and PDF stages for many Instagram accounts.
+
+    $ python -m src.innorep.batch_runner user1 user2 --usernames-file accounts.txt
+
+Scraping and analysis are network-bound and run as asyncio tasks, each stage with its own concurrency limit.
+PDF creation is CPU-bound (matplotlib/reportlab hold the GIL) and runs in a process pool. An account failing
+in any stage does not affect the others. A summary manifest of every account is written at the end.
+With --zip, reports are also streamed into one archive as they finish.
+"""
+import time
+import asyncio
+import argparse
+import multiprocessing
+from pathlib import Path
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+from concurrent.futures import ProcessPoolExecutor
+
+from src.innorep.analyze.analyze import create_openai_client
+from src.innorep.analyze.cache import ClassificationCache
+from src.innorep.analyze.ratelimit import RateLimiter
+from src.innorep.instrumentation import recording, span
+from src.innorep.run_llm import analyze_user, cache_path
+from src.innorep.run_scrape import scrape
+from src.innorep.serialization import write_json
+
+if TYPE_CHECKING:
+    from src.innorep.create_pdf import ReportZipWriter
+
+
+def default_report_dir() -> Path:
+    """report/reports under the current working directory, looked up when a batch starts rather than on import."""
+    return Path.cwd() / "report" / "reports"
+
+
+async def run_account(
+    username: str,
+    report_dir: Path,
+    scrape_slots: asyncio.Semaphore,
+    analyze_slots: asyncio.Semaphore,
+    pdf_pool: ProcessPoolExecutor,
+    scrape_options: dict,
+    analyze_options: dict,
+    report_zip: Optional["ReportZipWriter"] = None
+) -> dict:
+    """
+    Runs the three stages for one account and returns its manifest entry. Errors are recorded, not raised.
+
+    The spans of the account are written to a run metrics file (see instrumentation.py), whose path goes into
+    the entry. The report is built in another process, so only its total time is recorded.
+    """
+    entry = {"username": username, "status": "ok", "failed_stage": None, "error": None, "pdf": None, "seconds": {}}
+    stage = "scrape"
+    with recording("batch", username=username) as recorder:
+        try:
+            async with scrape_slots:
+                started = time.perf_counter()
+                with span("scrape"):
+                    await scrape(username, **scrape_options)
+                entry["seconds"]["scrape"] = time.perf_counter() - started
+
+            stage = "analyze"
+            async with analyze_slots:
+                started = time.perf_counter()
+                with span("analyze"):
+                    analysis = await analyze_user(username, **analyze_options)
+                entry["seconds"]["analyze"] = time.perf_counter() - started
+            entry["metrics"] = analysis["metrics"]
+
+            stage = "pdf"
+            started = time.perf_counter()
+            from src.innorep.create_pdf import build_report
+
+            with span("report"):
+                pdf_bytes = await asyncio.get_running_loop().run_in_executor(pdf_pool, build_report, username)
+            entry["seconds"]["pdf"] = time.perf_counter() - started
+            if pdf_bytes is None:
+                raise ValueError(f"No analysis data for {username}")
+            output_pdf = report_dir / f"{username}_innorep_report.pdf"
+            output_pdf.write_bytes(pdf_bytes)
+            entry["pdf"] = str(output_pdf)
+            if report_zip is not None:
+                report_zip.add(username, pdf_bytes)
+        except Exception as e:
+            print(f"{username}: {stage} failed: {e}")
+            entry.update(status="failed", failed_stage=stage, error=f"{type(e).__name__}: {e}")
+    entry["run_metrics"] = str(recorder.save())
+    return entry
+
+
+async def run_batch(
+    usernames: list[str],
+    report_dir: Optional[Path] = None,
+    scrape_concurrency: int = 2,
+    analyze_concurrency: int = 2,
+    pdf_workers: int = 2,
+    posts_max_pages: int = 3,
+    max_comments: Optional[int] = 100,
+    incremental: bool = False,
+    requests_per_minute: float = 500,
+    tokens_per_minute: float = 200_000,
+    zip_path: Optional[Path] = None
+) -> dict:
+    """
+    Creates reports for many accounts and writes a manifest next to them.
+
+    All accounts share one OpenAI client, one rate limiter (the quota is per API key) and one classification cache.
+
+    :param report_dir: Where the reports and the manifest go; defaults to `default_report_dir()`.
+    :param zip_path: Also write every report into this zip archive, added as each one finishes.
+
+    :return: The manifest: run timestamps and one entry per account with status, failed stage, error, PDF path,
+        per-stage durations and metrics.
+    """
+    report_dir = Path(report_dir) if report_dir is not None else default_report_dir()
+    report_dir.mkdir(parents=True, exist_ok=True)
+    started_at = datetime.now().isoformat()
+
+    scrape_slots = asyncio.Semaphore(scrape_concurrency)
+    analyze_slots = asyncio.Semaphore(analyze_concurrency)
+    client = create_openai_client(max_retries=0)
+    limiter = RateLimiter(requests_per_minute=requests_per_minute, tokens_per_minute=tokens_per_minute)
+    cache = ClassificationCache(cache_path)
+    scrape_options = {"posts_max_pages": posts_max_pages, "max_comments": max_comments, "incremental": incremental}
+    analyze_options = {"client": client, "limiter": limiter, "cache": cache, "incremental": incremental}
+
+    # Report dependencies (reportlab, matplotlib) are only loaded by runs that get this far
+    from src.innorep.create_pdf import ReportZipWriter
+
+    report_zip = ReportZipWriter(zip_path) if zip_path else None
+
+    try:
+        # Spawned, not forked: this process runs an event loop, HTTP client threads and SQLite connections, none of
+        # which survive a fork
+        with ProcessPoolExecutor(max_workers=pdf_workers, mp_context=multiprocessing.get_context("spawn")) as pdf_pool:
+            entries = await asyncio.gather(*(
+                run_account(username, report_dir, scrape_slots, analyze_slots, pdf_pool, scrape_options,
+                            analyze_options, report_zip)
+                for username in dict.fromkeys(usernames)
+            ))
+    finally:
+        await client.close()
+        cache.close()
+        if report_zip is not None:
+            report_zip.close()
+
+    manifest = {
+        "started_at": started_at,
+        "finished_at": datetime.now().isoformat(),
+        "succeeded": sum(1 for entry in entries if entry["status"] == "ok"),
+        "failed": sum(1 for entry in entries if entry["status"] != "ok"),
+        "zip": str(zip_path) if zip_path else None,
+        "accounts": entries,
+    }
+    manifest_file = report_dir / f"manifest_{datetime.now().strftime('%Y%m%d-%H%M%S')}.json"
+    write_json(manifest_file, manifest, pretty=True)
+    print(f"{manifest['succeeded']} reports created, {manifest['failed']} failed. Manifest: {manifest_file}")
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Create InnoRep reports for many Instagram accounts.")
+    parser.add_argument("usernames", nargs="*", help="Instagram usernames")
+    parser.add_argument("--usernames-file", type=Path, help="File with one username per line")
+    parser.add_argument("--report-dir", type=Path, help="Where reports go (default: ./report/reports)")
+    parser.add_argument("--scrape-concurrency", type=int, default=2)
+    parser.add_argument("--analyze-concurrency", type=int, default=2)
+    parser.add_argument("--pdf-workers", type=int, default=2)
+    parser.add_argument("--posts-max-pages", type=int, default=3)
+    parser.add_argument("--max-comments", type=int, default=100)
+    parser.add_argument("--incremental", action="store_true", help="Only scrape and analyze new content")
+    parser.add_argument("--zip", type=Path, help="Also write all reports into this zip archive")
+    args = parser.parse_args(argv)
+
+    usernames = list(args.usernames)
+    if args.usernames_file:
+        usernames += [line.strip() for line in args.usernames_file.read_text().splitlines() if line.strip()]
+    if not usernames:
+        parser.error("no usernames given")
+
+    manifest = asyncio.run(run_batch(
+        usernames,
+        report_dir=args.report_dir,
+        scrape_concurrency=args.scrape_concurrency,
+        analyze_concurrency=args.analyze_concurrency,
+        pdf_workers=args.pdf_workers,
+        posts_max_pages=args.posts_max_pages,
+        max_comments=args.max_comments,
+        incremental=args.incremental,
+        zip_path=args.zip,
+    ))
+    return 0 if manifest["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
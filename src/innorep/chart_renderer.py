@@ -0,0 +1,139 @@
+import hashlib
+import threading
+from io import BytesIO
+from pathlib import Path
+from typing import Optional
+from functools import lru_cache
+from collections import OrderedDict
+
+import matplotlib
+import pandas as pd
+import seaborn as sns
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+
+SENTIMENT_PALETTE = {'positive': 'lightblue', 'neutral': 'grey', 'negative': 'lightcoral'}
+SPAM_COLORS = ['lightcoral', 'lightblue']  # lightcoral for Spam and lightblue for Not Spam, as in the sentiment chart
+
+# Matplotlib is not thread-safe (rcParams, font cache, seaborn's global state), and report jobs run in threads:
+# one chart is drawn at a time in the process
+_render_lock = threading.Lock()
+
+
+@lru_cache(maxsize=None)
+def _theme(style: str) -> dict:
+    """The rcParams of a seaborn theme, computed once per style and applied around each render."""
+    return {**sns.plotting_context("notebook"), **sns.axes_style(style)}
+
+
+def frame_hash(df: pd.DataFrame) -> str:
+    """Content hash of a DataFrame: values, index and column names."""
+    digest = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    digest.update(repr(list(df.columns)).encode('utf-8'))
+    return digest.hexdigest()
+
+
+class ChartRenderer:
+    """
+    Renders the report charts to PNG bytes with the Agg backend and no pyplot state.
+
+    Each chart gets its own Figure, so concurrent reports never share a figure or an output file. The theme is set
+    with `matplotlib.rc_context` for the duration of a render and renders are serialized, so the process-global
+    rcParams are never changed under another thread. Renders are cached by the hash of the input DataFrame and the style settings,
+    in memory and optionally in `cache_dir`.
+    """
+
+    def __init__(
+        self,
+        style: str = "whitegrid",
+        dpi: int = 100,
+        max_cached: int = 64,
+        cache_dir: Optional[Path] = None
+    ):
+        self.style = style
+        self.dpi = dpi
+        self.max_cached = max_cached
+        self.cache_dir = Path(cache_dir) if cache_dir else None
+        if self.cache_dir:
+            self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cached(self, kind: str, df: pd.DataFrame, render) -> bytes:
+        key = hashlib.sha256(f"{kind}:{frame_hash(df)}:{self.style}:{self.dpi}".encode('utf-8')).hexdigest()
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                return self._cache[key]
+        cache_file = self.cache_dir / f"{key}.png" if self.cache_dir else None
+        if cache_file and cache_file.exists():
+            png = cache_file.read_bytes()
+        else:
+            with _render_lock, matplotlib.rc_context(_theme(self.style)):
+                png = render(df)
+            if cache_file:
+                cache_file.write_bytes(png)
+        with self._lock:
+            self._cache[key] = png
+            while len(self._cache) > self.max_cached:
+                self._cache.popitem(last=False)
+        return png
+
+    def _save(self, fig: Figure, **kwargs) -> bytes:
+        buffer = BytesIO()
+        fig.tight_layout()
+        fig.savefig(buffer, format='png', dpi=self.dpi, **kwargs)
+        return buffer.getvalue()
+
+    def _render_time_series(self, df_time_series: pd.DataFrame) -> bytes:
+        df_melted = df_time_series.reset_index().melt(id_vars='created_at', var_name='sentiment', value_name='count')
+        df_melted['created_at'] = pd.to_datetime(df_melted['created_at'])
+
+        fig = Figure(figsize=(12, 6))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        sns.lineplot(data=df_melted, x='created_at', y='count', hue='sentiment', palette=SENTIMENT_PALETTE, lw=3,
+                     ax=ax)
+
+        ax.set_xlabel('', fontsize=12)
+        ax.set_ylabel('', fontsize=12)
+        ax.tick_params(axis='x', labelrotation=45)
+        ax.set_yticks(ticks=[i * 0.1 for i in range(1, 11) if i % 2 == 0],
+                      labels=[f"{10*i}%" for i in range(1, 11) if i % 2 == 0])
+        ax.legend(title='Sentiment', loc='upper left')
+        sns.despine(ax=ax)
+        return self._save(fig)
+
+    def _render_spam(self, df_spam_barchart: pd.DataFrame) -> bytes:
+        fig = Figure(figsize=(7, 7))
+        FigureCanvasAgg(fig)
+        ax = fig.add_subplot()
+        ax.pie(df_spam_barchart['Percentage'], labels=df_spam_barchart['Spam'], colors=SPAM_COLORS, startangle=90,
+               counterclock=False, textprops={'fontsize': 20}, wedgeprops=dict(width=0.4, edgecolor='w'),
+               autopct='%1.1f%%', pctdistance=0.8)
+        return self._save(fig, transparent=True)
+
+    def time_series_chart(self, df_time_series: pd.DataFrame) -> bytes:
+        """PNG of the sentiment ratios over time."""
+        return self._cached("time_series", df_time_series, self._render_time_series)
+
+    def spam_chart(self, df_spam_barchart: pd.DataFrame) -> bytes:
+        """PNG of the spam distribution donut chart."""
+        return self._cached("spam", df_spam_barchart, self._render_spam)
+
+    def render_all(self, df_time_series: pd.DataFrame, df_spam_barchart: pd.DataFrame) -> dict[str, bytes]:
+        """Renders both report charts. Returns PNG bytes keyed like create_pdf_report's chart_images."""
+        return {'time_series_chart': self.time_series_chart(df_time_series),
+                'spam_chart': self.spam_chart(df_spam_barchart)}
+
+
+_default_renderer = None
+
+
+def get_renderer() -> ChartRenderer:
+    """The process-wide renderer, so its cache is shared by every report built in this process."""
+    global _default_renderer
+    if _default_renderer is None:
+        _default_renderer = ChartRenderer()
+    return _default_renderer
@@ -1,122 +1,116 @@
-import json
+import zipfile
+import threading
+from functools import lru_cache
+from io import BytesIO
 from datetime import datetime
 from pathlib import Path
 import pandas as pd
-import seaborn as sns
-import matplotlib.pyplot as plt
 from reportlab.platypus import SimpleDocTemplate, Paragraph, Image, Spacer, PageTemplate, Frame, Table, TableStyle
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.lib.styles import ParagraphStyle, getSampleStyleSheet
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import inch
 from reportlab.lib import colors
-from reportlab.lib.utils import ImageReader
 
 # Import your analysis functions
-from src.innorep.analyze.prepare import prepare_time_series_data, prepare_spam_barchart_data
+from src.innorep.analyze.prepare import aggregate
+from src.innorep.instrumentation import span
+from src.innorep.serialization import read_json
+from src.innorep.storage import ResultStore, default_path as store_path
 
 
 def load_json(json_path):
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-        return data
+        return read_json(json_path)
     except Exception as e:
         print(f"Error loading JSON file: {e}")
         return None
 
 
-def create_time_series_chart(df_time_series, grouping, filename):
-    # Prepare data without resetting index to avoid the issue with palette keys
-    df_melted = df_time_series.reset_index().melt(id_vars='created_at', var_name='sentiment', value_name='count')
+def load_analysis(profile_name):
+    """Loads the latest analysis from the result store, falling back to the analysis JSON file."""
+    # Reading a report must not create an empty store
+    if store_path.exists():
+        with ResultStore(read_only=True) as store:
+            analysis_data = store.load_analysis(profile_name, as_frame=True)
+        if analysis_data is not None:
+            return analysis_data
+    json_path = Path(__file__).resolve().parent / "analysis_results" / f"analysis_{profile_name}.json"
+    return load_json(json_path)
+
+
+def get_renderer():
+    # matplotlib and seaborn are imported when the first chart is rendered, not with this module
+    from src.innorep.chart_renderer import get_renderer
 
-    # Convert 'created_at' to datetime if not already
-    df_melted['created_at'] = pd.to_datetime(df_melted['created_at'])
+    return get_renderer()
 
-    # Set Seaborn style for a professional look
-    sns.set(style="whitegrid")
 
-    # Define custom colors
-    palette = {'positive': 'lightblue', 'neutral': 'grey', 'negative': 'lightcoral'}
+def create_time_series_chart(df_time_series, grouping, filename):
+    Path(filename).write_bytes(get_renderer().time_series_chart(df_time_series))
 
-    # Create the plot using Seaborn for a cleaner and more professional look
-    plt.figure(figsize=(12, 6))
-    sns.lineplot(data=df_melted, x='created_at', y='count', hue='sentiment', palette=palette, lw=3)
 
-    # Customize the plot with labels and title
-    plt.xlabel('', fontsize=12)
-    plt.ylabel('', fontsize=12)
-    plt.xticks(rotation=45)
-    plt.yticks(ticks=[i * 0.1 for i in range(1, 11) if i % 2 == 0], labels=[f"{10*i}%" for i in range(1, 11) if i % 2 == 0])
-    plt.legend(title='Sentiment', loc='upper left')
+def create_spam_distribution_chart(df_spam_barchart, filename):
+    Path(filename).write_bytes(get_renderer().spam_chart(df_spam_barchart))
 
-    # Remove image borders
-    sns.despine()
 
-    # Save the figure
-    plt.tight_layout()
-    plt.savefig(filename)
-    plt.close()
+background_image_path = str(Path(__file__).resolve().parent / 'background.jpg')  # Replace with your image filename
 
+FOOTER_TEXT = (
+    "This is a demo. The full version delivers deeper insights and personalized strategies to elevate your audience "
+    "engagement and reputation."
+)
 
-def create_spam_distribution_chart(df_spam_barchart, filename):
-    # Prepare data
-    labels = df_spam_barchart['Spam']
-    percentages = df_spam_barchart['Percentage']
+# Paragraph.drawOn briefly attaches the canvas to the paragraph, so shared paragraphs are drawn one at a time
+_page_lock = threading.Lock()
 
-    # Plot
-    plt.figure(figsize=(7, 7))
-    colors = ['lightcoral', 'lightblue']  # Use same colors as sentiment: lightcoral for Spam and lightblue for Not Spam
-    plt.pie(percentages, labels=labels, colors=colors, startangle=90, counterclock=False, textprops={'fontsize': 20},
-            wedgeprops=dict(width=0.4, edgecolor='w'), autopct='%1.1f%%', pctdistance=0.8)
 
-    # Show the figure
-    plt.tight_layout()
-    plt.savefig(filename, transparent=True)
-    plt.close()
+@lru_cache(maxsize=None)
+def page_styles():
+    """Header and footer styles, derived from 'Normal' once per process instead of changing it on every page."""
+    normal = getSampleStyleSheet()['Normal']
+    return {
+        'header': ParagraphStyle('ReportHeader', parent=normal, fontSize=9, textColor=colors.grey),
+        'footer': ParagraphStyle('ReportFooter', parent=normal, fontSize=7, textColor=colors.grey),
+    }
+
+
+@lru_cache(maxsize=32)
+def page_paragraph(text, style_name, width, height):
+    """A header or footer paragraph, parsed and wrapped once per text and frame size. Returns (paragraph, height)."""
+    paragraph = Paragraph(text, page_styles()[style_name])
+    _, h = paragraph.wrap(width, height)
+    return paragraph, h
 
 
 def header_footer(canvas, doc):
     canvas.saveState()
 
-    # Draw the background image
-    current_dir = Path(__file__).resolve().parent
-    bg_image_path = current_dir / 'background.jpg'  # Replace with your image filename
-    bg_image = ImageReader(bg_image_path)
+    # Draw the background image. Given by path, reportlab embeds the JPEG as is, once per document,
+    # and reuses that image object on every page instead of decoding and hashing it each time
     width, height = A4  # Use A4 dimensions
-    canvas.drawImage(bg_image, 0, 0, width=width, height=height)
-
-    styles = getSampleStyleSheet()
+    canvas.drawImage(background_image_path, 0, 0, width=width, height=height)
 
     # Header
-    header_style = styles['Normal']
-    header_style.fontSize = 9
-    header_style.textColor = colors.grey
-
     current_date = datetime.now().strftime('%Y-%m-%d')
-    header_text = Paragraph(f"InnoRep Analytical Report - {current_date}", header_style)
-    w, h = header_text.wrap(doc.width, doc.topMargin)
-    header_text.drawOn(canvas, doc.leftMargin, doc.height + doc.topMargin - h + 60)
+    header_text, h = page_paragraph(
+        f"InnoRep Analytical Report - {current_date}", 'header', doc.width, doc.topMargin)
 
     # # Optional: Add a logo to the header
     # logo = ImageReader(current_dir / 'logo.png')  # Replace with your logo's path
     # canvas.drawImage(logo, doc.width - inch, doc.height + doc.topMargin - h + 5, width=150, height=50)
 
     # Footer
-    footer_style = styles['Normal']
-    footer_style.fontSize = 7
-    footer_style.textColor = colors.grey
+    footer_text, footer_h = page_paragraph(FOOTER_TEXT, 'footer', doc.width, doc.bottomMargin)
 
-    footer_text = Paragraph(
-        "This is a demo. The full version delivers deeper insights and personalized strategies to elevate your audience engagement and reputation.",
-        footer_style
-    )
-    w, h = footer_text.wrap(doc.width, doc.bottomMargin)
-    footer_text.drawOn(canvas, doc.leftMargin, h)
+    with _page_lock:
+        header_text.drawOn(canvas, doc.leftMargin, doc.height + doc.topMargin - h + 60)
+        footer_text.drawOn(canvas, doc.leftMargin, footer_h)
 
     canvas.restoreState()
 
 
 def create_pdf_report(output_path, chart_images, analysis_data, start_date, end_date, df_spam_barchart, df_time_series):
+    # output_path and the chart images may be file paths or in-memory binary buffers
     doc = SimpleDocTemplate(output_path, pagesize=A4)
     styles = getSampleStyleSheet()
     flowables = []
@@ -224,43 +218,78 @@ def create_pdf_report(output_path, chart_images, analysis_data, start_date, end_
     doc.addPageTemplates([template])
 
     # Build PDF
-    doc.build(flowables)
-
+    with span("doc_build"):
+        doc.build(flowables)
 
-def main(profile_name, output_pdf):
-    # Adjust paths using Path objects
-    json_path = Path(__file__).resolve().parent / "analysis_results" / f"analysis_{profile_name}.json"
 
+def build_report(profile_name):
+    """Builds the PDF report of a profile entirely in memory and returns its bytes, or None without analysis data."""
     # Load analysis data
-    analysis_data = load_json(json_path)
+    with span("load_analysis"):
+        analysis_data = load_analysis(profile_name)
     if not analysis_data:
         print("Failed to load analysis data.")
-        return
+        return None
 
     # Define date range and grouping
     start_date = datetime(2023, 1, 1)
     end_date = datetime.now()
     grouping = '1M'
 
-    # Prepare data
-    df_time_series = prepare_time_series_data(analysis_data, start_date, end_date, grouping=grouping)
-    df_spam_barchart = prepare_spam_barchart_data(analysis_data, start_date, end_date)
+    # Prepare data: one pass over the results for the time series and the spam distribution
+    with span("aggregate"):
+        aggregates = aggregate(analysis_data['llm_results'], start_date, end_date, groupings=[grouping])
+    df_time_series = aggregates['time_series'][grouping]
+    df_spam_barchart = aggregates['spam_distribution']
 
-    # Create and save charts
-    charts_dir = Path(__file__).resolve().parent / "charts"
-    charts_dir.mkdir(parents=True, exist_ok=True)
-    time_series_chart_file = charts_dir / 'time_series_chart.png'
-    spam_chart_file = charts_dir / 'spam_chart.png'
+    # Render both charts in parallel (or take them from the render cache) straight into memory
+    with span("chart_render"):
+        charts = get_renderer().render_all(df_time_series, df_spam_barchart)
+    chart_images = {name: BytesIO(png) for name, png in charts.items()}
 
-    create_time_series_chart(df_time_series, grouping, str(time_series_chart_file))
-    create_spam_distribution_chart(df_spam_barchart, str(spam_chart_file))
+    # Create PDF report into a buffer
+    pdf_buffer = BytesIO()
+    create_pdf_report(pdf_buffer, chart_images, analysis_data, start_date, end_date, df_spam_barchart, df_time_series)
+    return pdf_buffer.getvalue()
 
-    # Create PDF report
-    chart_images = {
-        'time_series_chart': str(time_series_chart_file),
-        'spam_chart': str(spam_chart_file)
-    }
 
-    create_pdf_report(output_pdf, chart_images, analysis_data, start_date, end_date, df_spam_barchart, df_time_series)
+class ReportZipWriter:
+    """Writes reports into one zip archive as they are produced, so only the current report is held in memory."""
+
+    def __init__(self, target):
+        """:param target: A path or a writable binary file object."""
+        self._zip = zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED)
+
+    def add(self, profile_name, pdf_bytes):
+        with self._zip.open(f"{profile_name}_innorep_report.pdf", 'w') as f:
+            f.write(pdf_bytes)
+
+    def close(self):
+        self._zip.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_reports_zip(profile_names, target):
+    """Builds the reports of several profiles one after another into a zip archive. Returns the profiles included."""
+    included = []
+    with ReportZipWriter(target) as writer:
+        for profile_name in profile_names:
+            pdf_bytes = build_report(profile_name)
+            if pdf_bytes is not None:
+                writer.add(profile_name, pdf_bytes)
+                included.append(profile_name)
+    return included
+
+
+def main(profile_name, output_pdf):
+    pdf_bytes = build_report(profile_name)
+    if pdf_bytes is None:
+        return
 
+    Path(output_pdf).write_bytes(pdf_bytes)
     print(f"PDF report has been generated: {output_pdf}")
@@ -0,0 +1,245 @@
+"""
+Timing spans for the stages of a run, collected per run and summarized into a metrics file.
+
+    with recording("pipeline", username=username) as recorder:
+        ...  # code calling `with span("stage"): ...`
+    recorder.save()
+
+Values that are not timings, such as the deduplication ratio of an analysis, are recorded with
+`set_gauge(name, value)` and reported with the run.
+
+Outside `recording` a span or gauge records nothing and costs a context variable lookup. The recorder is kept in a
+context variable, so asyncio tasks started inside `recording` (and the concurrent runs of a batch) report to the
+recorder of their own run. Work handed to threads or processes is not recorded unless it records spans itself.
+
+Exporters: `Recorder.prometheus_text` renders the summary in the Prometheus text format, written next to the
+JSON file when INNOREP_PROMETHEUS_DIR is set (for the node exporter textfile collector). `enable_opentelemetry`
+additionally sends every span to OpenTelemetry, if it is installed and configured.
+"""
+import os
+import time
+import uuid
+import threading
+from pathlib import Path
+from datetime import datetime
+from contextlib import ExitStack, contextmanager
+from contextvars import ContextVar
+from typing import Iterator, Optional
+
+from src.innorep.serialization import write_json
+
+
+default_dir = Path(__file__).parent / "results" / "metrics"
+
+# Numeric span attributes that are summed into the run totals. Only the llm_request and batch_job spans carry
+# tokens and cost, and never for the same request
+TOTALS = ("prompt_tokens", "completion_tokens", "cost_usd", "retries")
+
+_recorder: ContextVar[Optional["Recorder"]] = ContextVar("innorep_recorder", default=None)
+_tracer = None
+
+
+def percentile(values: list[float], q: float) -> float:
+    """The q-th percentile (0-100) of the values, linearly interpolated."""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Recorder:
+    """The spans of one run: pipeline, analysis or report of one account."""
+
+    def __init__(self, run: str, **labels):
+        self.run = run
+        self.labels = labels
+        self.started_at = datetime.now().isoformat()
+        self.finished_at = None
+        self.seconds = None
+        self.spans: list[dict] = []
+        self.gauges: dict[str, float] = {}
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def record(self, name: str, seconds: float, **attributes) -> None:
+        with self._lock:
+            self.spans.append({"name": name, "seconds": seconds, **attributes})
+
+    def set_gauge(self, name: str, value: float) -> None:
+        with self._lock:
+            self.gauges[name] = value
+
+    def stages(self) -> dict[str, dict]:
+        """Count, total, p50/p95/max latency and attribute totals of the spans, by span name."""
+        grouped = {}
+        with self._lock:
+            for span_data in self.spans:
+                grouped.setdefault(span_data["name"], []).append(span_data)
+        stages = {}
+        for name, spans in grouped.items():
+            seconds = [span_data["seconds"] for span_data in spans]
+            stage = {
+                "count": len(spans),
+                "total_seconds": sum(seconds),
+                "p50_seconds": percentile(seconds, 50),
+                "p95_seconds": percentile(seconds, 95),
+                "max_seconds": max(seconds),
+                "errors": sum(1 for span_data in spans if span_data.get("error")),
+            }
+            for key in TOTALS:
+                if any(key in span_data for span_data in spans):
+                    stage[key] = sum(span_data.get(key) or 0 for span_data in spans)
+            stages[name] = stage
+        return stages
+
+    def summary(self) -> dict:
+        stages = self.stages()
+        totals = {key: sum(stage.get(key, 0) for stage in stages.values()) for key in TOTALS}
+        return {
+            "run": self.run,
+            **self.labels,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+            "seconds": self.seconds if self.seconds is not None else time.perf_counter() - self._started,
+            "totals": totals,
+            "gauges": dict(self.gauges),
+            "stages": stages,
+        }
+
+    def prometheus_text(self) -> str:
+        """The summary in the Prometheus text exposition format."""
+        labels = {"run": self.run, **{key: str(value) for key, value in self.labels.items()}}
+
+        def series(name, extra=None):
+            all_labels = {**labels, **(extra or {})}
+            rendered = ",".join(f'{key}="{_escape(value)}"' for key, value in all_labels.items())
+            return f"{name}{{{rendered}}}"
+
+        summary = self.summary()
+        lines = [
+            "# HELP innorep_stage_seconds Latency of the spans of a run by stage.",
+            "# TYPE innorep_stage_seconds summary",
+        ]
+        for stage, data in summary["stages"].items():
+            for quantile, key in (("0.5", "p50_seconds"), ("0.95", "p95_seconds")):
+                lines.append(f"{series('innorep_stage_seconds', {'stage': stage, 'quantile': quantile})} {data[key]}")
+            lines.append(f"{series('innorep_stage_seconds_sum', {'stage': stage})} {data['total_seconds']}")
+            lines.append(f"{series('innorep_stage_seconds_count', {'stage': stage})} {data['count']}")
+        lines += [
+            "# HELP innorep_run_total Totals of a run (tokens, cost, retries).",
+            "# TYPE innorep_run_total gauge",
+        ]
+        for key, value in summary["totals"].items():
+            lines.append(f"{series('innorep_run_total', {'kind': key})} {value}")
+        if summary["gauges"]:
+            lines += [
+                "# HELP innorep_run_gauge Values measured in a run (deduplication ratio, ...).",
+                "# TYPE innorep_run_gauge gauge",
+            ]
+            for key, value in summary["gauges"].items():
+                lines.append(f"{series('innorep_run_gauge', {'kind': key})} {value}")
+        lines += [
+            "# HELP innorep_run_seconds Wall time of a run.",
+            "# TYPE innorep_run_seconds gauge",
+            f"{series('innorep_run_seconds')} {summary['seconds']}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    def save(self, directory: Path = default_dir, include_spans: bool = False) -> Path:
+        """
+        Writes the summary to run_<name>_<timestamp>_<random suffix>.json in `directory` and, if INNOREP_PROMETHEUS_DIR is set,
+        the Prometheus text to innorep_<name>.prom there.
+
+        :param include_spans: Also write every single span.
+        :return: The path of the JSON file.
+        """
+        self.finished_at = self.finished_at or datetime.now().isoformat()
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        name = "_".join([self.run, *(str(value) for value in self.labels.values())])
+        # A random suffix, so runs finishing in the same second (parallel jobs, other processes) do not overwrite
+        path = directory / f"run_{name}_{datetime.now().strftime('%Y%m%d-%H%M%S')}_{uuid.uuid4().hex[:8]}.json"
+        summary = self.summary()
+        if include_spans:
+            summary["spans"] = list(self.spans)
+        write_json(path, summary, pretty=True)
+
+        prometheus_dir = os.environ.get("INNOREP_PROMETHEUS_DIR")
+        if prometheus_dir:
+            prometheus_file = Path(prometheus_dir) / f"innorep_{name}.prom"
+            temp_file = prometheus_file.with_name(f".{prometheus_file.name}.tmp")
+            temp_file.write_text(self.prometheus_text(), encoding='utf-8')
+            os.replace(temp_file, prometheus_file)
+        return path
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def current_recorder() -> Optional[Recorder]:
+    return _recorder.get()
+
+
+@contextmanager
+def recording(run: str, **labels) -> Iterator[Recorder]:
+    """Collects the spans of the code inside (and of the tasks it starts) into a new Recorder."""
+    recorder = Recorder(run, **labels)
+    token = _recorder.set(recorder)
+    try:
+        yield recorder
+    finally:
+        recorder.finished_at = datetime.now().isoformat()
+        recorder.seconds = time.perf_counter() - recorder._started
+        _recorder.reset(token)
+
+
+@contextmanager
+def span(name: str, **attributes) -> Iterator[dict]:
+    """
+    Times the code inside as one span of the current run.
+
+    The yielded dict holds the span attributes and can be extended inside (for example with token counts).
+    An exception marks the span with an error and is raised again.
+    """
+    recorder = _recorder.get()
+    if recorder is None and _tracer is None:
+        yield attributes
+        return
+    with ExitStack() as stack:
+        otel_span = stack.enter_context(_tracer.start_as_current_span(name)) if _tracer is not None else None
+        started = time.perf_counter()
+        try:
+            yield attributes
+        except BaseException as e:
+            attributes["error"] = type(e).__name__
+            raise
+        finally:
+            seconds = time.perf_counter() - started
+            if recorder is not None:
+                recorder.record(name, seconds, **attributes)
+            if otel_span is not None:
+                otel_span.set_attributes({key: value for key, value in attributes.items()
+                                          if isinstance(value, (str, bool, int, float))})
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Records a value of the current run, replacing an earlier value of the same name."""
+    recorder = _recorder.get()
+    if recorder is not None:
+        recorder.set_gauge(name, value)
+
+
+def enable_opentelemetry(tracer_name: str = "innorep") -> None:
+    """
+    Also reports every span to OpenTelemetry, through the globally configured tracer provider.
+
+    Raises ImportError if opentelemetry-api is not installed.
+    """
+    global _tracer
+    from opentelemetry import trace
+
+    _tracer = trace.get_tracer(tracer_name)
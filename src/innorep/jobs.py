@@ -0,0 +1,192 @@
+import os
+import time
+import uuid
+import sqlite3
+import asyncio
+import threading
+from pathlib import Path
+from typing import Optional
+from concurrent.futures import ThreadPoolExecutor
+
+from src.innorep.instrumentation import recording
+
+
+default_path = Path(__file__).parent / "results" / "jobs.sqlite"
+default_report_dir = Path(__file__).parent / "results" / "reports"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    status TEXT NOT NULL,
+    stage TEXT,
+    message TEXT,
+    error TEXT,
+    pdf_path TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL,
+    finished_at REAL,
+    owner TEXT,
+    heartbeat REAL
+);
+CREATE INDEX IF NOT EXISTS idx_jobs_username ON jobs (username, created_at);
+"""
+
+# Job statuses; queued and running jobs are "in flight"
+QUEUED, RUNNING, DONE, FAILED = "queued", "running", "done", "failed"
+IN_FLIGHT = (QUEUED, RUNNING)
+
+# Columns added after the first version of the table, created on tables that lack them
+_ADDED_COLUMNS = (("owner", "TEXT"), ("heartbeat", "REAL"))
+
+
+class JobQueue:
+    """
+    Runs report jobs (scrape, analyze, PDF) in background threads and records them in a SQLite job table.
+
+    A request for a username that already has a job in flight gets that job instead of a new one, and a
+    request for a username whose report was finished less than `max_age` seconds ago gets the finished job,
+    so its PDF is served without running anything. Every job records its current stage and a progress
+    message, which the app polls.
+
+    Several processes (app instances, workers) can share the job table. Each queue refreshes the heartbeat of the
+    jobs it owns every `heartbeat_interval` seconds; an in-flight job whose heartbeat is older than three intervals
+    was left by a process that stopped and is marked failed, on start and then at every heartbeat. Jobs of the
+    other live processes are left alone.
+    """
+
+    def __init__(
+        self,
+        path: Path = default_path,
+        report_dir: Path = default_report_dir,
+        workers: int = 2,
+        max_age: float = 24 * 3600,
+        pipeline_options: Optional[dict] = None,
+        heartbeat_interval: float = 30.0
+    ):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.report_dir = Path(report_dir)
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+        self.max_age = max_age
+        self.pipeline_options = pipeline_options or {}
+        self.heartbeat_interval = heartbeat_interval
+        # Not the pid, which a restarted container gets again: it would keep the jobs of its predecessor alive
+        self.owner = uuid.uuid4().hex
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="innorep-job")
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(SCHEMA)
+            columns = {row['name'] for row in self._conn.execute("PRAGMA table_info(jobs)")}
+            for name, column_type in _ADDED_COLUMNS:
+                if name not in columns:
+                    self._conn.execute(f"ALTER TABLE jobs ADD COLUMN {name} {column_type}")
+        self._fail_orphaned()
+        self._stop = threading.Event()
+        self._heartbeat = threading.Thread(target=self._beat, name="innorep-job-heartbeat", daemon=True)
+        self._heartbeat.start()
+
+    def submit(self, username: str) -> str:
+        """Returns the id of the job producing the report of `username`: in flight, fresh, or newly queued."""
+        username = username.strip().lstrip("@")
+        if not username:
+            raise ValueError("username is empty")
+        with self._lock, self._conn:
+            reusable = self._conn.execute(
+                "SELECT id, status, pdf_path FROM jobs WHERE username = ? "
+                "AND (status IN (?, ?) OR (status = ? AND finished_at >= ?)) ORDER BY created_at DESC LIMIT 1",
+                (username, *IN_FLIGHT, DONE, time.time() - self.max_age),
+            ).fetchone()
+            if reusable is not None and (reusable['status'] != DONE or Path(reusable['pdf_path']).exists()):
+                return reusable['id']
+            job_id = uuid.uuid4().hex
+            now = time.time()
+            self._conn.execute(
+                "INSERT INTO jobs (id, username, status, stage, message, created_at, updated_at, owner, heartbeat) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job_id, username, QUEUED, "queued", "Waiting for a free worker", now, now, self.owner, now),
+            )
+        self._pool.submit(self._run, job_id, username)
+        return job_id
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row is not None else None
+
+    def load_pdf(self, job_id: str) -> Optional[bytes]:
+        """The PDF of a finished job, or None."""
+        job = self.get(job_id)
+        if job is None or job['status'] != DONE or not job['pdf_path'] or not Path(job['pdf_path']).exists():
+            return None
+        return Path(job['pdf_path']).read_bytes()
+
+    def _update(self, job_id: str, **fields) -> None:
+        fields['updated_at'] = time.time()
+        assignments = ", ".join(f"{name} = ?" for name in fields)
+        with self._lock, self._conn:
+            self._conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def _fail_orphaned(self) -> None:
+        """Marks failed the in-flight jobs whose owner stopped refreshing their heartbeat."""
+        now = time.time()
+        with self._lock, self._conn:
+            # Jobs of tables older than the heartbeat column only have updated_at to go by
+            self._conn.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? "
+                "WHERE status IN (?, ?) AND COALESCE(heartbeat, updated_at) < ?",
+                (FAILED, "interrupted", now, *IN_FLIGHT, now - 3 * self.heartbeat_interval),
+            )
+
+    def _beat(self) -> None:
+        while not self._stop.wait(self.heartbeat_interval):
+            with self._lock, self._conn:
+                self._conn.execute(
+                    "UPDATE jobs SET heartbeat = ? WHERE owner = ? AND status IN (?, ?)",
+                    (time.time(), self.owner, *IN_FLIGHT),
+                )
+            self._fail_orphaned()
+
+    def _run(self, job_id: str, username: str) -> None:
+        # Imported here so that the app starts without loading the pipeline dependencies
+        from src.innorep.create_pdf import build_report
+        from src.innorep.pipeline import run_pipeline
+
+        with recording("job", username=username) as recorder:
+            try:
+                self._update(job_id, status=RUNNING, stage="scrape_analyze",
+                             message=f"Scraping and analyzing Instagram profile: {username}")
+                analysis = asyncio.run(run_pipeline(username, **self.pipeline_options))
+
+                total_comments = analysis['metrics']['total_comments']
+                self._update(job_id, stage="report", message=f"Creating PDF report ({total_comments} comments analyzed)")
+                pdf_bytes = build_report(username)
+                if pdf_bytes is None:
+                    raise ValueError(f"No analysis data for {username}")
+                pdf_path = self.report_dir / f"{username}_innorep_report.pdf"
+                temp_path = pdf_path.with_name(f".{pdf_path.name}.{job_id}.tmp")
+                temp_path.write_bytes(pdf_bytes)
+                os.replace(temp_path, pdf_path)
+
+                self._update(job_id, status=DONE, stage="done", message="Report generated.", pdf_path=str(pdf_path),
+                             finished_at=time.time())
+            except Exception as e:
+                print(f"Job {job_id} for {username} failed: {e}")
+                self._update(job_id, status=FAILED, error=f"{type(e).__name__}: {e}", finished_at=time.time())
+        recorder.save()
+
+    def close(self, wait: bool = True) -> None:
+        self._pool.shutdown(wait=wait)
+        self._stop.set()
+        self._heartbeat.join()
+        with self._lock:
+            self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
@@ -0,0 +1,105 @@
+import asyncio
+from datetime import datetime
+from typing import Optional
+
+from openai import AsyncOpenAI
+
+from src.innorep.analyze.analyze import analyze_comment_queue
+from src.innorep.analyze.cache import ClassificationCache
+from src.innorep.analyze.heuristics import HeuristicClassifier
+from src.innorep.analyze.records import CommentResults
+from src.innorep.analyze.utils import first_error
+from src.innorep.instrumentation import recording
+from src.innorep.run_llm import cache_path, load_previous_results, save_analysis
+from src.innorep.run_scrape import (
+    configure_scrapfly, load_previous_scrape, merge_posts, save_posts, save_state, save_user
+)
+from src.innorep.scrape import instagram
+
+
+async def run_pipeline(
+    username: str,
+    posts_max_pages: int = 3,
+    max_comments: Optional[int] = 100,
+    scrape_concurrency: int = 4,
+    concurrency: int = 30,
+    queue_size: int = 1000,
+    client: Optional[AsyncOpenAI] = None,
+    cache: Optional[ClassificationCache] = None,
+    use_cache: bool = True,
+    heuristic_threshold: Optional[float] = 0.9,
+    incremental: bool = False
+) -> dict:
+    """
+    Scrapes a profile and classifies its comments at the same time.
+
+    Comments of each post go into a bounded queue as soon as the post is scraped, and the classification workers
+    take them from there, so the run takes about as long as the slower of the two stages instead of their sum.
+    When the queue is full, scraping waits for classification to catch up. The usual user_{username}.json,
+    all-user-posts_{username}.json and analysis_{username}.json files are written at the end.
+
+    :param queue_size: Maximum number of scraped comments waiting for classification.
+    :param incremental: Stop scraping at content stored by the previous run and classify only the new comments,
+        merging them into the stored posts and analysis.
+
+    :return: The analysis data, as written to analysis_{username}.json (with compact results under 'llm_results').
+    """
+    configure_scrapfly()
+    timestamp = datetime.now().isoformat()
+
+    user_info = await instagram.scrape_user(username)
+    save_user(username, user_info, timestamp)
+
+    previous_posts, state = load_previous_scrape(username) if incremental else ([], {})
+    previous_results = load_previous_results(username) if incremental else CommentResults()
+    known_comment_ids = {
+        post['id']: {comment['id'] for comment in post.get('comments') or []} for post in previous_posts
+    }
+    classified_ids = set(previous_results.ids)
+
+    queue = asyncio.Queue(maxsize=queue_size)
+    scraped_posts = []
+
+    async def produce():
+        async for post in instagram.scrape_user_posts(
+                user_info['id'], max_pages=posts_max_pages, max_comments=max_comments,
+                concurrency=scrape_concurrency, since=state.get('last_taken_at'),
+                known_comment_ids=known_comment_ids):
+            scraped_posts.append(post)
+            for comment in post.get('comments') or []:
+                if comment['id'] not in classified_ids:
+                    await queue.put(comment)
+        await queue.put(None)
+
+    own_cache = cache is None and use_cache
+    if own_cache:
+        cache = ClassificationCache(cache_path)
+    prefilter = HeuristicClassifier(threshold=heuristic_threshold) if heuristic_threshold is not None else None
+
+    run_stats = {}
+    try:
+        # If either side fails, the task group cancels the other and waits for it, so no worker is still using
+        # the cache when it is closed and the producer never blocks on a queue nobody reads
+        async with asyncio.TaskGroup() as group:
+            group.create_task(produce())
+            analysis = group.create_task(analyze_comment_queue(
+                queue, concurrency=concurrency, client=client, cache=cache, prefilter=prefilter, stats=run_stats))
+        results = analysis.result()
+    except BaseExceptionGroup as e:
+        raise first_error(e) from None
+    finally:
+        if own_cache:
+            cache.close()
+
+    posts_all, _ = merge_posts(previous_posts, scraped_posts)
+    save_posts(username, posts_all, timestamp)
+    save_state(username, posts_all, timestamp)
+    return save_analysis(username, previous_results + results, run_stats)
+
+
+def main(username: str, **kwargs) -> dict:
+    """Runs the pipeline and writes its run metrics (see instrumentation.py)."""
+    with recording("pipeline", username=username) as recorder:
+        analysis = asyncio.run(run_pipeline(username, **kwargs))
+    print(f"Run metrics: {recorder.save()}")
+    return analysis
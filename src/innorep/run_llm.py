@@ -1,14 +1,28 @@
-import json
 import asyncio
+import warnings
 from pathlib import Path
 from datetime import datetime
+from typing import Optional
+
+from openai import AsyncOpenAI
 
 from src.innorep.analyze.analyze import analyze_comments, calculate_metrics
+from src.innorep.analyze.batch import BatchTransport
+from src.innorep.analyze.cache import ClassificationCache
+from src.innorep.analyze.checkpoint import AnalysisCheckpoint
+from src.innorep.analyze.heuristics import HeuristicClassifier
+from src.innorep.analyze.ratelimit import RateLimiter
+from src.innorep.analyze.records import CommentResults
+from src.innorep.instrumentation import recording
+from src.innorep.serialization import read_json, write_json
+from src.innorep.storage import ResultStore
 
 
 input_dir = Path(__file__).parent / "scrape_results"
 output_dir = Path(__file__).parent / "analysis_results"
 output_dir.mkdir(exist_ok=True)
+cache_path = output_dir / "classification_cache.sqlite"
+checkpoint_dir = output_dir / "checkpoints"
 
 
 def get_latest_file(username: str, prefix: str) -> Path:
@@ -19,24 +33,113 @@ def get_latest_file(username: str, prefix: str) -> Path:
     return max(files, key=lambda f: f.stat().st_mtime)
 
 
-def main(username: str, batch_size: int = 30):
-    # Load user data (as before)
-    user_file = get_latest_file(username, "user")
-    with open(user_file, 'r', encoding='utf-8') as f:
-        user_data = json.load(f)
+def main(username: str, batch_size: Optional[int] = None, **kwargs):
+    """
+    Synchronous entry point for `analyze_user`; see it for the options. Also writes the run metrics.
 
-    # Load posts data (as before)
-    posts_file = get_latest_file(username, "all-user-posts")
-    with open(posts_file, 'r', encoding='utf-8') as f:
-        posts_data = json.load(f)
+    :param batch_size: Deprecated name of `concurrency`, the number of requests in flight.
+    """
+    if batch_size is not None:
+        warnings.warn("batch_size is deprecated, use concurrency", DeprecationWarning, stacklevel=2)
+        kwargs.setdefault('concurrency', batch_size)
+    with recording("analysis", username=username) as recorder:
+        analysis = asyncio.run(analyze_user(username, **kwargs))
+    print(f"Run metrics: {recorder.save()}")
+    return analysis
+
+
+async def analyze_user(
+    username: str,
+    concurrency: int = 30,
+    client: Optional[AsyncOpenAI] = None,
+    cache: Optional[ClassificationCache] = None,
+    use_cache: bool = True,
+    mode: str = "live",
+    pack_size: int = 20,
+    batch_transport: Optional[BatchTransport] = None,
+    heuristic_threshold: Optional[float] = 0.9,
+    incremental: bool = False,
+    limiter: Optional[RateLimiter] = None,
+    resume: bool = True
+) -> dict:
+    """
+    Classifies the scraped comments of a user and writes analysis_{username}.json.
+
+    A client and rate limiter passed in can be shared by several users analyzed at the same time.
 
+    In incremental mode, comments already classified by the previous run are kept as they are and only new
+    (or previously failed) comments are analyzed.
+
+    With `resume`, classifications are checkpointed under analysis_results/checkpoints while the run goes on. A run
+    that fails or is killed is resumed by the next run on the same comments; the checkpoint is removed once the
+    analysis is saved.
+    """
     comments = []
-    for post in posts_data['posts_all']:
+    for post in load_posts(username):
         comments.extend(post.get('comments', []))
 
+    previous_results = load_previous_results(username) if incremental else CommentResults()
+    done_ids = set(previous_results.ids)
+    comments = [comment for comment in comments if comment['id'] not in done_ids]
+    print(f"Analyzing {len(comments)} comments ({len(done_ids)} kept from the previous run)")
+
+    # Reuse classifications from previous runs unless disabled
+    own_cache = cache is None and use_cache
+    if own_cache:
+        cache = ClassificationCache(cache_path)
+
+    # Settle obvious spam/praise locally; None sends every comment to the model
+    prefilter = HeuristicClassifier(threshold=heuristic_threshold) if heuristic_threshold is not None else None
+
+    checkpoint = AnalysisCheckpoint(checkpoint_dir, username) if resume else None
+
     # Analyze comments asynchronously
-    results = asyncio.run(analyze_comments(comments, batch_size=batch_size))
+    run_stats = {}
+    try:
+        results = await analyze_comments(
+            comments, concurrency=concurrency, client=client, cache=cache, mode=mode, pack_size=pack_size,
+            batch_transport=batch_transport, limiter=limiter, prefilter=prefilter, stats=run_stats,
+            checkpoint=checkpoint)
+        analysis = save_analysis(username, previous_results + results, run_stats)
+        if checkpoint is not None:
+            checkpoint.clear()
+    finally:
+        if own_cache:
+            cache.close()
+        if checkpoint is not None:
+            # Keeps the chunks of a failed run for the next one, but lets other runs of the user take the lock
+            checkpoint.close()
+    return analysis
+
+
+def load_posts(username: str) -> list[dict]:
+    """Scraped posts of a user from the result store, or from the latest all-user-posts JSON file."""
+    with ResultStore() as store:
+        if store.has_user(username):
+            return store.load_posts(username)
+    posts_file = get_latest_file(username, "all-user-posts")
+    return read_json(posts_file)['posts_all']
+
+
+def load_previous_results(username: str) -> CommentResults:
+    """Successful classifications stored by the previous run; empty if there is none."""
+    with ResultStore() as store:
+        analysis = store.load_analysis(username)
+    if analysis is None:
+        analysis_file = output_dir / f"analysis_{username}.json"
+        if not analysis_file.exists():
+            return CommentResults()
+        analysis = read_json(analysis_file)
+    return CommentResults.from_dicts(
+        result for result in analysis['llm_results'] if result.get('sentiment') is not None)
+
+
+def save_analysis(username: str, results: CommentResults, run_stats: dict) -> dict:
+    """
+    Calculates the metrics and writes analysis_{username}.json.
 
+    :return: The analysis data, with the compact results under 'llm_results'.
+    """
     # Calculate metrics
     metrics = calculate_metrics(results)
 
@@ -45,9 +148,14 @@ def main(username: str, batch_size: int = 30):
         "username": username,
         "metrics": metrics,
         "llm_results": results,
+        "run_stats": run_stats,
         "timestamp": datetime.now().isoformat()
     }
 
-    # Save analysis data to JSON
-    output_dir.joinpath(f"analysis_{username}.json").write_text(
-        json.dumps(analysis, indent=2, ensure_ascii=False), encoding='utf-8')
+    # Save analysis data to the result store and to JSON
+    with ResultStore() as store:
+        run_id = store.append_run(username, metrics, run_stats, analysis['timestamp'])
+        store.upsert_classifications(username, results, run_id)
+    # The results are streamed into the file entry by entry
+    write_json(output_dir / f"analysis_{username}.json", analysis)
+    return analysis
@@ -1,48 +1,131 @@
 from pathlib import Path
-import json
 from datetime import datetime
+from typing import Optional
 from src.innorep.scrape import instagram
+from src.innorep.serialization import read_json, write_json
+from src.innorep.storage import ResultStore
 
 output = Path(__file__).parent / "scrape_results"
 output.mkdir(exist_ok=True)
 
 
-async def scrape(username: str, posts_max_pages: int = 3):
+def save_user(username: str, user_info: dict, timestamp: str, pretty: bool = False):
+    with ResultStore() as store:
+        store.upsert_user(username, user_info, timestamp)
+    write_json(
+        output / f"user_{username}.json",
+        {
+            "user_info": user_info,
+            "username": username,
+            "timestamp": timestamp,
+        },
+        pretty=pretty
+    )
+
+
+def save_posts(username: str, posts_all: list[dict], timestamp: str, pretty: bool = False):
+    with ResultStore() as store:
+        store.upsert_posts(username, posts_all, timestamp)
+    # The posts are written one at a time
+    write_json(
+        output / f"all-user-posts_{username}.json",
+        {
+            "posts_all": posts_all,
+            "username": username,
+            "timestamp": timestamp,
+        },
+        pretty=pretty
+    )
+
+
+def load_previous_scrape(username: str) -> tuple[list[dict], dict]:
+    """Loads the stored posts and the incremental scrape state of a user, or empty ones if there are none."""
+    posts_file = output / f"all-user-posts_{username}.json"
+    state_file = output / f"state_{username}.json"
+    with ResultStore() as store:
+        if store.has_user(username):
+            posts_all = store.load_posts(username)
+        elif posts_file.exists():
+            posts_all = read_json(posts_file)["posts_all"]
+        else:
+            posts_all = []
+    state = read_json(state_file) if state_file.exists() else {}
+    return posts_all, state
+
+
+def save_state(username: str, posts_all: list[dict], timestamp: str):
+    """Records the newest post for the next incremental run."""
+    newest = max(posts_all, key=lambda post: post.get('taken_at') or 0, default=None)
+    write_json(
+        output / f"state_{username}.json",
+        {
+            "username": username,
+            "last_post_id": newest['id'] if newest else None,
+            "last_taken_at": newest.get('taken_at') if newest else None,
+            "timestamp": timestamp,
+        }
+    )
+
+
+def merge_posts(previous_posts: list[dict], scraped_posts: list[dict]) -> tuple[list[dict], list[dict]]:
+    """
+    Merges freshly scraped posts into the stored ones. Fresh post fields win, comments are merged by id.
+
+    :return: The merged posts, newest first, and the comments that were not stored before.
+    """
+    merged = {post['id']: post for post in previous_posts}
+    new_comments = []
+    for post in scraped_posts:
+        previous = merged.get(post['id'])
+        known = {comment['id']: comment for comment in (previous or {}).get('comments') or []}
+        fresh = [comment for comment in post.get('comments') or [] if comment['id'] not in known]
+        new_comments.extend(fresh)
+        merged[post['id']] = {**post, 'comments': list(known.values()) + fresh}
+    posts_all = sorted(merged.values(), key=lambda post: post.get('taken_at') or 0, reverse=True)
+    return posts_all, new_comments
+
+
+def configure_scrapfly():
     # enable scrapfly cache?
     instagram.BASE_CONFIG["cache"] = True
     instagram.BASE_CONFIG["debug"] = True
 
+
+async def scrape(
+    username: str,
+    posts_max_pages: int = 3,
+    max_comments: Optional[int] = 100,
+    concurrency: int = 4,
+    incremental: bool = False
+) -> None:
+    """
+    Scrapes a profile into user_{username}.json and all-user-posts_{username}.json.
+
+    In incremental mode, pagination stops at posts and comments stored by the previous run and the new ones are
+    merged into the stored dataset.
+    """
+    configure_scrapfly()
+
     print("running Instagram scrape and saving results to ./scrape_results directory")
     timestamp = datetime.now().isoformat()
 
     user_info = await instagram.scrape_user(username)
-    output.joinpath(f"user_{username}.json").write_text(
-        json.dumps(
-            {
-                "user_info": user_info,
-                "username": username,
-                "timestamp": timestamp,
-            },
-            indent=2,
-            ensure_ascii=False
-        ),
-        encoding='utf-8'
-    )
+    save_user(username, user_info, timestamp)
     user_id = user_info['id']
 
-    posts_all = []
-    async for post in instagram.scrape_user_posts(user_id, max_pages=posts_max_pages):
-        posts_all.append(post)
-    output.joinpath(f"all-user-posts_{username}.json").write_text(
-        json.dumps(
-            {
-                "posts_all": posts_all,
-                "username": username,
-                "timestamp": timestamp,
-
-            },
-            indent=2,
-            ensure_ascii=False
-        ),
-        encoding='utf-8'
-    )
+    previous_posts, state = load_previous_scrape(username) if incremental else ([], {})
+    known_comment_ids = {
+        post['id']: {comment['id'] for comment in post.get('comments') or []} for post in previous_posts
+    }
+
+    scraped_posts = []
+    async for post in instagram.scrape_user_posts(
+            user_id, max_pages=posts_max_pages, max_comments=max_comments, concurrency=concurrency,
+            since=state.get('last_taken_at'), known_comment_ids=known_comment_ids):
+        scraped_posts.append(post)
+
+    posts_all, new_comments = merge_posts(previous_posts, scraped_posts)
+    if incremental:
+        print(f"{len(scraped_posts)} posts re-scraped, {len(new_comments)} new comments")
+    save_posts(username, posts_all, timestamp)
+    save_state(username, posts_all, timestamp)
@@ -5,16 +5,21 @@ https://scrapfly.io/blog/how-to-scrape-instagram/
 To run this scraper set env variable $SCRAPFLY_KEY with your scrapfly API key:
 $ export $SCRAPFLY_KEY="your key from https://scrapfly.io/dashboard"
 """
+import os
 import json
-from typing import Dict, Optional
+import asyncio
+from typing import AsyncIterator, Callable, Dict, List, Optional, Set
 from urllib.parse import quote
 
 import jmespath
-import streamlit as st
 from loguru import logger as log
 from scrapfly import ScrapeConfig, ScrapflyClient
 
-SCRAPFLY = ScrapflyClient(key=st.secrets["SCRAPFLY_KEY"])
+from src.innorep import serialization
+from src.innorep.instrumentation import span
+
+# Created on first use by get_scrapfly(), so importing this module needs no API key
+SCRAPFLY: Optional[ScrapflyClient] = None
 BASE_CONFIG = {
     # Instagram.com requires Anti Scraping Protection bypass feature.
     # for more: https://scrapfly.io/docs/scrape-api/anti-scraping-protection
@@ -22,13 +27,25 @@ BASE_CONFIG = {
     "country": "CA",  # change country for relevant results
 }
 INSTAGRAM_APP_ID = "936619743392459"  # this is the public app id for instagram.com
+POSTS_URL = "https://www.instagram.com/graphql/query/?query_hash=e769aa130647d2354c40ea6a439bfc08&variables="
+COMMENTS_URL = "https://www.instagram.com/graphql/query/?query_hash=bc3296d1ce80a24b1b6e40b1e72903f5&variables="
 
 
-def parse_user(data: Dict) -> Dict:
-    """Reduce the user data to the relevant fields"""
-    log.debug("parsing user data {}", data["username"])
-    result = jmespath.search(
-        """{
+def get_scrapfly() -> ScrapflyClient:
+    """The Scrapfly client, created on first use from the SCRAPFLY_KEY environment variable."""
+    global SCRAPFLY
+    if SCRAPFLY is None:
+        key = os.environ.get("SCRAPFLY_KEY")
+        if not key:
+            raise RuntimeError("SCRAPFLY_KEY is not set")
+        SCRAPFLY = ScrapflyClient(key=key)
+    return SCRAPFLY
+
+
+# jmespath expressions, compiled once. The post and comment ones are the reference for the hand-written
+# extractors below, which give the same result without walking the expression tree for every post
+USER_EXPRESSION = jmespath.compile(
+    """{
         name: full_name,
         username: username,
         id: id,
@@ -83,71 +100,10 @@ def parse_user(data: Dict) -> Dict:
         saved_count: edge_saved_media.count,
         collections_count: edge_saved_media.count,
         related_profiles: edge_related_profiles.edges[].node.username
-    }""",
-        data,
-    )
-    return result
-
-
-async def scrape_user(username: str) -> Dict:
-    """Scrape instagram user's data"""
-    log.info("scraping instagram user {}", username)
-    result = await SCRAPFLY.async_scrape(
-        ScrapeConfig(
-            url=f"https://i.instagram.com/api/v1/users/web_profile_info/?username={username}",
-            headers={"x-ig-app-id": INSTAGRAM_APP_ID},
-            **BASE_CONFIG,
-        )
-    )
-    data = json.loads(result.content)
-    return parse_user(data["data"]["user"])
-
-
-def parse_comments(data: Dict) -> Dict:
-    """Parse the comments data from the post dataset"""
-    if "edge_media_to_comment" in data:
-        return jmespath.search(
-            """{
-                comments_count: edge_media_to_comment.count,
-                comments_disabled: comments_disabled,
-                comments_next_page: edge_media_to_comment.page_info.end_cursor,
-                comments: edge_media_to_comment.edges[].node.{
-                    id: id,
-                    text: text,
-                    created_at: created_at,
-                    owner_id: owner.id,
-                    owner: owner.username,
-                    owner_verified: owner.is_verified,
-                    viewer_has_liked: viewer_has_liked
-                }
-            }""",
-            data,
-        )
-    else:
-        return jmespath.search(
-            """{
-                comments_count: edge_media_to_parent_comment.count,
-                comments_disabled: comments_disabled,
-                comments_next_page: edge_media_to_parent_comment.page_info.end_cursor,
-                comments: edge_media_to_parent_comment.edges[].node.{
-                    id: id,
-                    text: text,
-                    created_at: created_at,
-                    owner: owner.username,
-                    owner_verified: owner.is_verified,
-                    viewer_has_liked: viewer_has_liked,
-                    likes: edge_liked_by.count
-                }
-            }""",
-            data,
-        )
-
-
-def parse_post(data: Dict) -> Dict:
-    """Reduce post dataset to the most important fields"""
-    log.debug("parsing post data {}", data["shortcode"])
-    result = jmespath.search(
-        """{
+    }"""
+)
+POST_EXPRESSION = jmespath.compile(
+    """{
         id: id,
         shortcode: shortcode,
         dimensions: dimensions,
@@ -167,10 +123,179 @@ def parse_post(data: Dict) -> Dict:
         tagged_users: edge_media_to_tagged_user.edges[].node.user.username,
         captions: edge_media_to_caption.edges[].node.text,
         related_profiles: edge_related_profiles.edges[].node.username
-    }""",
-        data,
-    )
-    comments_data = parse_comments(data)
+    }"""
+)
+COMMENTS_EXPRESSION = jmespath.compile(
+    """{
+        comments_count: edge_media_to_comment.count,
+        comments_disabled: comments_disabled,
+        comments_next_page: edge_media_to_comment.page_info.end_cursor,
+        comments: edge_media_to_comment.edges[].node.{
+            id: id,
+            text: text,
+            created_at: created_at,
+            owner_id: owner.id,
+            owner: owner.username,
+            owner_verified: owner.is_verified,
+            viewer_has_liked: viewer_has_liked
+        }
+    }"""
+)
+PARENT_COMMENTS_EXPRESSION = jmespath.compile(
+    """{
+        comments_count: edge_media_to_parent_comment.count,
+        comments_disabled: comments_disabled,
+        comments_next_page: edge_media_to_parent_comment.page_info.end_cursor,
+        comments: edge_media_to_parent_comment.edges[].node.{
+            id: id,
+            text: text,
+            created_at: created_at,
+            owner: owner.username,
+            owner_verified: owner.is_verified,
+            viewer_has_liked: viewer_has_liked,
+            likes: edge_liked_by.count
+        }
+    }"""
+)
+
+
+def parse_user(data: Dict) -> Dict:
+    """Reduce the user data to the relevant fields"""
+    log.debug("parsing user data {}", data["username"])
+    return USER_EXPRESSION.search(data)
+
+
+async def scrape_user(username: str) -> Dict:
+    """Scrape instagram user's data"""
+    log.info("scraping instagram user {}", username)
+    with span("scrape_user"):
+        result = await get_scrapfly().async_scrape(
+            ScrapeConfig(
+                url=f"https://i.instagram.com/api/v1/users/web_profile_info/?username={username}",
+                headers={"x-ig-app-id": INSTAGRAM_APP_ID},
+                **BASE_CONFIG,
+            )
+        )
+        data = serialization.loads(result.content)
+        return parse_user(data["data"]["user"])
+
+
+def _get(data, *path):
+    """Follows a path of keys like a jmespath field expression: None as soon as a value is not an object."""
+    for key in path:
+        if not isinstance(data, dict):
+            return None
+        data = data.get(key)
+    return data
+
+
+def _project(items, extract: Callable) -> Optional[List]:
+    """
+    A jmespath `list[].expression` projection: the list is flattened one level, `extract` is applied to every
+    element and None results are dropped. None if `items` is not a list.
+    """
+    if not isinstance(items, list):
+        return None
+    result = []
+    for item in items:
+        for element in item if isinstance(item, list) else (item,):
+            value = extract(element)
+            if value is not None:
+                result.append(value)
+    return result
+
+
+def _comment(edge) -> Optional[Dict]:
+    node = _get(edge, "node")
+    if node is None:
+        return None
+    return {
+        "id": _get(node, "id"),
+        "text": _get(node, "text"),
+        "created_at": _get(node, "created_at"),
+        "owner_id": _get(node, "owner", "id"),
+        "owner": _get(node, "owner", "username"),
+        "owner_verified": _get(node, "owner", "is_verified"),
+        "viewer_has_liked": _get(node, "viewer_has_liked"),
+    }
+
+
+def _parent_comment(edge) -> Optional[Dict]:
+    node = _get(edge, "node")
+    if node is None:
+        return None
+    return {
+        "id": _get(node, "id"),
+        "text": _get(node, "text"),
+        "created_at": _get(node, "created_at"),
+        "owner": _get(node, "owner", "username"),
+        "owner_verified": _get(node, "owner", "is_verified"),
+        "viewer_has_liked": _get(node, "viewer_has_liked"),
+        "likes": _get(node, "edge_liked_by", "count"),
+    }
+
+
+def parse_comments(data: Dict, fast: bool = True) -> Dict:
+    """
+    Parse the comments data from the post dataset
+
+    :param fast: Use the hand-written extractor instead of evaluating the jmespath expression;
+        both give the same result.
+    """
+    if "edge_media_to_comment" in data:
+        if not fast:
+            return COMMENTS_EXPRESSION.search(data)
+        edge, extract = data["edge_media_to_comment"], _comment
+    else:
+        if not fast:
+            return PARENT_COMMENTS_EXPRESSION.search(data)
+        edge, extract = _get(data, "edge_media_to_parent_comment"), _parent_comment
+    return {
+        "comments_count": _get(edge, "count"),
+        "comments_disabled": data.get("comments_disabled"),
+        "comments_next_page": _get(edge, "page_info", "end_cursor"),
+        "comments": _project(_get(edge, "edges"), extract),
+    }
+
+
+def _edge_nodes(data, key: str, *path) -> Optional[List]:
+    """The `key.edges[].node.path` projection."""
+    return _project(_get(data, key, "edges"), lambda edge: _get(edge, "node", *path))
+
+
+def parse_post(data: Dict, fast: bool = True) -> Dict:
+    """
+    Reduce post dataset to the most important fields
+
+    :param fast: Use the hand-written extractors instead of evaluating the jmespath expressions;
+        both give the same result.
+    """
+    log.debug("parsing post data {}", data["shortcode"])
+    if not fast:
+        result = POST_EXPRESSION.search(data)
+    else:
+        result = {
+            "id": data.get("id"),
+            "shortcode": data.get("shortcode"),
+            "dimensions": data.get("dimensions"),
+            "src": data.get("display_url"),
+            "thumbnail_src": data.get("thumbnail_src"),
+            "media_preview": data.get("media_preview"),
+            "video_url": data.get("video_url"),
+            "views": data.get("video_view_count"),
+            "likes": _get(data, "edge_media_preview_like", "count"),
+            "location": _get(data, "location", "name"),
+            "taken_at": data.get("taken_at_timestamp"),
+            "related": _edge_nodes(data, "edge_web_media_to_related_media", "shortcode"),
+            "type": data.get("product_type"),
+            "video_duration": data.get("video_duration"),
+            "music": data.get("clips_music_attribution_info"),
+            "is_video": data.get("is_video"),
+            "tagged_users": _edge_nodes(data, "edge_media_to_tagged_user", "user", "username"),
+            "captions": _edge_nodes(data, "edge_media_to_caption", "text"),
+            "related_profiles": _edge_nodes(data, "edge_related_profiles", "username"),
+        }
+    comments_data = parse_comments(data, fast=fast)
     result.update(comments_data)
 
     return result
@@ -193,20 +318,71 @@ async def scrape_post(url_or_shortcode: str) -> Dict:
     }
     url = "https://www.instagram.com/graphql/query/?query_hash=b3055c01b4b222b8a47dc12b090e4e64&variables="
     print(url + quote(json.dumps(variables)))
-    result = await SCRAPFLY.async_scrape(
+    result = await get_scrapfly().async_scrape(
         ScrapeConfig(
             url=url + quote(json.dumps(variables)),
             headers={"x-ig-app-id": INSTAGRAM_APP_ID},
             **BASE_CONFIG,
         )
     )
-    data = json.loads(result.content)
+    data = serialization.loads(result.content)
     return parse_post(data["data"]["shortcode_media"])
 
 
-async def scrape_user_posts(user_id: str, page_size=24, max_pages: Optional[int] = None):
-    """Scrape all posts of an instagram user of given numeric user id"""
-    base_url = "https://www.instagram.com/graphql/query/?query_hash=e769aa130647d2354c40ea6a439bfc08&variables="
+async def scrape_post_comments(
+    post: Dict,
+    max_comments: Optional[int] = None,
+    page_size: int = 50,
+    known_ids: Optional[Set[str]] = None,
+) -> Dict:
+    """
+    Follow the comment pages of a parsed post until max_comments or the last page, adding them to the post.
+    With known_ids (comments scraped by an earlier run) it stops at the first page that reaches known comments.
+    If a page fails, the error is raised with the comments of the pages before it already added to the post.
+    """
+    comments = list(post.get("comments") or [])
+    seen = {comment["id"] for comment in comments}
+    known_ids = known_ids or set()
+    cursor = post.get("comments_next_page")
+    reached_known = bool(seen & known_ids)
+    try:
+        while cursor and not reached_known and (max_comments is None or len(comments) < max_comments):
+            variables = {"shortcode": post["shortcode"], "first": page_size, "after": cursor}
+            with span("scrape_comments_page") as page_span:
+                result = await get_scrapfly().async_scrape(
+                    ScrapeConfig(COMMENTS_URL + quote(json.dumps(variables)), headers={"x-ig-app-id": INSTAGRAM_APP_ID},
+                                 **BASE_CONFIG)
+                )
+                data = serialization.loads(result.content)
+                page = parse_comments(data["data"]["shortcode_media"])
+                page_span["comments"] = len(page["comments"] or [])
+            for comment in page["comments"] or []:
+                reached_known = reached_known or comment["id"] in known_ids
+                if comment["id"] not in seen:
+                    seen.add(comment["id"])
+                    comments.append(comment)
+            if page["comments_next_page"] == cursor:
+                break
+            cursor = page["comments_next_page"]
+    finally:
+        # Also on a failed page: the post keeps the comments gathered so far and the cursor of the failed page
+        if max_comments is not None:
+            comments = comments[:max_comments]
+        post["comments"] = comments
+        post["comments_next_page"] = cursor
+    log.debug("scraped {} comments of post {}", len(comments), post["shortcode"])
+    return post
+
+
+async def _scrape_post_pages(
+    user_id: str, page_size: int, max_pages: Optional[int], since: Optional[int] = None
+) -> AsyncIterator[Dict]:
+    """
+    Scrape the timeline pages of an instagram user one after another, yielding parsed posts.
+    With since (a taken_at timestamp) pagination stops after the first page that ends with a post that old.
+    Only the last post of a page counts: pinned posts come first on the first page whatever their age, so an old
+    pinned post does not end the scrape before the new posts below it are read.
+    """
     variables = {
         "id": user_id,
         "first": page_size,
@@ -214,17 +390,24 @@ async def scrape_user_posts(user_id: str, page_size=24, max_pages: Optional[int]
     }
     _page_number = 1
     while True:
-        url = base_url + quote(json.dumps(variables))
-        result = await SCRAPFLY.async_scrape(ScrapeConfig(url, **BASE_CONFIG))
-        data = json.loads(result.content)
-        posts = data["data"]["user"]["edge_owner_to_timeline_media"]
-        for post in posts["edges"]:
-            yield parse_post(post["node"])
+        url = POSTS_URL + quote(json.dumps(variables))
+        # The page span covers fetching and parsing, not the consumer's work between the yields
+        with span("scrape_posts_page", page=_page_number):
+            result = await get_scrapfly().async_scrape(ScrapeConfig(url, **BASE_CONFIG))
+            data = serialization.loads(result.content)
+            posts = data["data"]["user"]["edge_owner_to_timeline_media"]
+            parsed_posts = [parse_post(post["node"]) for post in posts["edges"]]
+        reached_known = since is not None and bool(parsed_posts) and (parsed_posts[-1]["taken_at"] or 0) <= since
+        for parsed in parsed_posts:
+            yield parsed
         page_info = posts["page_info"]
         if _page_number == 1:
             log.info(f"scraping total {posts['count']} posts of {user_id}")
         else:
             log.info(f"scraping posts page {_page_number}")
+        if reached_known:
+            log.info("reached posts scraped by an earlier run, stopping at page {}", _page_number)
+            break
         if not page_info["has_next_page"]:
             break
         if variables["after"] == page_info["end_cursor"]:
@@ -233,3 +416,52 @@ async def scrape_user_posts(user_id: str, page_size=24, max_pages: Optional[int]
         _page_number += 1
         if max_pages and _page_number > max_pages:
             break
+
+
+async def scrape_user_posts(
+    user_id: str,
+    page_size=24,
+    max_pages: Optional[int] = None,
+    max_comments: Optional[int] = 100,
+    concurrency: int = 4,
+    since: Optional[int] = None,
+    known_comment_ids: Optional[Dict[str, Set[str]]] = None,
+):
+    """
+    Scrape all posts of an instagram user of given numeric user id.
+
+    Deeper comment pages of each post are fetched concurrently, up to `concurrency` requests at a time,
+    while post pagination continues. Posts are yielded as soon as their comments are complete, so the
+    order follows completion rather than the timeline. max_comments caps the comments kept per post
+    (None for no cap, 0 to keep only the comments embedded in the timeline page).
+
+    For incremental runs, since stops post pagination at posts taken at or before that timestamp and
+    known_comment_ids (post id -> comment ids) stops comment pagination at comments already scraped.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def complete_comments(post: Dict) -> Dict:
+        if max_comments == 0 or not post.get("comments_next_page"):
+            return post
+        async with semaphore:
+            try:
+                return await scrape_post_comments(
+                    post, max_comments=max_comments, known_ids=(known_comment_ids or {}).get(post["id"]))
+            except Exception as e:
+                # scrape_post_comments has added the pages fetched before the error: keep them and the post
+                log.warning("failed to scrape comments of post {} after {} comments: {}",
+                            post["shortcode"], len(post.get("comments") or []), e)
+                return post
+
+    pending = set()
+    try:
+        async for post in _scrape_post_pages(user_id, page_size, max_pages, since=since):
+            pending.add(asyncio.create_task(complete_comments(post)))
+            for task in [task for task in pending if task.done()]:
+                pending.discard(task)
+                yield task.result()
+        for task in asyncio.as_completed(pending):
+            yield await task
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,134 @@
+"""
+JSON encoding and decoding of the scrape and analysis files and of the Scrapfly responses.
+
+The fastest installed backend is used: orjson, then msgspec, then the standard library. Set INNOREP_JSON_BACKEND
+to "orjson", "msgspec" or "json" to choose one, or call `set_backend`. All backends write UTF-8 without escaping
+non-ASCII characters. Output is compact unless `pretty` is set, which indents by two spaces.
+"""
+import os
+import json
+from pathlib import Path
+from typing import Any, Callable, Union
+
+
+def _json_backend() -> tuple[Callable, Callable]:
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        separators = None if pretty else (",", ":")
+        return json.dumps(obj, indent=2 if pretty else None, separators=separators, ensure_ascii=False,
+                          default=_default).encode('utf-8')
+
+    return dumps, json.loads
+
+
+def _orjson_backend() -> tuple[Callable, Callable]:
+    import orjson
+
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        return orjson.dumps(obj, default=_default, option=orjson.OPT_INDENT_2 if pretty else 0)
+
+    return dumps, orjson.loads
+
+
+def _msgspec_backend() -> tuple[Callable, Callable]:
+    import msgspec
+
+    encoder = msgspec.json.Encoder(enc_hook=_default)
+    decoder = msgspec.json.Decoder()
+
+    def dumps(obj: Any, pretty: bool = False) -> bytes:
+        data = encoder.encode(obj)
+        return msgspec.json.format(data, indent=2) if pretty else data
+
+    return dumps, decoder.decode
+
+
+BACKENDS = {"orjson": _orjson_backend, "msgspec": _msgspec_backend, "json": _json_backend}
+
+backend = None
+_dumps = None
+_loads = None
+
+
+def _default(obj: Any) -> Any:
+    """Encodes values the backends do not know: enum members by value, numpy scalars, other iterables as lists."""
+    value = getattr(obj, 'value', None)
+    if isinstance(value, (str, int, float)):
+        return value
+    if hasattr(obj, 'item') and not hasattr(obj, '__len__'):
+        return obj.item()
+    if hasattr(obj, '__iter__'):
+        return list(obj)
+    raise TypeError(f"Object of type {type(obj).__name__} is not JSON serializable")
+
+
+def set_backend(name: str = None) -> str:
+    """
+    Selects the JSON backend.
+
+    :param name: "orjson", "msgspec" or "json"; None picks the fastest installed one.
+
+    :return: The name of the selected backend.
+    """
+    global backend, _dumps, _loads
+    candidates = [name] if name else list(BACKENDS)
+    for candidate in candidates:
+        try:
+            _dumps, _loads = BACKENDS[candidate]()
+        except ImportError:
+            if name:
+                raise
+            continue
+        backend = candidate
+        return backend
+
+
+set_backend(os.environ.get("INNOREP_JSON_BACKEND") or None)
+
+
+def dumps(obj: Any, pretty: bool = False) -> bytes:
+    """Encodes an object to UTF-8 JSON."""
+    return _dumps(obj, pretty)
+
+
+def loads(data: Union[str, bytes]) -> Any:
+    """Decodes JSON text or bytes."""
+    return _loads(data)
+
+
+def read_json(path: Path) -> Any:
+    return _loads(Path(path).read_bytes())
+
+
+def _streamed(value: Any) -> bool:
+    """Top-level values written item by item: lists and other iterables such as CommentResults."""
+    return (isinstance(value, (list, tuple)) or hasattr(value, '__iter__')) and not isinstance(
+        value, (str, bytes, dict))
+
+
+def write_json(path: Path, obj: dict, pretty: bool = False) -> None:
+    """
+    Writes a JSON object to a file.
+
+    Lists and iterables at the top level are encoded and written one item at a time, so a large posts or results
+    array never exists as one encoded string. The file is written to a temporary name and then renamed, so readers
+    never see half a file.
+    """
+    path = Path(path)
+    temp_path = path.with_name(f".{path.name}.tmp")
+    newline, indent = (b"\n", b"  ") if pretty else (b"", b"")
+    with open(temp_path, 'wb') as f:
+        f.write(b"{")
+        for index, (key, value) in enumerate(obj.items()):
+            f.write((b"," if index else b"") + newline + indent + _dumps(str(key)) + (b": " if pretty else b":"))
+            if not _streamed(value):
+                f.write(_dumps(value, pretty).replace(b"\n", newline + indent))
+                continue
+            f.write(b"[")
+            empty = True
+            for item_index, item in enumerate(value):
+                item_json = _dumps(item, pretty).replace(b"\n", newline + indent * 2)
+                f.write((b"," if item_index else b"") + newline + indent * 2 + item_json)
+                empty = False
+            f.write(b"]" if empty else newline + indent + b"]")
+        f.write(newline + b"}")
+    os.replace(temp_path, path)
@@ -0,0 +1,261 @@
+import sqlite3
+from pathlib import Path
+from typing import TYPE_CHECKING, Optional
+
+from src.innorep.serialization import dumps, loads, read_json
+
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+default_path = Path(__file__).parent / "results" / "innorep.sqlite"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    user_id TEXT,
+    info TEXT NOT NULL,
+    timestamp TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS posts (
+    id TEXT PRIMARY KEY,
+    username TEXT NOT NULL,
+    shortcode TEXT,
+    taken_at INTEGER,
+    data TEXT NOT NULL,
+    scraped_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_posts_username_taken_at ON posts (username, taken_at);
+CREATE TABLE IF NOT EXISTS comments (
+    id TEXT PRIMARY KEY,
+    post_id TEXT NOT NULL,
+    username TEXT NOT NULL,
+    text TEXT,
+    created_at INTEGER,
+    data TEXT NOT NULL,
+    scraped_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_comments_username_created_at ON comments (username, created_at);
+CREATE INDEX IF NOT EXISTS idx_comments_post_id ON comments (post_id);
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    username TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    metrics TEXT NOT NULL,
+    run_stats TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_runs_username ON runs (username, id);
+CREATE TABLE IF NOT EXISTS classifications (
+    username TEXT NOT NULL,
+    comment_id TEXT NOT NULL,
+    created_at INTEGER,
+    comment TEXT,
+    sentiment TEXT,
+    spam TEXT,
+    source TEXT,
+    error TEXT,
+    run_id INTEGER,
+    rule TEXT,
+    PRIMARY KEY (username, comment_id)
+);
+CREATE INDEX IF NOT EXISTS idx_classifications_username_created_at ON classifications (username, created_at);
+"""
+
+# Columns added after the first version of the tables, created on tables that lack them
+_ADDED_COLUMNS = (
+    ("posts", "scraped_at", "TEXT"), ("comments", "scraped_at", "TEXT"), ("classifications", "rule", "TEXT"))
+
+CLASSIFICATION_COLUMNS = ['id', 'created_at', 'comment', 'sentiment', 'spam', 'source', 'error', 'rule']
+
+
+def _text(obj) -> str:
+    return dumps(obj).decode('utf-8')
+
+
+def _value(value):
+    """Enum members are stored by value."""
+    return getattr(value, 'value', value)
+
+
+class ResultStore:
+    """
+    SQLite store for scraped users, posts and comments, classifications and analysis runs.
+
+    Rows are upserted by id, so repeated and incremental runs update the same data instead of rewriting
+    whole documents, and every analysis run is kept in the runs table.
+    """
+
+    def __init__(self, path: Path = default_path, read_only: bool = False):
+        """
+        :param read_only: Open an existing store for reading only, without creating the file or the schema.
+        """
+        self.path = Path(path)
+        if read_only:
+            self._conn = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+            return
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(self.path)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        for table, name, column_type in _ADDED_COLUMNS:
+            if name not in {row[1] for row in self._conn.execute(f"PRAGMA table_info({table})")}:
+                self._conn.execute(f"ALTER TABLE {table} ADD COLUMN {name} {column_type}")
+
+    def upsert_user(self, username: str, user_info: dict, timestamp: str) -> None:
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO users (username, user_id, info, timestamp) VALUES (?, ?, ?, ?)",
+                (username, user_info.get('id'), _text(user_info), timestamp),
+            )
+
+    def upsert_posts(self, username: str, posts: list[dict], timestamp: Optional[str] = None) -> None:
+        """
+        Upserts posts and their comments. Posts are stored without the comments list, which goes to its table.
+
+        :param timestamp: The time of the scrape that produced the posts (ISO format), which marks them as its dataset.
+        """
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO posts (id, username, shortcode, taken_at, data, scraped_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (post['id'], username, post.get('shortcode'), post.get('taken_at'),
+                     _text({k: v for k, v in post.items() if k != 'comments'}), timestamp)
+                    for post in posts
+                ],
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO comments (id, post_id, username, text, created_at, data, scraped_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (comment['id'], post['id'], username, comment.get('text'), comment.get('created_at'),
+                     _text(comment), timestamp)
+                    for post in posts for comment in post.get('comments') or []
+                ],
+            )
+
+    def append_run(self, username: str, metrics: dict, run_stats: dict, timestamp: str) -> int:
+        """Records one analysis run and returns its id."""
+        with self._conn:
+            cursor = self._conn.execute(
+                "INSERT INTO runs (username, timestamp, metrics, run_stats) VALUES (?, ?, ?, ?)",
+                (username, timestamp, _text(metrics), _text(run_stats)),
+            )
+        return cursor.lastrowid
+
+    def upsert_classifications(self, username: str, results: list[dict], run_id: Optional[int] = None) -> None:
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO classifications "
+                "(username, comment_id, created_at, comment, sentiment, spam, source, error, rule, run_id) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [
+                    (username, result['id'], result['created_at'], result['comment'], _value(result['sentiment']),
+                     _value(result['spam']), result.get('source'), result.get('error'),
+                     result.get('rule'), run_id)
+                    for result in results
+                ],
+            )
+
+    def has_user(self, username: str) -> bool:
+        return self._conn.execute("SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+    def load_posts(self, username: str) -> list[dict]:
+        """
+        Posts of the latest scrape of a user, newest first, with their comments, in the all-user-posts JSON layout.
+
+        The store keeps the posts of every scrape; like the all-user-posts file, this returns only the dataset the
+        latest scrape saved (for an incremental scrape, the merged one). Rows stored without a scrape time, by
+        versions before it was recorded, are all returned when there is nothing newer.
+        """
+        latest = self._conn.execute(
+            "SELECT MAX(scraped_at) FROM posts WHERE username = ?", (username,)).fetchone()[0]
+        scrape_filter, parameters = ("", (username,)) if latest is None else ("AND scraped_at = ?", (username, latest))
+        comments = {}
+        for post_id, data in self._conn.execute(
+                f"SELECT post_id, data FROM comments WHERE username = ? {scrape_filter} ORDER BY created_at",
+                parameters):
+            comments.setdefault(post_id, []).append(loads(data))
+        posts = []
+        for post_id, data in self._conn.execute(
+                f"SELECT id, data FROM posts WHERE username = ? {scrape_filter} ORDER BY taken_at DESC", parameters):
+            post = loads(data)
+            post['comments'] = comments.get(post_id, [])
+            posts.append(post)
+        return posts
+
+    def latest_run_id(self, username: str) -> Optional[int]:
+        row = self._conn.execute(
+            "SELECT id FROM runs WHERE username = ? ORDER BY id DESC LIMIT 1", (username,)).fetchone()
+        return row[0] if row is not None else None
+
+    def classifications_frame(self, username: str, run_id: Optional[int] = None) -> "pd.DataFrame":
+        """
+        Classifications of a user as a DataFrame with the llm_results columns, read column-wise from SQLite.
+
+        :param run_id: Only the classifications saved by this run; every run saves all results it reports, so
+            rows of comments an earlier run saw but the latest did not are left out.
+        """
+        import pandas as pd
+
+        query = ("SELECT comment_id AS id, created_at, comment, sentiment, spam, source, error, rule "
+                 "FROM classifications WHERE username = ?")
+        params = (username,)
+        if run_id is not None:
+            query += " AND run_id = ?"
+            params += (run_id,)
+        return pd.read_sql_query(query + " ORDER BY created_at", self._conn, params=params)
+
+    def load_analysis(self, username: str, as_frame: bool = False) -> Optional[dict]:
+        """
+        The latest analysis of a user in the analysis_{username}.json layout, or None if there is none.
+
+        :param as_frame: Return llm_results as a DataFrame (what analyze/prepare.py consumes) instead of a list of dicts.
+        """
+        run = self._conn.execute(
+            "SELECT id, metrics, run_stats, timestamp FROM runs WHERE username = ? ORDER BY id DESC LIMIT 1",
+            (username,)
+        ).fetchone()
+        if run is None:
+            return None
+        run_id, metrics, run_stats, timestamp = run
+        # The rows of the same run as the metrics, so the report never mixes in stale classifications
+        frame = self.classifications_frame(username, run_id)
+        return {
+            "username": username,
+            "metrics": loads(metrics),
+            "llm_results": frame if as_frame else frame.astype(object).where(frame.notna(), None).to_dict('records'),
+            "run_stats": loads(run_stats),
+            "timestamp": timestamp,
+        }
+
+    def export_parquet(self, username: str, path: Path) -> None:
+        """Writes the classifications of the latest run of a user to a Parquet file (needs pyarrow or fastparquet)."""
+        self.classifications_frame(username, self.latest_run_id(username)).to_parquet(path, index=False)
+
+    def import_json(self, username: str, scrape_dir: Path, analysis_dir: Path) -> None:
+        """Loads the JSON files written by earlier versions (user_, all-user-posts_ and analysis_ files) into the store."""
+        user_file = Path(scrape_dir) / f"user_{username}.json"
+        if user_file.exists():
+            user_data = read_json(user_file)
+            self.upsert_user(username, user_data['user_info'], user_data['timestamp'])
+        posts_file = Path(scrape_dir) / f"all-user-posts_{username}.json"
+        if posts_file.exists():
+            posts_data = read_json(posts_file)
+            self.upsert_posts(username, posts_data['posts_all'], posts_data.get('timestamp'))
+        analysis_file = Path(analysis_dir) / f"analysis_{username}.json"
+        if analysis_file.exists():
+            analysis = read_json(analysis_file)
+            run_id = self.append_run(
+                username, analysis['metrics'], analysis.get('run_stats', {}), analysis['timestamp'])
+            self.upsert_classifications(username, analysis['llm_results'], run_id)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()